@@ -0,0 +1,104 @@
+import re
+import time
+import datetime
+import threading
+
+RATE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+
+def parse_rate(value):
+    """Bytes per second from a number or a string such as "500K" or "2.5M" (None = unlimited)"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if value > 0 else None
+    match = re.fullmatch(r'\s*([0-9.]+)\s*([kKmMgG]?)(?:i?[bB])?(?:/s)?\s*', value)
+    if not match:
+        raise ValueError(f"invalid rate {value!r}")
+    rate = float(match.group(1)) * RATE_UNITS[match.group(2).lower()]
+    return rate if rate > 0 else None
+
+
+def parse_clock(value):
+    """Minutes since midnight for an "HH:MM" string"""
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+class BandwidthScheduler:
+    """Global download bandwidth budget shared by every running job
+
+    The budget is the base limit, or the limit of the first schedule entry
+    whose time window contains the current time, for example
+    {"start": "09:00", "end": "18:00", "limit": "2M"} (windows may wrap past
+    midnight). A limit of None means unlimited.
+
+    In-process downloads draw from one token bucket as data arrives, so
+    running jobs share the budget however many there are. Jobs that run as
+    a separate yt-dlp process can't be throttled from outside; they get an
+    equal share of the budget as their --limit-rate when they start.
+    """
+    def __init__(self, limit=None, schedule=None, burst_seconds=1.0):
+        self.limit = parse_rate(limit)
+        self.schedule = [
+            (parse_clock(entry['start']), parse_clock(entry['end']), parse_rate(entry.get('limit')))
+            for entry in schedule or []
+        ]
+        self.burst_seconds = burst_seconds
+        self._tokens = 0.0
+        self._last_refill = time.monotonic()
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def current_limit(self, now=None):
+        """Bytes per second allowed right now, or None if unlimited"""
+        if self.schedule:
+            now = now or datetime.datetime.now()
+            minute = now.hour * 60 + now.minute
+            for start, end, limit in self.schedule:
+                inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+                if inside:
+                    return limit
+        return self.limit
+
+    def job_started(self):
+        with self._lock:
+            self._active += 1
+
+    def job_finished(self):
+        with self._lock:
+            self._active = max(0, self._active - 1)
+
+    def job_rate_limit(self):
+        """Equal share of the current budget per running job, for engines that can't share a bucket"""
+        limit = self.current_limit()
+        if limit is None:
+            return None
+        with self._lock:
+            return limit / max(1, self._active)
+
+    def consume(self, num_bytes, cancel_token=None):
+        """Take num_bytes from the bucket, sleeping while the budget is overdrawn"""
+        limit = self.current_limit()
+        if limit is None or num_bytes <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(limit * self.burst_seconds, self._tokens + (now - self._last_refill) * limit)
+            self._last_refill = now
+            self._tokens -= num_bytes
+            delay = -self._tokens / limit if self._tokens < 0 else 0
+        if delay > 0:
+            if cancel_token is not None:
+                cancel_token.wait(delay)
+            else:
+                time.sleep(delay)
+
+
+def scheduler_from_settings(settings):
+    """Build the BandwidthScheduler described by the bandwidth settings"""
+    try:
+        return BandwidthScheduler(settings["bandwidth_limit"], settings["bandwidth_schedule"])
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Error in bandwidth settings: {e}")
+        return BandwidthScheduler()
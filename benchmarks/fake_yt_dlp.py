@@ -0,0 +1,211 @@
+"""Stand-in for the yt-dlp command line tool, backed by the benchmark media server
+
+Understands the subset of yt-dlp options the CLI engine and the metadata
+probe use. Video and playlist IDs are taken from ordinary YouTube URLs and
+fetched from the server at $PORYGON_BENCH_SERVER, so the application runs
+unchanged with PORYGON_YTDLP="python benchmarks/fake_yt_dlp.py".
+"""
+import os
+import sys
+import json
+import time
+import urllib.request
+from urllib.parse import urlparse, parse_qs
+
+SERVER = os.environ.get("PORYGON_BENCH_SERVER", "http://127.0.0.1:8000")
+
+# Options that take a value; every other option is a flag
+VALUE_OPTIONS = {
+    '-f', '-o', '--merge-output-format', '--audio-format', '--audio-quality', '--progress-template',
+    '--limit-rate', '--concurrent-fragments', '--load-info-json', '--download-archive',
+}
+
+PROGRESS_INTERVAL = 0.1
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_args(argv):
+    """Split argv into {option: [values]}, a set of flags and the positional URLs"""
+    options, flags, urls = {}, set(), []
+    args = iter(argv)
+    for arg in args:
+        if arg == '--print-to-file':
+            options.setdefault(arg, []).append((next(args), next(args)))
+        elif arg in VALUE_OPTIONS:
+            options.setdefault(arg, []).append(next(args))
+        elif arg.startswith('-'):
+            flags.add(arg)
+        else:
+            urls.append(arg)
+    return options, flags, urls
+
+
+def fetch_json(path):
+    with urllib.request.urlopen(SERVER + path, timeout=30) as response:
+        return json.load(response)
+
+
+def video_id(url):
+    parsed = urlparse(url)
+    query = parse_qs(parsed.query)
+    if 'v' in query:
+        return query['v'][0]
+    return parsed.path.rstrip('/').split('/')[-1]
+
+
+def select_formats(info, selector):
+    """Resolve a format selector the way yt-dlp would for the server's formats"""
+    by_id = {f['format_id']: f for f in info['formats']}
+    for separator in ('+', ','):
+        ids = selector.split(separator)
+        if len(ids) > 1 and all(i in by_id for i in ids):
+            return [by_id[i] for i in ids]
+    if selector in by_id:
+        return [by_id[selector]]
+    if selector.startswith('bestaudio'):
+        return [by_id['140']]
+    if '+' in selector:
+        return [by_id['137'], by_id['140']]
+    return [by_id['18']]
+
+
+def resolve(info, selector, merge_format=None):
+    """Info dict with the selected formats filled in, as printed by -J"""
+    info = dict(info)
+    formats = select_formats(info, selector or 'best')
+    if len(formats) > 1 and '+' in (selector or ''):
+        info['requested_formats'] = formats
+        info['format_id'] = '+'.join(f['format_id'] for f in formats)
+        info['ext'] = merge_format or 'mp4'
+    else:
+        info.update(formats[0])
+    return info
+
+
+def output_name(template, info, ext):
+    fields = dict(info, ext=ext)
+    fields['title'] = fields.get('title', '').replace('/', '_')
+    return template % fields
+
+
+def fetch(url, filename, rate_limit, progress_template, resume):
+    """Download url into filename (through a .part file), printing progress lines"""
+    part = filename + '.part'
+    start = os.path.getsize(part) if resume and os.path.exists(part) else 0
+    request = urllib.request.Request(url, headers={'Range': f"bytes={start}-"} if start else {})
+    began = last_report = time.monotonic()
+    with urllib.request.urlopen(request, timeout=30) as response, open(part, 'ab' if start else 'wb') as f:
+        total = start + int(response.headers.get('Content-Length') or 0)
+        downloaded = start
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            f.write(chunk)
+            downloaded += len(chunk)
+            elapsed = time.monotonic() - began
+            if rate_limit:
+                ahead = (downloaded - start) / rate_limit - elapsed
+                if ahead > 0:
+                    time.sleep(ahead)
+            now = time.monotonic()
+            if progress_template and now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                report(progress_template, 'downloading', downloaded, total, start, now - began, filename)
+    if progress_template:
+        report(progress_template, 'finished', downloaded, total, start, time.monotonic() - began, filename)
+    os.replace(part, filename)
+
+
+def report(template, status, downloaded, total, start, elapsed, filename):
+    speed = (downloaded - start) / elapsed if elapsed > 0 else None
+    progress = {
+        'status': status,
+        'downloaded_bytes': downloaded,
+        'total_bytes': total,
+        'speed': speed,
+        'eta': int((total - downloaded) / speed) if speed else None,
+        'filename': filename,
+    }
+    print(template.replace('%(progress)j', json.dumps(progress)), flush=True)
+
+
+def download(options, flags, urls):
+    if options.get('--load-info-json'):
+        with open(options['--load-info-json'][-1], encoding='utf-8') as f:
+            info = json.load(f)
+    else:
+        info = fetch_json(f"/info/{video_id(urls[0])}")
+    selector = (options.get('-f') or ['best'])[-1]
+    merge_format = (options.get('--merge-output-format') or [None])[-1]
+    template = (options.get('-o') or ['%(title)s.%(ext)s'])[-1]
+    rate_limit = float(options['--limit-rate'][-1]) if options.get('--limit-rate') else None
+    progress_template = next(
+        (t.split(':', 1)[1] for t in options.get('--progress-template', []) if t.startswith('download:')), None
+    )
+    resume = '--continue' in flags
+
+    formats = select_formats(info, selector)
+    written = []
+    if len(formats) > 1 and '+' in selector:
+        # Merge: fetch every stream, then join them into the final file
+        final = output_name(template, info, merge_format or 'mp4')
+        streams = []
+        for f in formats:
+            stream = output_name(template, dict(info, **f), f"f{f['format_id']}.{f['ext']}")
+            fetch(f['url'], stream, rate_limit, progress_template, resume)
+            streams.append(stream)
+        print(f'[Merger] Merging formats into "{final}"', flush=True)
+        with open(final, 'wb') as out:
+            for stream in streams:
+                with open(stream, 'rb') as f:
+                    out.write(f.read())
+                os.remove(stream)
+        written.append(final)
+    else:
+        for f in formats:
+            filename = output_name(template, dict(info, **f), f['ext'])
+            fetch(f['url'], filename, rate_limit, progress_template, resume)
+            if '-x' in flags:
+                codec = (options.get('--audio-format') or ['mp3'])[-1]
+                extracted = os.path.splitext(filename)[0] + '.' + codec
+                print(f'[ExtractAudio] Destination: {extracted}', flush=True)
+                os.replace(filename, extracted)
+                filename = extracted
+            written.append(filename)
+
+    if '--write-thumbnail' in flags and info.get('thumbnail'):
+        thumbnail = os.path.splitext(written[0])[0] + '.jpg'
+        with urllib.request.urlopen(info['thumbnail'], timeout=30) as response, open(thumbnail, 'wb') as f:
+            f.write(response.read())
+        print(f"[info] Writing thumbnail to: {thumbnail}", flush=True)
+
+    for what, path in options.get('--print-to-file', []):
+        if what.split(':')[-1] == 'filepath':
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write("".join(filename + "\n" for filename in written))
+    return 0
+
+
+def main(argv):
+    options, flags, urls = parse_args(argv)
+    try:
+        if '--flat-playlist' in flags:
+            list_id = parse_qs(urlparse(urls[0]).query).get('list', [video_id(urls[0])])[0]
+            for entry in fetch_json(f"/playlist/{list_id}"):
+                print(json.dumps(dict(entry, _type='url', url=entry['id'])), flush=True)
+            return 0
+        if '--dump-single-json' in flags or '-J' in flags:
+            info = fetch_json(f"/info/{video_id(urls[0])}")
+            if options.get('-f'):
+                info = resolve(info, options['-f'][-1], (options.get('--merge-output-format') or [None])[-1])
+            print(json.dumps(info))
+            return 0
+        return download(options, flags, urls)
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,144 @@
+"""Local HTTP server that stands in for YouTube in the benchmarks
+
+    /info/<id>              video metadata (JSON) as the fake yt-dlp reports it
+    /thumb/<id>.jpg         a thumbnail image (a BMP, which QImage decodes by content)
+    /media/<id>/<format>    media bytes for one format
+    /playlist/<list id>     the entries of a playlist (JSON)
+
+Every response waits `latency` seconds first; media is sent at no more than
+`bandwidth` bytes per second per connection.
+"""
+import re
+import json
+import time
+import struct
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Formats offered for every video: a progressive mp4, a video-only and an audio-only stream
+FORMATS = (
+    {'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2', 'height': 360, 'tbr': 500},
+    {'format_id': '137', 'ext': 'mp4', 'vcodec': 'avc1.640028', 'acodec': 'none', 'height': 1080, 'tbr': 4000},
+    {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 128, 'tbr': 128},
+)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def make_bmp(width, height):
+    """An uncompressed 24-bit BMP with a simple gradient"""
+    row_size = (width * 3 + 3) & ~3
+    pixels = bytearray(row_size * height)
+    for y in range(height):
+        row = b"".join(bytes((x * 255 // width, y * 255 // height, 128)) for x in range(width))
+        pixels[y * row_size:y * row_size + len(row)] = row
+    header = struct.pack('<2sIHHI', b'BM', 54 + len(pixels), 0, 0, 54)
+    info = struct.pack('<IiiHHIIiiII', 40, width, height, 1, 24, 0, len(pixels), 2835, 2835, 0, 0)
+    return header + info + bytes(pixels)
+
+
+class MediaServer:
+    """Threaded HTTP server with configurable latency, bandwidth and media size"""
+    def __init__(self, latency=0.0, bandwidth=None, media_size=4 * 1024 * 1024, playlist_size=50,
+                 thumbnail_size=(480, 360)):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.media_size = media_size
+        self.playlist_size = playlist_size
+        self.thumbnail = make_bmp(*thumbnail_size)
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def info(self, video_id):
+        return {
+            'id': video_id,
+            'title': f"Benchmark video {video_id}",
+            'thumbnail': f"{self.url}/thumb/{video_id}.jpg",
+            'duration': 212,
+            'uploader': "Porygon Benchmarks",
+            'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+            'extractor_key': 'Youtube',
+            'formats': [
+                dict(f, url=f"{self.url}/media/{video_id}/{f['format_id']}", filesize=self.media_size)
+                for f in FORMATS
+            ],
+        }
+
+    def handle(self, request):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        parts = request.path.split('?')[0].strip('/').split('/')
+        if parts[0] == 'info' and len(parts) == 2:
+            self.send(request, json.dumps(self.info(parts[1])).encode(), 'application/json')
+        elif parts[0] == 'thumb' and len(parts) == 2:
+            self.send(request, self.thumbnail, 'image/bmp')
+        elif parts[0] == 'playlist' and len(parts) == 2:
+            # Valid 11 character video IDs, distinct per playlist
+            tag = (re.sub(r'[^0-9A-Za-z]', '', parts[1]) + "xxxx")[:4]
+            entries = [
+                {'id': f"{tag}{index:07d}", 'title': f"Entry {index}", 'ie_key': 'Youtube'}
+                for index in range(self.playlist_size)
+            ]
+            self.send(request, json.dumps(entries).encode(), 'application/json')
+        elif parts[0] == 'media' and len(parts) == 3:
+            self.send_media(request)
+        else:
+            request.send_error(404)
+
+    def send(self, request, body, content_type):
+        request.send_response(200)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def send_media(self, request):
+        start = 0
+        range_header = request.headers.get('Range')
+        if range_header and range_header.startswith('bytes='):
+            start = min(int(range_header[len('bytes='):].split('-')[0] or 0), self.media_size)
+        remaining = self.media_size - start
+        request.send_response(206 if start else 200)
+        request.send_header('Content-Type', 'application/octet-stream')
+        request.send_header('Content-Length', str(remaining))
+        request.end_headers()
+        chunk = b"\0" * CHUNK_SIZE
+        began = time.monotonic()
+        sent = 0
+        try:
+            while sent < remaining:
+                size = min(CHUNK_SIZE, remaining - sent)
+                request.wfile.write(chunk[:size])
+                sent += size
+                if self.bandwidth:
+                    # Sleep until the connection is back under its bandwidth
+                    ahead = sent / self.bandwidth - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
@@ -0,0 +1,302 @@
+"""Offline benchmarks for Porygon
+
+Runs the real history store, download queue and (if PyQt6 is installed)
+GUI against a local media server and a fake yt-dlp, so results are
+repeatable without network access. Results are written as JSON.
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --history-sizes 1000 --concurrency 1,4 --skip-gui
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from media_server import MediaServer
+
+VIDEO_FORMAT = "Pre-muxed Video (no merge)"
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers (None if empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def video_url(index, prefix="bench"):
+    """Watch URL with a valid 11 character video ID made of the prefix and the index"""
+    return f"https://www.youtube.com/watch?v={prefix}{index:0{11 - len(prefix)}d}"
+
+
+def parse_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def setup_environment(server, home):
+    """Point the application at the fake yt-dlp, the media server and a scratch data directory"""
+    os.environ["PORYGON_BENCH_SERVER"] = server.url
+    os.environ["PORYGON_YTDLP"] = f'"{sys.executable}" "{os.path.join(BENCH_DIR, "fake_yt_dlp.py")}"'
+    os.environ["PORYGON_ENGINE"] = "cli"
+    os.environ["PORYGON_HOME"] = home
+
+
+def history_record(index):
+    return {
+        "title": f"Benchmark video {index}",
+        "url": f"https://www.youtube.com/watch?v={index:011d}",
+        "date": "2024-01-01 12:00:00",
+        "format": VIDEO_FORMAT,
+        "path": "/media/videos",
+        "thumbnail": "",
+        "filepath": f"/media/videos/Benchmark video {index}.mp4",
+        "filesize": 4 * 1024 * 1024,
+        "mtime": 1700000000.0,
+    }
+
+
+def bench_history(sizes, work_dir):
+    """Appending, loading, querying and searching the history, and migrating the legacy JSON file"""
+    from history_store import HistoryStore
+    from history_search import HistorySearchIndex
+
+    results = []
+    for size in sizes:
+        directory = tempfile.mkdtemp(dir=work_dir)
+        store = HistoryStore(os.path.join(directory, "history.sqlite3"))
+        append_times = []
+        started = time.perf_counter()
+        for index in range(size):
+            record_started = time.perf_counter()
+            store.append(history_record(index))
+            append_times.append(time.perf_counter() - record_started)
+        append_total = time.perf_counter() - started
+
+        started = time.perf_counter()
+        records = store.load()
+        load_s = time.perf_counter() - started
+
+        lookups = min(size, 1000)
+        started = time.perf_counter()
+        for index in range(0, size, max(1, size // lookups)):
+            store.find_by_video_id(f"{index:011d}")
+        lookup_s = (time.perf_counter() - started) / lookups
+        store.close()
+
+        started = time.perf_counter()
+        search_index = HistorySearchIndex()
+        search_index.add_many(records)
+        index_build_s = time.perf_counter() - started
+        # Typing a query one keystroke at a time, then a facet on its own
+        search_times = []
+        for query in ("b", "be", "ben", "benchmark", "benchmark vid", "benchmark video 1"):
+            search_started = time.perf_counter()
+            search_index.search(query)
+            search_times.append(time.perf_counter() - search_started)
+        search_started = time.perf_counter()
+        search_index.search(format_option=VIDEO_FORMAT, date_from="2024-01-01")
+        facet_s = time.perf_counter() - search_started
+
+        json_file = os.path.join(directory, "download_history.json")
+        with open(json_file, 'w') as f:
+            json.dump([history_record(index) for index in range(size)], f)
+        started = time.perf_counter()
+        migrated = HistoryStore(os.path.join(directory, "migrated.sqlite3"), legacy_json_file=json_file)
+        migrate_s = time.perf_counter() - started
+        migrated.close()
+
+        results.append({
+            "records": size,
+            "append_total_s": append_total,
+            "append_p50_ms": percentile(append_times, 0.5) * 1000,
+            "append_p95_ms": percentile(append_times, 0.95) * 1000,
+            "load_s": load_s,
+            "loaded": len(records),
+            "find_by_video_id_ms": lookup_s * 1000,
+            "search_index_build_s": index_build_s,
+            "search_keystroke_max_ms": max(search_times) * 1000,
+            "search_facet_ms": facet_s * 1000,
+            "migrate_json_s": migrate_s,
+        })
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def bench_downloads(concurrency_levels, jobs, media_size, work_dir):
+    """Download throughput of the queue with the CLI engine at several pool sizes"""
+    from download_engine import create_engine
+    from download_queue import DownloadQueue, COMPLETED
+    from video_metadata import MetadataCache
+
+    results = []
+    for run, workers in enumerate(concurrency_levels):
+        directory = tempfile.mkdtemp(dir=work_dir)
+        done = threading.Event()
+        finished = []
+        durations = {}
+
+        def on_finished(job):
+            durations[job.id] = time.perf_counter() - started
+            finished.append(job)
+            if len(finished) == jobs:
+                done.set()
+
+        queue = DownloadQueue(
+            create_engine(),
+            MetadataCache(os.path.join(directory, "metadata_cache.json")),
+            max_workers=workers,
+            per_host_limit=workers,
+            on_job_finished=on_finished,
+            max_retries=0,
+        )
+        started = time.perf_counter()
+        for index in range(jobs):
+            queue.enqueue(video_url(index, f"r{run}x"), directory, VIDEO_FORMAT)
+        done.wait()
+        wall = time.perf_counter() - started
+        queue.shutdown()
+
+        completed = [job for job in finished if job.state == COMPLETED]
+        total_bytes = sum((job.result or {}).get('filesize') or 0 for job in completed)
+        latencies = [durations[job.id] for job in completed]
+        results.append({
+            "concurrency": workers,
+            "jobs": jobs,
+            "completed": len(completed),
+            "failed": [job.message for job in finished if job.state != COMPLETED][:5],
+            "wall_s": wall,
+            "mb_per_s": total_bytes / wall / (1024 * 1024),
+            "jobs_per_s": len(completed) / wall,
+            "job_finish_p50_s": percentile(latencies, 0.5),
+            "job_finish_p95_s": percentile(latencies, 0.95),
+            "media_size": media_size,
+        })
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def bench_gui(jobs):
+    """Time to preview a pasted URL, and event loop stalls while downloads run"""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PyQt6.QtCore import QTimer, QEventLoop
+        from PyQt6.QtWidgets import QApplication
+    except ImportError as e:
+        return {"skipped": f"PyQt6 is not available: {e}"}
+    from youtube_downloader import YouTubeDownloader
+
+    app = QApplication.instance() or QApplication([])
+    window = YouTubeDownloader()
+
+    def wait_until(condition, timeout=30):
+        deadline = time.perf_counter() + timeout
+        while not condition() and time.perf_counter() < deadline:
+            app.processEvents(QEventLoop.ProcessEventsFlag.AllEvents, 5)
+        return condition()
+
+    def preview(url, direct):
+        expected = f"Benchmark video {url.split('v=')[1]}"
+        started = time.perf_counter()
+        if direct:
+            window.url_input.setText(url)
+            window.url_timer.stop()
+            window.fetch_preview(url)
+        else:
+            window.url_input.setText(url)
+        shown = wait_until(lambda: window.preview_thumbnail.title_label.text() == expected)
+        return time.perf_counter() - started if shown else None
+
+    url = video_url(0, "guiprev")
+    results = {
+        # Includes the 800 ms typing debounce before the fetch starts
+        "preview_cold_s": preview(url, direct=False),
+        "preview_debounce_ms": 800,
+    }
+    window.url_input.clear()
+    window.last_url = ""
+    results["preview_warm_s"] = preview(url, direct=True)
+
+    # Gaps between ticks of a 5 ms timer show how long the event loop was blocked
+    gaps = []
+    last_tick = [time.perf_counter()]
+
+    def tick():
+        now = time.perf_counter()
+        gaps.append(now - last_tick[0])
+        last_tick[0] = now
+
+    timer = QTimer()
+    timer.timeout.connect(tick)
+    timer.start(5)
+    output_dir = tempfile.mkdtemp()
+    window.output_path.setText(output_dir)
+    started = time.perf_counter()
+    for index in range(jobs):
+        window.download_queue.enqueue(video_url(index, "guidl"), output_dir, VIDEO_FORMAT)
+    wait_until(lambda: all(job.finished for job in window.download_queue.jobs.values()), timeout=600)
+    timer.stop()
+    window.close()
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+    results.update({
+        "jobs": jobs,
+        "download_wall_s": time.perf_counter() - started,
+        "stall_max_ms": max(gaps) * 1000 if gaps else None,
+        "stall_p95_ms": percentile(gaps, 0.95) * 1000 if gaps else None,
+        "stalls_over_50ms": sum(1 for gap in gaps if gap > 0.05),
+    })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run Porygon's offline benchmarks")
+    parser.add_argument('--output', help="write the JSON results here instead of to stdout")
+    parser.add_argument('--history-sizes', default="1000,10000,100000")
+    parser.add_argument('--concurrency', default="1,4,8")
+    parser.add_argument('--jobs', type=int, default=16, help="downloads per concurrency level")
+    parser.add_argument('--media-size', type=int, default=4 * 1024 * 1024, help="bytes per media file")
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds added to every request")
+    parser.add_argument('--bandwidth', type=float, default=8 * 1024 * 1024,
+                        help="bytes per second per connection (0 for unlimited)")
+    parser.add_argument('--skip-gui', action='store_true')
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="porygon-bench-")
+    server = MediaServer(latency=args.latency, bandwidth=args.bandwidth or None, media_size=args.media_size).start()
+    setup_environment(server, work_dir)
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "parameters": vars(args),
+    }
+    try:
+        results["history"] = bench_history(parse_list(args.history_sizes), work_dir)
+        results["downloads"] = bench_downloads(parse_list(args.concurrency), args.jobs, args.media_size, work_dir)
+        results["gui"] = {"skipped": "--skip-gui"} if args.skip_gui else bench_gui(args.jobs)
+        results["server_requests"] = server.requests
+    finally:
+        server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
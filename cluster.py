@@ -0,0 +1,529 @@
+"""Distributed downloads: a coordinator hands jobs to headless worker nodes
+
+The coordinator (the GUI with cluster_port set, or any process that creates
+a Coordinator) serves a small JSON-over-HTTP protocol. Worker nodes run
+
+    python youtube_downloader.py --worker http://controller:8765
+
+which uses the headless runner's download queue. Every request is a POST of
+a JSON object and gets a JSON object back:
+
+    /register   {"name", "slots", "free_disk"} -> {"node_id", "poll_interval"}
+    /pull       {"node_id", "free_disk"} -> {"jobs": [job spec, ...]}
+    /progress   {"node_id", "free_disk", "jobs": {job id: {"state", "percent", "title", "message"}}}
+                -> {"cancel": [job id, ...]}
+    /result     {"node_id", "result": headless result line} -> {}
+
+GET /nodes returns the nodes and jobs, for scripts. A request from an
+unknown node_id gets a 404, and the node registers again.
+
+Jobs are handed out when nodes pull: the least loaded live node (assigned
+jobs per slot) with room on its disk for the job's estimated size gets it
+first. A node that hasn't been heard from for node_timeout seconds is
+dropped and its jobs go back to the front of the queue; if it comes back,
+it registers again and cancels what it was still running.
+
+With a token, every request must carry it in the X-Porygon-Token header.
+"""
+import os
+import sys
+import json
+import time
+import heapq
+import socket
+import itertools
+import threading
+
+from download_queue import QUEUED, RUNNING, CANCELLED, COMPLETED, FAILED, SKIPPED, FINISHED_STATES
+from staging import free_space, FREE_SPACE_MARGIN
+
+# Seconds between a worker's progress reports and pulls
+POLL_INTERVAL = 1.0
+
+# A node that hasn't reported for this many seconds is considered gone
+NODE_TIMEOUT = 15.0
+
+TOKEN_HEADER = "X-Porygon-Token"
+
+
+class RemoteJob:
+    """A job run by a worker node, shaped like a DownloadJob for the queue view and history"""
+    _ids = itertools.count(1)
+
+    def __init__(self, url, output_path, format_option, priority=0, allow_duplicate=False, estimated_size=None):
+        self.id = f"remote-{next(self._ids)}"
+        self.url = url
+        self.output_path = output_path  # None lets the node use its default folder
+        self.format_option = format_option
+        self.priority = priority
+        self.allow_duplicate = allow_duplicate
+        self.estimated_size = estimated_size
+        self.state = QUEUED
+        self.title = ""
+        self.thumbnail_path = ""
+        self.percent = 0.0
+        self.message = "Waiting for a worker"
+        self.result = None
+        self.node = None  # name of the node running or that ran the job
+        self.node_id = None
+        self.attempts = 0  # times the job was handed to a node
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    @property
+    def status(self):
+        return self.state
+
+    def spec(self):
+        """The job line sent to the node (see headless.parse_job_spec)"""
+        spec = {"id": self.id, "url": self.url, "format": self.format_option,
+                "priority": self.priority, "allow_duplicate": self.allow_duplicate}
+        if self.output_path:
+            spec["output"] = self.output_path
+        return spec
+
+
+class Node:
+    """A registered worker node"""
+    def __init__(self, node_id, name, slots, free_disk):
+        self.id = node_id
+        self.name = name
+        self.slots = max(1, int(slots))
+        self.free_disk = free_disk
+        self.jobs = set()  # ids of the jobs assigned to it
+        self.last_seen = time.monotonic()
+
+    def load(self):
+        return len(self.jobs) / self.slots
+
+    def reserved_bytes(self, jobs):
+        return sum(jobs[job_id].estimated_size or 0 for job_id in self.jobs)
+
+
+class Coordinator:
+    """Queue of RemoteJobs served to worker nodes over HTTP
+
+    on_job_updated/on_job_finished are called (from server threads) like
+    the DownloadQueue callbacks.
+    """
+    def __init__(self, port, host="127.0.0.1", token=None, node_timeout=NODE_TIMEOUT,
+                 on_job_updated=None, on_job_finished=None):
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        self.token = token
+        self.node_timeout = node_timeout
+        self.on_job_updated = on_job_updated
+        self.on_job_finished = on_job_finished
+        self.jobs = {}  # job id -> RemoteJob, in the order they were added
+        self.nodes = {}  # node id -> Node
+        self._pending = []  # (-priority, sequence, job id)
+        self._sequence = itertools.count()
+        self._node_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        coordinator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if not handler.authorized():
+                    return
+                if handler.path.split('?')[0] != "/nodes":
+                    handler.send_error(404)
+                    return
+                handler.reply(200, coordinator.snapshot())
+
+            def do_POST(handler):
+                if not handler.authorized():
+                    return
+                try:
+                    length = int(handler.headers.get("Content-Length") or 0)
+                    request = json.loads(handler.rfile.read(length) or b"{}")
+                    status, reply = coordinator.handle(handler.path.split('?')[0], request)
+                except (ValueError, KeyError, TypeError) as e:
+                    status, reply = 400, {"error": f"bad request: {e}"}
+                handler.reply(status, reply)
+
+            def authorized(handler):
+                if coordinator.token and handler.headers.get(TOKEN_HEADER) != coordinator.token:
+                    handler.reply(403, {"error": "missing or wrong token"})
+                    return False
+                return True
+
+            def reply(handler, status, body):
+                data = json.dumps(body).encode()
+                handler.send_response(status)
+                handler.send_header("Content-Type", "application/json")
+                handler.send_header("Content-Length", str(len(data)))
+                handler.end_headers()
+                handler.wfile.write(data)
+
+            def log_message(handler, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        threading.Thread(target=self._reap_loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def submit(self, url, format_option, output_path=None, priority=0, allow_duplicate=False, estimated_size=None):
+        """Queue a single video for the worker nodes and return its RemoteJob"""
+        job = RemoteJob(url, output_path, format_option, priority, allow_duplicate, estimated_size)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._push(job)
+        self._notify_updated(job)
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a job; a node running it is told to stop at its next report"""
+        job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return
+        with self._lock:
+            node = self.nodes.get(job.node_id)
+            if node is not None:
+                node.jobs.discard(job_id)
+            job.state = CANCELLED
+            job.message = "Download cancelled"
+        self._notify_finished(job)
+
+    def retry(self, job_id):
+        """Queue a failed job again"""
+        job = self.jobs.get(job_id)
+        if job is None or job.state != FAILED:
+            return
+        with self._lock:
+            job.state = QUEUED
+            job.message = "Waiting for a worker"
+            self._push(job)
+        self._notify_updated(job)
+
+    def move_to_top(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return
+        with self._lock:
+            job.priority = max(other.priority for other in self.jobs.values()) + 1
+            if job.state == QUEUED:
+                self._push(job)
+
+    def remove_finished(self):
+        with self._lock:
+            for job_id in [job_id for job_id, job in self.jobs.items() if job.finished]:
+                del self.jobs[job_id]
+
+    def snapshot(self):
+        """Nodes and jobs as JSON-friendly dicts"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "nodes": [{"id": node.id, "name": node.name, "slots": node.slots, "jobs": sorted(node.jobs),
+                           "free_disk": node.free_disk, "seen_s_ago": round(now - node.last_seen, 1)}
+                          for node in self.nodes.values()],
+                "jobs": [{"id": job.id, "url": job.url, "state": job.state, "node": job.node,
+                          "percent": job.percent, "message": job.message}
+                         for job in self.jobs.values()],
+            }
+
+    def handle(self, path, request):
+        """Answer one protocol request, returning (HTTP status, reply)"""
+        if path == "/register":
+            return 200, self._register(request)
+        node = self._seen(request.get("node_id"), request.get("free_disk"))
+        if node is None:
+            return 404, {"error": "unknown node"}
+        if path == "/pull":
+            return 200, {"jobs": [job.spec() for job in self._assign(node)]}
+        if path == "/progress":
+            return 200, {"cancel": self._progress(node, request.get("jobs") or {})}
+        if path == "/result":
+            self._result(node, request["result"])
+            return 200, {}
+        return 404, {"error": f"unknown request {path}"}
+
+    def _register(self, request):
+        with self._lock:
+            node_id = f"node-{next(self._node_ids)}"
+            self.nodes[node_id] = Node(node_id, str(request.get("name") or node_id),
+                                       request.get("slots") or 1, request.get("free_disk"))
+        return {"node_id": node_id, "poll_interval": POLL_INTERVAL}
+
+    def _seen(self, node_id, free_disk):
+        with self._lock:
+            node = self.nodes.get(node_id)
+            if node is not None:
+                node.last_seen = time.monotonic()
+                if free_disk is not None:
+                    node.free_disk = free_disk
+        return node
+
+    def _assign(self, node):
+        """Jobs for a node that pulls, as long as no live node is less loaded"""
+        assigned = []
+        with self._lock:
+            while len(node.jobs) < node.slots:
+                least_loaded = min((other.load() for other in self.nodes.values()
+                                    if len(other.jobs) < other.slots), default=node.load())
+                if node.load() > least_loaded:
+                    break
+                job = self._pop_fitting(node)
+                if job is None:
+                    break
+                job.state = RUNNING
+                job.node, job.node_id = node.name, node.id
+                job.attempts += 1
+                job.message = f"Sent to {node.name}"
+                node.jobs.add(job.id)
+                assigned.append(job)
+        for job in assigned:
+            self._notify_updated(job)
+        return assigned
+
+    def _pop_fitting(self, node):
+        """Take the first pending job the node has disk space for (lock held)"""
+        skipped = []
+        found = None
+        while self._pending:
+            entry = heapq.heappop(self._pending)
+            job = self.jobs.get(entry[2])
+            if job is None or job.state != QUEUED or -entry[0] != job.priority:
+                continue  # finished, already assigned, or re-pushed with a new priority
+            if node.free_disk is not None and job.estimated_size:
+                room = node.free_disk - node.reserved_bytes(self.jobs) - FREE_SPACE_MARGIN
+                if job.estimated_size > room:
+                    skipped.append(entry)
+                    continue
+            found = job
+            break
+        for entry in skipped:
+            heapq.heappush(self._pending, entry)
+        return found
+
+    def _progress(self, node, reports):
+        """Apply a node's progress report, returning the jobs it should stop"""
+        updated = []
+        cancel = []
+        with self._lock:
+            for job_id, report in reports.items():
+                job = self.jobs.get(job_id)
+                if job is None or job_id not in node.jobs:
+                    cancel.append(job_id)  # cancelled, or reassigned while the node was away
+                    continue
+                job.percent = float(report.get("percent") or 0.0)
+                job.title = report.get("title") or job.title
+                job.message = report.get("message") or job.message
+                updated.append(job)
+        for job in updated:
+            self._notify_updated(job)
+        return cancel
+
+    def _result(self, node, result):
+        job = self.jobs.get(result.get("id"))
+        with self._lock:
+            if job is None or job.id not in node.jobs:
+                return  # the job was cancelled or given to another node meanwhile
+            node.jobs.discard(job.id)
+            state = result.get("state")
+            job.state = state if state in (COMPLETED, FAILED, SKIPPED, CANCELLED) else FAILED
+            job.title = result.get("title") or job.title
+            job.message = result.get("message") or ""
+            job.output_path = result.get("output") or job.output_path
+            job.result = {"filepath": result.get("filepath"), "filesize": result.get("filesize"),
+                          "mtime": result.get("mtime"), "node": node.name}
+            if job.state == COMPLETED:
+                job.percent = 100.0
+        self._notify_finished(job)
+
+    def _reap_loop(self):
+        while not self._stopped.wait(1.0):
+            self.reap()
+
+    def reap(self):
+        """Drop nodes that stopped reporting and queue their jobs again"""
+        requeued = []
+        now = time.monotonic()
+        with self._lock:
+            # Ahead of every queued job, like move_to_top; jobs requeued together keep their order
+            top = max((job.priority for job in self.jobs.values()), default=0) + 1
+            for node in list(self.nodes.values()):
+                if now - node.last_seen < self.node_timeout:
+                    continue
+                del self.nodes[node.id]
+                for job_id in sorted(node.jobs, key=lambda job_id: int(job_id.split('-')[1])):
+                    job = self.jobs.get(job_id)
+                    if job is None or job.finished:
+                        continue
+                    job.state = QUEUED
+                    job.node = job.node_id = None
+                    job.percent = 0.0
+                    job.message = f"Waiting for a worker ({node.name} stopped responding)"
+                    job.priority = top
+                    self._push(job)
+                    requeued.append(job)
+        for job in requeued:
+            self._notify_updated(job)
+        return requeued
+
+    def _push(self, job):
+        heapq.heappush(self._pending, (-job.priority, next(self._sequence), job.id))
+
+    def _notify_updated(self, job):
+        if self.on_job_updated is not None:
+            self.on_job_updated(job)
+
+    def _notify_finished(self, job):
+        if self.on_job_finished is not None:
+            self.on_job_finished(job)
+
+
+def start_coordinator(settings, **callbacks):
+    """Start the coordinator described by the cluster settings, or return None"""
+    port = settings.get("cluster_port")
+    if not port:
+        return None
+    try:
+        return Coordinator(int(port), settings.get("cluster_host") or "127.0.0.1",
+                           settings.get("cluster_token"), **callbacks).start()
+    except (OSError, ValueError) as e:
+        print(f"Error starting the cluster coordinator: {e}")
+        return None
+
+
+class WorkerNode:
+    """Pulls jobs from a coordinator into a HeadlessRunner and reports back"""
+    def __init__(self, runner, coordinator_url, name=None, slots=None, token=None, output_path=None):
+        self.runner = runner
+        self.url = coordinator_url.rstrip('/')
+        self.name = name or socket.gethostname()
+        self.slots = slots or runner.queue.pool_size
+        self.token = token
+        self.output_path = output_path
+        self.node_id = None
+        self.poll_interval = POLL_INTERVAL
+        self.active = {}  # remote job id -> local DownloadJob
+        self._outbox = []  # results not yet delivered
+        self._lock = threading.Lock()
+        runner.result_listeners.append(self.on_result)
+
+    def request(self, path, body):
+        """POST a protocol request; returns (status, reply), status None if unreachable"""
+        import urllib.request
+        import urllib.error
+        data = json.dumps(body).encode()
+        request = urllib.request.Request(self.url + path, data=data, method="POST",
+                                         headers={"Content-Type": "application/json"})
+        if self.token:
+            request.add_header(TOKEN_HEADER, self.token)
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status, json.loads(response.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            return e.code, {}
+        except (OSError, ValueError):
+            return None, {}
+
+    def free_disk(self):
+        return free_space(self.output_path or self.runner.args.output)
+
+    def register(self):
+        status, reply = self.request("/register", {"name": self.name, "slots": self.slots,
+                                                   "free_disk": self.free_disk()})
+        if status != 200:
+            return False
+        self.node_id = reply["node_id"]
+        self.poll_interval = reply.get("poll_interval", POLL_INTERVAL)
+        print(f"Registered with {self.url} as {self.node_id}", file=sys.stderr)
+        return True
+
+    def on_result(self, result):
+        # Runs on a queue worker thread
+        if result.get("id") is None:
+            return
+        with self._lock:
+            self.active.pop(result["id"], None)
+            self._outbox.append(result)
+
+    def step(self):
+        """One round of reporting and pulling; returns False if the coordinator is unreachable"""
+        if self.node_id is None:
+            # Whatever ran under an old registration has been given to other nodes
+            with self._lock:
+                stale, self.active = self.active, {}
+                self._outbox = []
+            for job in stale.values():
+                self.runner.queue.cancel(job.id)
+            if not self.register():
+                return False
+
+        with self._lock:
+            outbox = list(self._outbox)
+        for result in outbox:
+            status, _ = self.request("/result", {"node_id": self.node_id, "result": result})
+            if status == 404:
+                self.node_id = None
+                return True
+            if status != 200:
+                return False
+            with self._lock:
+                self._outbox.remove(result)
+
+        with self._lock:
+            reports = {remote_id: {"state": job.status, "percent": job.percent, "title": job.title,
+                                   "message": job.message}
+                       for remote_id, job in self.active.items()}
+        status, reply = self.request("/progress", {"node_id": self.node_id, "free_disk": self.free_disk(),
+                                                   "jobs": reports})
+        if status == 404:
+            self.node_id = None
+            return True
+        if status != 200:
+            return False
+        for remote_id in reply.get("cancel", []):
+            with self._lock:
+                job = self.active.pop(remote_id, None)
+            if job is not None:
+                self.runner.queue.cancel(job.id)
+
+        if len(self.active) < self.slots:
+            status, reply = self.request("/pull", {"node_id": self.node_id, "free_disk": self.free_disk()})
+            if status == 404:
+                self.node_id = None
+                return True
+            if status != 200:
+                return False
+            for spec in reply.get("jobs", []):
+                spec.setdefault("output", self.output_path or self.runner.args.output)
+                try:
+                    os.makedirs(spec["output"], exist_ok=True)  # a node's folder may not exist yet
+                except OSError:
+                    pass  # the download reports it
+                job = self.runner.submit(spec)
+                with self._lock:
+                    # A job can finish before this, e.g. one already in the archive;
+                    # its result (tagged with the remote id) is already in the outbox
+                    if not job.finished:
+                        self.active[spec["id"]] = job
+        return True
+
+    def run(self, stop_event):
+        """Report and pull until stop_event is set, waiting out coordinator outages"""
+        while not stop_event.is_set():
+            if not self.step():
+                print(f"Coordinator {self.url} unreachable, retrying", file=sys.stderr)
+                stop_event.wait(max(self.poll_interval, 5.0))
+                continue
+            stop_event.wait(self.poll_interval)
+        return 0
@@ -0,0 +1,87 @@
+import os
+import re
+import threading
+
+from video_metadata import archive_id
+
+# Written once the archive has been seeded from the history, so an
+# interrupted seeding is done again on the next launch
+SEEDED_MARKER = ".seeded"
+
+
+def profile_name(format_option):
+    """File-name friendly name of a format option, e.g. "audio_only_mp3" """
+    return re.sub(r'[^a-z0-9]+', '_', format_option.lower()).strip('_')
+
+
+class DownloadArchive:
+    """Record of downloaded videos, one archive file per format profile
+
+    The files use yt-dlp's --download-archive format (one "<extractor> <id>"
+    line per video), so they can also be passed to yt-dlp directly. Each
+    profile is loaded into a set the first time it is used, making lookups
+    O(1); new entries are appended to the file as they are added.
+    """
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self.is_new = not os.path.exists(os.path.join(archive_dir, SEEDED_MARKER))
+        self._ids = {}  # format option -> set of archive IDs
+        self._lock = threading.Lock()
+        os.makedirs(archive_dir, exist_ok=True)
+
+    def path_for(self, format_option):
+        return os.path.join(self.archive_dir, profile_name(format_option) + ".txt")
+
+    def contains(self, video_archive_id, format_option):
+        if not video_archive_id:
+            return False
+        with self._lock:
+            return video_archive_id in self._ids_locked(format_option)
+
+    def add(self, video_archive_id, format_option):
+        """Record a downloaded video; returns False if it was already recorded"""
+        return self.add_many([(video_archive_id, format_option)]) == 1
+
+    def add_many(self, entries):
+        """Record several (archive ID, format option) pairs, returning how many were new"""
+        new_lines = {}
+        with self._lock:
+            for video_archive_id, format_option in entries:
+                if not video_archive_id:
+                    continue
+                ids = self._ids_locked(format_option)
+                if video_archive_id not in ids:
+                    ids.add(video_archive_id)
+                    new_lines.setdefault(format_option, []).append(video_archive_id)
+            for format_option, lines in new_lines.items():
+                try:
+                    with open(self.path_for(format_option), 'a') as f:
+                        f.write("".join(line + "\n" for line in lines))
+                except Exception as e:
+                    print(f"Error saving download archive: {e}")
+        return sum(len(lines) for lines in new_lines.values())
+
+    def import_history(self, records):
+        """Seed the archive from existing download history records"""
+        added = self.add_many(
+            (archive_id(record.get('url', '')), record.get('format', ''))
+            for record in records if record.get('format')
+        )
+        with open(os.path.join(self.archive_dir, SEEDED_MARKER), 'w'):
+            pass
+        self.is_new = False
+        return added
+
+    def _ids_locked(self, format_option):
+        ids = self._ids.get(format_option)
+        if ids is None:
+            ids = set()
+            path = self.path_for(format_option)
+            try:
+                if os.path.exists(path):
+                    with open(path, 'r') as f:
+                        ids.update(line.strip() for line in f if line.strip())
+            except Exception as e:
+                print(f"Error loading download archive: {e}")
+            self._ids[format_option] = ids
+        return ids
@@ -0,0 +1,595 @@
+import os
+import copy
+import importlib.util
+import json
+import shlex
+import tempfile
+import subprocess
+
+from tasks import CancelToken, TaskCancelled, terminate_process_tree
+from postprocess import STREAM_TEMPLATE, build_plan
+
+# yt-dlp format selectors for each option in the format combo box
+FORMAT_SELECTORS = {
+    "High Quality Video (mp4)": 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
+    "Medium Quality Video (mp4)": 'bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/best[height<=720][ext=mp4]/best[height<=720]',
+    "Low Quality Video (mp4)": 'bestvideo[height<=480][ext=mp4]+bestaudio[ext=m4a]/best[height<=480][ext=mp4]/best[height<=480]',
+    # A single file that already has audio and video, so ffmpeg never runs
+    "Pre-muxed Video (no merge)": 'best[ext=mp4][vcodec!=none][acodec!=none]/best[vcodec!=none][acodec!=none]',
+    # The audio stream exactly as the site serves it
+    "Audio Only (m4a, no re-encode)": 'bestaudio[ext=m4a]',
+}
+
+AUDIO_ONLY_MP3 = "Audio Only (mp3)"
+
+# Audio options that extract the audio stream with ffmpeg: (selector, codec, quality).
+# When the selected stream already has the codec, yt-dlp copies it instead of re-encoding.
+AUDIO_EXTRACT = {
+    AUDIO_ONLY_MP3: ('bestaudio/best', 'mp3', '5'),
+    "Audio Only (opus, no re-encode)": ('bestaudio[acodec=opus]', 'opus', None),
+}
+
+# Video chosen from the probed formats so that combining the streams is a
+# remux; falls back to a selector with the same guarantee when there is no probe
+REMUX_ONLY = "Best Video (remux only)"
+REMUX_ONLY_FALLBACK = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo[ext=webm]+bestaudio[ext=webm]/best[vcodec!=none][acodec!=none]'
+
+# Containers and the codecs they can hold, for the remux-only choice
+REMUX_CONTAINERS = (
+    ('mp4', ('avc1', 'h264', 'av01', 'hev1', 'hvc1'), ('mp4a', 'aac')),
+    ('webm', ('vp9', 'vp09', 'vp8', 'av01'), ('opus', 'vorbis')),
+)
+
+# Marks the progress lines the CLI engine asks yt-dlp to print
+PROGRESS_PREFIX = "[porygon-progress] "
+
+# Format options in the order they are offered to the user
+FORMAT_OPTIONS = [
+    "High Quality Video (mp4)",
+    "Medium Quality Video (mp4)",
+    "Low Quality Video (mp4)",
+    "Pre-muxed Video (no merge)",
+    REMUX_ONLY,
+    AUDIO_ONLY_MP3,
+    "Audio Only (m4a, no re-encode)",
+    "Audio Only (opus, no re-encode)",
+]
+
+
+def yt_dlp_command():
+    """The yt-dlp command as an argument list ($PORYGON_YTDLP overrides it, e.g. with a stand-in)"""
+    return shlex.split(os.environ.get("PORYGON_YTDLP", "yt-dlp"), posix=os.name != 'nt')
+
+
+class DownloadCancelled(TaskCancelled):
+    """Raised by an engine when a download is stopped through its cancel token"""
+
+
+def _has_codec(codec, prefixes):
+    return bool(codec) and codec != 'none' and codec.lower().startswith(prefixes)
+
+
+def _video_quality(f):
+    return (f.get('height') or 0, f.get('fps') or 0, f.get('tbr') or 0)
+
+
+def remux_only_format(formats):
+    """Pick the best format (or video+audio pair) that needs no re-encoding
+
+    Returns (format spec, container) using explicit format IDs, preferring
+    whichever container offers the higher resolution, or None if the probe
+    has no suitable formats.
+    """
+    candidates = []
+    for container, video_codecs, audio_codecs in REMUX_CONTAINERS:
+        videos = [f for f in formats if _has_codec(f.get('vcodec'), video_codecs) and f.get('acodec') == 'none']
+        audios = [f for f in formats if _has_codec(f.get('acodec'), audio_codecs) and f.get('vcodec') == 'none']
+        if videos and audios:
+            video = max(videos, key=_video_quality)
+            audio = max(audios, key=lambda f: f.get('abr') or f.get('tbr') or 0)
+            candidates.append((_video_quality(video), f"{video['format_id']}+{audio['format_id']}", container))
+    # Progressive formats need no ffmpeg at all
+    muxed = [f for f in formats
+             if f.get('vcodec') not in (None, 'none') and f.get('acodec') not in (None, 'none') and f.get('format_id')]
+    if muxed:
+        best = max(muxed, key=_video_quality)
+        candidates.append((_video_quality(best), best['format_id'], best.get('ext') or None))
+    if not candidates:
+        return None
+    _, spec, container = max(candidates, key=lambda candidate: candidate[0])
+    return spec, container
+
+
+def format_settings(format_option, formats=None):
+    """How to download a format option: format spec, merge container and audio extraction
+
+    Returns a dict with 'format', 'merge_output_format' (or None) and
+    'extract_audio' ((codec, quality) or None) for the engines to translate.
+    """
+    settings = {'format': None, 'merge_output_format': None, 'extract_audio': None}
+    if format_option in FORMAT_SELECTORS:
+        settings['format'] = FORMAT_SELECTORS[format_option]
+    elif format_option in AUDIO_EXTRACT:
+        selector, codec, quality = AUDIO_EXTRACT[format_option]
+        settings['format'] = selector
+        settings['extract_audio'] = (codec, quality)
+    elif format_option == REMUX_ONLY:
+        chosen = remux_only_format(formats) if formats else None
+        if chosen:
+            settings['format'], settings['merge_output_format'] = chosen
+        else:
+            settings['format'] = REMUX_ONLY_FALLBACK
+    return settings
+
+
+def format_bytes(num_bytes):
+    """Format a byte count the way yt-dlp does (e.g. 12.34MiB)"""
+    if num_bytes is None:
+        return "Unknown"
+    size = float(num_bytes)
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return f"{size:.2f}{unit}"
+        size /= 1024
+    return f"{size:.2f}TiB"
+
+
+def progress_record(phase, d):
+    """Build a structured progress record from a yt-dlp progress or postprocessor dict"""
+    if phase == 'postprocess':
+        return {
+            'phase': phase,
+            'status': d.get('status'),
+            'postprocessor': d.get('postprocessor'),
+        }
+
+    total = d.get('total_bytes') or d.get('total_bytes_estimate')
+    downloaded = d.get('downloaded_bytes')
+    percent = None
+    if total and downloaded is not None:
+        percent = min(downloaded * 100.0 / total, 100.0)
+    elif d.get('status') == 'finished':
+        percent = 100.0
+    return {
+        'phase': phase,
+        'status': d.get('status'),
+        'downloaded_bytes': downloaded,
+        'total_bytes': total,
+        'speed': d.get('speed'),
+        'eta': d.get('eta'),
+        'percent': percent,
+        'filename': d.get('filename'),
+    }
+
+
+def parse_progress_line(line):
+    """Parse a line printed through the CLI engine's --progress-template"""
+    try:
+        phase, payload = line[len(PROGRESS_PREFIX):].split(' ', 1)
+        return progress_record(phase, json.loads(payload))
+    except ValueError:
+        return None
+
+
+def format_progress(record):
+    """Build a human readable progress line from a structured progress record"""
+    if record.get('phase') == 'postprocess':
+        return f"[{record.get('postprocessor', 'postprocess')}] {record.get('status', '')}"
+
+    parts = ["[download]"]
+    if record.get('percent') is not None:
+        parts.append(f"{record['percent']:5.1f}%")
+    if record.get('total_bytes'):
+        parts.append(f"of {format_bytes(record['total_bytes'])}")
+    if record.get('speed'):
+        parts.append(f"at {format_bytes(record['speed'])}/s")
+    if record.get('eta') is not None:
+        minutes, seconds = divmod(int(record['eta']), 60)
+        parts.append(f"ETA {minutes:02d}:{seconds:02d}")
+    return " ".join(parts)
+
+
+def file_details(filepath):
+    """Final path, size and modification time of a downloaded file, for the history record"""
+    details = {'filepath': filepath, 'filesize': None, 'mtime': None}
+    if filepath:
+        try:
+            stat = os.stat(filepath)
+            details['filesize'] = stat.st_size
+            details['mtime'] = stat.st_mtime
+        except OSError:
+            pass
+    return details
+
+
+class _CallbackLogger:
+    """yt-dlp logger that forwards messages to a callback instead of stdout"""
+    def __init__(self, on_log):
+        self.on_log = on_log
+
+    def debug(self, msg):
+        # yt-dlp sends regular info messages through debug() when a logger is set
+        if not msg.startswith("[debug] "):
+            self.on_log(msg)
+
+    def info(self, msg):
+        self.on_log(msg)
+
+    def warning(self, msg):
+        self.on_log(f"WARNING: {msg}")
+
+    def error(self, msg):
+        self.on_log(msg)
+
+
+class ApiDownloadEngine:
+    """Download engine that drives yt_dlp.YoutubeDL in-process
+
+    Cancellation is noticed in the progress hooks, so an ffmpeg process
+    yt_dlp runs itself (HLS downloads, fixups) finishes its current step
+    first; the CLI engine kills the whole process group instead.
+    """
+    name = "api"
+
+    def build_options(self, output_path, format_option, concurrent_fragments=1, formats=None):
+        """Translate a format option into YoutubeDL params"""
+        options = {
+            'outtmpl': f'{output_path}/%(title)s.%(ext)s',
+            'writethumbnail': True,
+            'noplaylist': True,
+            'quiet': True,
+            'no_warnings': True,
+            'noprogress': True,
+            # Keep partial downloads in .part files and continue them when a job is retried or resumed
+            'continuedl': True,
+            'nopart': False,
+            # Fragments of DASH/HLS formats fetched in parallel
+            'concurrent_fragment_downloads': max(1, int(concurrent_fragments)),
+        }
+        settings = format_settings(format_option, formats)
+        if settings['format']:
+            options['format'] = settings['format']
+        if settings['merge_output_format']:
+            options['merge_output_format'] = settings['merge_output_format']
+        if settings['extract_audio']:
+            codec, quality = settings['extract_audio']
+            postprocessor = {'key': 'FFmpegExtractAudio', 'preferredcodec': codec}
+            if quality:
+                postprocessor['preferredquality'] = quality
+            options['postprocessors'] = [postprocessor]
+        return options
+
+    def download(self, url, output_path, format_option, on_progress=None, on_log=None, on_thumbnail=None,
+                 cancel_token=None, bandwidth=None, concurrent_fragments=1, formats=None, postprocess=True):
+        """Download a URL and return a dict with the final file and thumbnail paths
+
+        formats is the probed format list, used by options that pick formats
+        themselves (REMUX_ONLY). With a BandwidthScheduler, the download
+        draws from its shared token bucket: the progress hook runs after
+        every block received, and sleeping there slows the download to the
+        global budget.
+
+        With postprocess=False only the raw streams are downloaded, and any
+        merge or audio extraction is returned as a plan under 'postprocess'
+        (see postprocess.py) instead of being run.
+        """
+        import yt_dlp
+
+        received = {}  # filename -> bytes already charged to the bandwidth budget
+
+        def progress_hook(d):
+            # Raising from a hook is the supported way to abort a YoutubeDL download
+            if cancel_token is not None and cancel_token.cancelled:
+                raise DownloadCancelled()
+            if bandwidth is not None and d.get('status') == 'downloading':
+                downloaded = d.get('downloaded_bytes') or 0
+                previous = received.get(d.get('filename'), downloaded)
+                received[d.get('filename')] = max(previous, downloaded)
+                bandwidth.consume(downloaded - previous, cancel_token)
+            if on_progress is not None:
+                on_progress(progress_record('download', d))
+
+        def postprocessor_hook(d):
+            if cancel_token is not None and cancel_token.cancelled:
+                raise DownloadCancelled()
+            if on_progress is not None:
+                on_progress(progress_record('postprocess', d))
+
+        options = self.build_options(output_path, format_option, concurrent_fragments, formats)
+        options['progress_hooks'] = [progress_hook]
+        options['postprocessor_hooks'] = [postprocessor_hook]
+        if on_log is not None:
+            options['logger'] = _CallbackLogger(on_log)
+
+        plan = None
+        try:
+            if postprocess:
+                with yt_dlp.YoutubeDL(options) as ydl:
+                    info = ydl.extract_info(url, download=True)
+            else:
+                info, plan = self._download_streams(yt_dlp, url, output_path, format_option, formats, options)
+        except yt_dlp.utils.DownloadError:
+            # yt-dlp wraps exceptions raised from hooks in a DownloadError
+            if cancel_token is not None and cancel_token.cancelled:
+                raise DownloadCancelled()
+            raise
+
+        result = {'title': info.get('title', ""), 'filepath': None, 'thumbnail_path': None, 'postprocess': plan}
+        downloads = info.get('requested_downloads') or []
+        if plan is None:
+            # After post-processing and moving, 'filepath' is the file that ends up on disk
+            result.update(file_details(downloads[-1].get('filepath') if downloads else None))
+        for thumbnail in info.get('thumbnails') or []:
+            if thumbnail.get('filepath') and os.path.exists(thumbnail['filepath']):
+                result['thumbnail_path'] = thumbnail['filepath']
+                if on_thumbnail is not None:
+                    on_thumbnail(thumbnail['filepath'])
+        return result
+
+    def _download_streams(self, yt_dlp, url, output_path, format_option, formats, options):
+        """Download the selected streams unprocessed, returning (info, plan)
+
+        The format selector is resolved first, on the extracted (but not yet
+        processed) info, so the page is only fetched once. Streams that need
+        ffmpeg are then downloaded as separate files (format "a,b" instead of
+        "a+b") under STREAM_TEMPLATE.
+        """
+        settings = format_settings(format_option, formats)
+        options = dict(options)
+        options.pop('postprocessors', None)
+        with yt_dlp.YoutubeDL(options) as ydl:
+            raw = ydl.extract_info(url, download=False, process=False)
+            resolved = ydl.process_ie_result(copy.deepcopy(raw), download=False)
+            requested = resolved.get('requested_formats') or [resolved]
+            if len(requested) < 2 and not settings['extract_audio']:
+                # A single stream used as is: nothing to post-process
+                return ydl.process_ie_result(copy.deepcopy(raw), download=True), None
+
+        options['format'] = ','.join(f['format_id'] for f in requested)
+        options['outtmpl'] = f'{output_path}/{STREAM_TEMPLATE}'
+        options['writethumbnail'] = False
+        with yt_dlp.YoutubeDL(options) as ydl:
+            info = ydl.process_ie_result(copy.deepcopy(raw), download=True)
+        return info, build_plan(info.get('requested_downloads') or [], settings)
+
+    def iter_entries(self, url, cancel_token=None):
+        """Yield the videos of a playlist or channel as they are discovered"""
+        import yt_dlp
+
+        options = {'extract_flat': 'in_playlist', 'lazy_playlist': True, 'quiet': True, 'no_warnings': True}
+        with yt_dlp.YoutubeDL(options) as ydl:
+            # process=False keeps 'entries' as the extractor's lazy page generator
+            info = ydl.extract_info(url, download=False, process=False)
+            if info.get('_type') == 'url' and info.get('url'):
+                yield from self.iter_entries(info['url'], cancel_token)
+                return
+            if info.get('_type') not in ('playlist', 'multi_video'):
+                yield flat_entry(info)
+                return
+            for entry in info.get('entries') or []:
+                if cancel_token is not None and cancel_token.cancelled:
+                    return
+                if entry and is_nested_collection(entry):
+                    yield from self.iter_entries(entry['url'], cancel_token)
+                elif entry:
+                    yield flat_entry(entry)
+
+
+class CliDownloadEngine:
+    """Fallback download engine that runs the yt-dlp command line tool"""
+    name = "cli"
+
+    def build_command(self, url, output_path, format_option, filepath_file=None, rate_limit=None, concurrent_fragments=1,
+                      formats=None, streams=None, info_file=None):
+        """Build the yt-dlp command based on the selected format
+
+        With filepath_file, yt-dlp writes the final path of the downloaded
+        file there (--print-to-file, which unlike --print doesn't imply --quiet).
+        With streams (a list of format IDs), those formats are downloaded as
+        separate, unprocessed files. info_file reuses an info JSON written by
+        resolve_command() instead of extracting the URL again.
+        """
+        cmd = yt_dlp_command()
+        settings = format_settings(format_option, formats)
+        if streams:
+            cmd.extend(['-f', ','.join(streams), '--no-write-thumbnail'])
+        else:
+            if settings['format']:
+                cmd.extend(['-f', settings['format']])
+            if settings['merge_output_format']:
+                cmd.extend(['--merge-output-format', settings['merge_output_format']])
+            if settings['extract_audio']:
+                codec, quality = settings['extract_audio']
+                cmd.extend(['-x', '--audio-format', codec])
+                if quality:
+                    cmd.extend(['--audio-quality', quality])
+            cmd.append('--write-thumbnail')
+
+        cmd.append('--no-playlist')
+        # Keep partial downloads in .part files and continue them when a job is retried or resumed
+        cmd.extend(['--continue', '--part'])
+        # One machine-readable JSON progress line per update instead of the progress bar
+        cmd.extend([
+            '--newline',
+            '--progress-template', f'download:{PROGRESS_PREFIX}download %(progress)j',
+            '--progress-template', f'postprocess:{PROGRESS_PREFIX}postprocess %(progress)j',
+        ])
+        if filepath_file:
+            cmd.extend(['--print-to-file', 'after_move:filepath', filepath_file])
+        if rate_limit:
+            cmd.extend(['--limit-rate', str(int(rate_limit))])
+        if concurrent_fragments > 1:
+            cmd.extend(['--concurrent-fragments', str(int(concurrent_fragments))])
+        template = STREAM_TEMPLATE if streams else '%(title)s.%(ext)s'
+        cmd.extend(['-o', f'{output_path}/{template}'])
+        if info_file:
+            cmd.extend(['--load-info-json', info_file])
+        else:
+            cmd.append(url)
+        return cmd
+
+    def resolve_command(self, url, format_option, formats=None):
+        """yt-dlp command that prints the info JSON with the selected formats resolved"""
+        settings = format_settings(format_option, formats)
+        cmd = yt_dlp_command() + ['--no-playlist', '--no-warnings', '-J']
+        if settings['format']:
+            cmd.extend(['-f', settings['format']])
+        if settings['merge_output_format']:
+            cmd.extend(['--merge-output-format', settings['merge_output_format']])
+        cmd.append(url)
+        return cmd
+
+    def download(self, url, output_path, format_option, on_progress=None, on_log=None, on_thumbnail=None,
+                 cancel_token=None, bandwidth=None, concurrent_fragments=1, formats=None, postprocess=True):
+        """Download a URL and return a dict with the final file and thumbnail paths
+
+        A separate process can't draw from the shared bandwidth bucket, so it
+        is given its share of the budget as a fixed --limit-rate instead.
+
+        With postprocess=False the formats are resolved first (-J) and, if
+        they need ffmpeg, downloaded as raw streams from the saved info JSON;
+        the merge or audio extraction is returned as a plan under 'postprocess'.
+        """
+        result = {'title': "", 'filepath': None, 'thumbnail_path': None, 'postprocess': None}
+        cancel_token = cancel_token or CancelToken()
+        temp_files = []
+        try:
+            streams = info_file = None
+            if not postprocess:
+                completed = cancel_token.run(self.resolve_command(url, format_option, formats))
+                if completed.returncode != 0:
+                    raise RuntimeError(f"Format selection failed with error code {completed.returncode}")
+                resolved = json.loads(completed.stdout)
+                result['title'] = resolved.get('title', "")
+                requested = resolved.get('requested_formats') or [resolved]
+                fd, info_file = tempfile.mkstemp(prefix="porygon-", suffix=".info.json")
+                temp_files.append(info_file)
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(completed.stdout)
+                if len(requested) >= 2 or format_settings(format_option, formats)['extract_audio']:
+                    streams = [f['format_id'] for f in requested]
+
+            fd, filepath_file = tempfile.mkstemp(prefix="porygon-", suffix=".txt")
+            os.close(fd)
+            temp_files.append(filepath_file)
+            cmd = self.build_command(
+                url, output_path, format_option, filepath_file,
+                rate_limit=bandwidth.job_rate_limit() if bandwidth is not None else None,
+                concurrent_fragments=concurrent_fragments,
+                formats=formats,
+                streams=streams,
+                info_file=info_file
+            )
+            self._run(cmd, result, on_progress, on_log, on_thumbnail, cancel_token)
+            with open(filepath_file, 'r', encoding='utf-8') as f:
+                lines = [line.strip() for line in f if line.strip()]
+        finally:
+            for path in temp_files:
+                os.remove(path)
+
+        if streams:
+            downloads = []
+            for stream in requested:
+                paths = [line for line in lines if f".f{stream['format_id']}." in os.path.basename(line)]
+                downloads.append(dict(stream, filepath=paths[-1] if paths else None))
+            result['postprocess'] = build_plan(downloads, format_settings(format_option, formats))
+        if result['postprocess'] is None:
+            result.update(file_details(lines[-1] if lines else None))
+        return result
+
+    def _run(self, cmd, result, on_progress, on_log, on_thumbnail, cancel_token):
+        """Run yt-dlp, feeding its output to the callbacks and the thumbnail path into result"""
+        process = cancel_token.popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+            universal_newlines=True
+        )
+
+        # Stream the output
+        for line in process.stdout:
+            line = line.strip()
+            if line.startswith(PROGRESS_PREFIX):
+                record = parse_progress_line(line)
+                if record is not None and on_progress is not None:
+                    on_progress(record)
+                continue
+            if on_log is not None:
+                on_log(line)
+
+            # Check if thumbnail is written in this line
+            if "Writing thumbnail" in line and not result['thumbnail_path']:
+                parts = line.split("Writing thumbnail to: ")
+                if len(parts) > 1:
+                    result['thumbnail_path'] = parts[1].strip()
+                    if on_thumbnail is not None:
+                        on_thumbnail(result['thumbnail_path'])
+
+        # Wait for the process to complete
+        process.wait()
+        cancel_token.unregister_process(process)
+        if cancel_token is not None and cancel_token.cancelled:
+            raise DownloadCancelled()
+        if process.returncode != 0:
+            raise RuntimeError(f"Download failed with error code {process.returncode}")
+
+    def iter_entries(self, url, cancel_token=None):
+        """Yield the videos of a playlist or channel as yt-dlp prints them"""
+        cmd = yt_dlp_command() + ['--flat-playlist', '--dump-json', '--no-warnings', url]
+        cancel_token = cancel_token or CancelToken()
+        process = cancel_token.popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        try:
+            for line in process.stdout:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if is_nested_collection(entry):
+                    yield from self.iter_entries(entry['url'], cancel_token)
+                else:
+                    yield flat_entry(entry)
+        finally:
+            # Stopping early (or a consumer that stops iterating) leaves yt-dlp running
+            terminate_process_tree(process)
+            process.wait()
+            cancel_token.unregister_process(process)
+        if process.returncode != 0 and not (cancel_token is not None and cancel_token.cancelled):
+            raise RuntimeError(f"Playlist expansion failed with error code {process.returncode}")
+
+
+def flat_entry(entry):
+    """Reduce a flat-playlist entry to the fields needed to queue it
+
+    'archive_id' is the video's download archive ID when the entry names its
+    extractor, so duplicates are found without probing the video.
+    """
+    url = entry.get('webpage_url') or entry.get('url') or ""
+    if entry.get('ie_key') == 'Youtube' and entry.get('id') and "://" not in url:
+        url = f"https://www.youtube.com/watch?v={entry['id']}"
+    extractor = entry.get('ie_key') or entry.get('extractor_key')
+    return {'id': entry.get('id'), 'url': url, 'title': entry.get('title') or "",
+            'archive_id': f"{extractor.lower()} {entry['id']}" if extractor and entry.get('id') else None}
+
+
+def is_nested_collection(entry):
+    """Channel pages list their tabs (Videos, Shorts, ...) as nested playlists"""
+    return entry.get('_type') == 'url' and entry.get('ie_key') == 'YoutubeTab' and bool(entry.get('url'))
+
+
+def create_engine(name=None):
+    """Create the requested engine, falling back to the CLI when yt_dlp isn't installed
+
+    The engine can be forced with the PORYGON_ENGINE environment variable
+    ("api" or "cli"); the default prefers the in-process API. yt_dlp itself
+    is only imported by the first download, as importing it is slow.
+    """
+    name = name or os.environ.get("PORYGON_ENGINE", "auto")
+    if name == "cli":
+        return CliDownloadEngine()
+    if importlib.util.find_spec("yt_dlp") is not None:
+        return ApiDownloadEngine()
+    if name == "api":
+        print("yt_dlp module is not available, falling back to the yt-dlp command")
+    return CliDownloadEngine()
@@ -0,0 +1,817 @@
+import os
+import time
+import heapq
+import random
+import itertools
+import threading
+from collections import Counter, deque
+from concurrent.futures import CancelledError
+from urllib.parse import urlparse
+
+from download_engine import format_progress, file_details
+from video_metadata import normalize_url, archive_id
+from tasks import CancelToken, TaskCancelled, read_url
+from metrics import JobMetrics
+from staging import estimate_download_size, check_free_space
+
+# Job states
+QUEUED = "Queued"
+RUNNING = "Downloading"
+PAUSED = "Paused"
+RETRYING = "Retrying"
+# Downloaded and waiting for (or running in) the post-processing pool; also
+# how a RUNNING job is shown while yt-dlp runs ffmpeg itself
+POSTPROCESSING = "Post-processing"
+CANCELLED = "Cancelled"
+COMPLETED = "Completed"
+FAILED = "Failed"
+SKIPPED = "Skipped"
+
+FINISHED_STATES = (CANCELLED, COMPLETED, FAILED, SKIPPED)
+
+# Hosts that serve the same site and should share one concurrency limit
+HOST_ALIASES = {
+    "youtu.be": "youtube.com",
+    "youtube-nocookie.com": "youtube.com",
+    "music.youtube.com": "youtube.com",
+}
+
+
+def host_key(url):
+    """Normalize the host of a URL for per-host concurrency limits"""
+    host = urlparse(url if "://" in url else "https://" + url).netloc.lower().split(':')[0]
+    for prefix in ("www.", "m."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    return HOST_ALIASES.get(host, host)
+
+
+# Error messages that usually mean the network or server hiccuped rather than
+# that the video can't be downloaded; jobs failing with these are retried
+TRANSIENT_ERRORS = (
+    "timed out", "timeout", "connection reset", "connection aborted", "connection refused",
+    "remote end closed", "temporary failure", "name resolution", "network is unreachable",
+    "incompleteread", "eof occurred", "http error 429", "http error 5", "unable to download video data",
+)
+
+
+def is_transient_error(message):
+    """Guess whether a download error is worth retrying"""
+    message = message.lower()
+    return any(pattern in message for pattern in TRANSIENT_ERRORS)
+
+
+def retry_delay(attempt, base_delay, max_delay):
+    """Exponential backoff with jitter for the given (1-based) retry attempt
+
+    The delay doubles per attempt up to max_delay, and a random half of it is
+    dropped so jobs that failed together don't all retry at the same moment.
+    """
+    delay = min(max_delay, base_delay * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class DownloadJob:
+    """A single URL in the download queue"""
+    _ids = itertools.count(1)
+
+    def __init__(self, url, output_path, format_option, priority=0, title="", collection_id=None, tag=None):
+        self.id = next(self._ids)
+        self.url = url
+        self.output_path = output_path
+        self.format_option = format_option
+        self.priority = priority
+        self.collection_id = collection_id
+        self.tag = tag  # the caller's own id for the job, e.g. from a headless job spec
+        self.host = host_key(url)
+        self.state = QUEUED
+        self.title = title
+        self.thumbnail_path = ""
+        self.percent = 0.0
+        self.progress = {}
+        self.message = ""
+        self.result = None
+        self.created_at = time.time()
+        self.attempts = 0  # failed attempts so far
+        self.next_attempt_at = None  # when a RETRYING job is queued again
+        self.store_id = None  # row in the JobStore, if the job is persisted
+        self.staging_dir = None  # per-job directory in the StagingArea, once chosen
+        self.archive_id = None  # "<extractor> <video id>", once known
+        self.allow_duplicate = False  # download even if the archive has the video
+        self._pending_key = None  # (archive ID, format) while registered as pending
+        self.spans = []  # finished timing spans of every attempt (dicts, see metrics.py)
+        self._span = None  # span of the phase running now
+        self._cancel_token = CancelToken()
+        self._pause_requested = False
+        self._cancel_requested = False
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    @property
+    def status(self):
+        """The state, or POSTPROCESSING while a running job is in its ffmpeg stage"""
+        if self.state == RUNNING and self.progress.get('phase') == 'postprocess':
+            return POSTPROCESSING
+        return self.state
+
+
+class CollectionExpansion:
+    """A playlist or channel URL whose entries are being streamed into the queue"""
+    _ids = itertools.count(1)
+
+    def __init__(self, url, output_path, format_option, priority=0, tag=None):
+        self.id = next(self._ids)
+        self.url = url
+        self.output_path = output_path
+        self.format_option = format_option
+        self.priority = priority
+        self.tag = tag  # the caller's own id for the collection
+        self.title = ""
+        self.job_ids = []
+        self.done = False
+        self.error = None
+        self._cancel_token = CancelToken()
+
+    @property
+    def count(self):
+        return len(self.job_ids)
+
+    @property
+    def cancelled(self):
+        return self._cancel_token.cancelled
+
+
+class DownloadQueue:
+    """Priority queue of downloads run by a bounded pool of worker threads
+
+    Higher priority jobs start first; jobs with the same priority start in
+    the order they were added. At most per_host_limit jobs (or the limit in
+    host_limits) run against one host at a time.
+
+    on_job_updated/on_job_finished are called on state changes only;
+    progress is coalesced per job and collected with drain_progress().
+
+    With an archive, a URL whose video was already downloaded (or is already
+    queued) in the same format is added as a SKIPPED job instead of being
+    downloaded again, and completed downloads are recorded in the archive.
+
+    With a postprocessor (PostProcessPool), engines only download the raw
+    streams: the job's network slot is freed as soon as they are on disk and
+    the job waits in POSTPROCESSING while the pool merges or extracts audio.
+
+    With a job_store, every state change is persisted and restore() brings
+    unfinished jobs back after a restart. Jobs that fail with a transient
+    error are retried up to max_retries times with exponential backoff.
+
+    Each phase of a job (probe, thumbnail, transfer, postprocess, move) is
+    timed as a span and recorded in metrics (a JobMetrics).
+
+    Jobs whose estimated size doesn't fit on the output folder's disk fail
+    before downloading. With a staging area (a StagingArea), jobs download
+    and post-process in a local directory and only the finished file is
+    moved to the output folder.
+    """
+    def __init__(self, engine, metadata_cache, max_workers=3, per_host_limit=3, host_limits=None,
+                 on_job_updated=None, on_job_finished=None, on_collection_updated=None, log_size=5000,
+                 job_store=None, max_retries=3, retry_base_delay=5, retry_max_delay=300, archive=None,
+                 bandwidth=None, concurrent_fragments=None, postprocessor=None, metrics=None, staging=None):
+        self.engine = engine
+        self.staging = staging
+        self.metrics = metrics if metrics is not None else JobMetrics()
+        self.postprocessor = postprocessor
+        self.bandwidth = bandwidth  # shared BandwidthScheduler, or None for no limit
+        self.concurrent_fragments = dict(concurrent_fragments or {})  # format option (or "default") -> count
+        self.metadata_cache = metadata_cache
+        self.archive = archive
+        self.job_store = job_store
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.per_host_limit = per_host_limit
+        self.host_limits = dict(host_limits or {})
+        self.on_job_updated = on_job_updated
+        self.on_job_finished = on_job_finished
+        self.on_collection_updated = on_collection_updated
+
+        # Raw engine output, bounded so long sessions don't grow without limit
+        self.log = deque(maxlen=log_size)  # (timestamp, job id, line)
+        self._dirty = set()  # ids of jobs with progress not yet drained
+        self._progress_lock = threading.Lock()
+
+        self.collections = {}  # expansion id -> CollectionExpansion
+        self.jobs = {}  # job id -> DownloadJob, in the order they were added
+        self._pending = {}  # (archive ID, format) -> id of the unfinished job downloading it
+        self._heap = []  # (-priority, sequence, job)
+        self._sequence = itertools.count()
+        self._host_counts = Counter()
+        self._cond = threading.Condition()
+        self._max_workers = 0
+        self._worker_count = 0
+        self._shutdown = False
+        self._held = None  # jobs added while new jobs are held, or None
+        self.set_pool_size(max_workers)
+
+    def enqueue(self, url, output_path, format_option, priority=0, title="", collection_id=None,
+                allow_duplicate=False, video_archive_id=None, tag=None):
+        """Add a URL to the queue and return its job
+
+        Unless allow_duplicate is set, the job is SKIPPED if the video is in
+        the archive for this format or another unfinished job is downloading it.
+        A video whose archive ID isn't known yet (video_archive_id, e.g. from a
+        playlist entry, or cached metadata) is checked again after its probe.
+
+        A SKIPPED job is reported to on_job_finished before this returns, so
+        callers that need to recognise it there pass their own id as tag.
+        """
+        job = DownloadJob(normalize_url(url), output_path, format_option, priority, title, collection_id, tag)
+        job.allow_duplicate = allow_duplicate
+        job.archive_id = video_archive_id or archive_id(job.url, self.metadata_cache.peek(job.url))
+        with self._cond:
+            self.jobs[job.id] = job
+            if self._held is not None:
+                job.message = "Waiting for the download archive"
+                self._held.append(job)
+            else:
+                self._admit(job)
+        if job.state == SKIPPED:
+            self._notify_finished(job)
+        else:
+            self._notify_updated(job)
+        return job
+
+    def _admit(self, job):
+        """Check a new job against the archive and queue, then queue or skip it (lock held)"""
+        duplicate = self.find_duplicate(job.archive_id, job.format_option)
+        if duplicate and not job.allow_duplicate:
+            job.state = SKIPPED
+            job.message = duplicate
+        else:
+            self._register_pending(job)
+            self._push(job)
+
+    def hold_new_jobs(self):
+        """Keep jobs added from now on waiting, unchecked, until release_new_jobs()
+
+        For while the archive is still being filled: restored jobs are not
+        held, so restore() before releasing lets new jobs see them too.
+        """
+        with self._cond:
+            if self._held is None:
+                self._held = []
+
+    def release_new_jobs(self):
+        """Check the held jobs for duplicates and queue them"""
+        with self._cond:
+            held, self._held = self._held or [], None
+            for job in held:
+                if job.finished:
+                    continue  # cancelled while held
+                job.message = ""
+                self._admit(job)  # a paused job's heap entry is ignored until it resumes
+        for job in held:
+            if job.state == SKIPPED:
+                self._notify_finished(job)
+            elif not job.finished:
+                self._notify_updated(job)
+
+    def find_duplicate(self, video_archive_id, format_option):
+        """Describe why a video needn't be downloaded again, or return None"""
+        if not video_archive_id:
+            return None
+        if self.archive is not None and self.archive.contains(video_archive_id, format_option):
+            return "Already downloaded in this format"
+        if (video_archive_id, format_option) in self._pending:
+            return "Already in the queue"
+        return None
+
+    def _register_pending(self, job):
+        if job.archive_id:
+            job._pending_key = (job.archive_id, job.format_option)
+            self._pending.setdefault(job._pending_key, job.id)
+
+    def _release_pending(self, job):
+        if job._pending_key and self._pending.get(job._pending_key) == job.id:
+            del self._pending[job._pending_key]
+        job._pending_key = None
+
+    def restore(self):
+        """Re-create the jobs saved in the job store by a previous run
+
+        Jobs that were queued, running or post-processing are queued again
+        (yt-dlp continues from their .part files); paused and failed jobs
+        come back paused and failed. Returns the restored jobs.
+        """
+        if self.job_store is None:
+            return []
+        restored = []
+        for record in self.job_store.load():
+            job = DownloadJob(record['url'], record['output_path'], record['format'],
+                              record['priority'] or 0, record['title'] or "")
+            job.store_id = record['id']
+            job.allow_duplicate = bool(record['allow_duplicate'])
+            job.attempts = record['attempts'] or 0
+            job.created_at = record['created_at'] or job.created_at
+            job.message = record['message'] or ""
+            job.archive_id = archive_id(job.url, self.metadata_cache.peek(job.url))
+            with self._cond:
+                self.jobs[job.id] = job
+                if record['state'] != FAILED:
+                    self._register_pending(job)
+                if record['state'] in (PAUSED, FAILED):
+                    job.state = record['state']
+                elif record['state'] == RETRYING and record['next_attempt_at']:
+                    self._schedule_retry(job, max(0, record['next_attempt_at'] - time.time()))
+                else:
+                    if record['state'] in (RUNNING, POSTPROCESSING):
+                        job.message = "Resuming interrupted download"
+                    self._push(job)
+            self._notify_updated(job)
+            restored.append(job)
+        return restored
+
+    def enqueue_collection(self, url, output_path, format_option, priority=0, tag=None):
+        """Expand a playlist or channel in the background, queueing entries as they arrive
+
+        Downloads of the first entries start while later pages of the
+        playlist are still being fetched; like enqueue, tag is the caller's
+        id for it, known to the callbacks from the start.
+        """
+        collection = CollectionExpansion(url, output_path, format_option, priority, tag)
+        self.collections[collection.id] = collection
+        threading.Thread(target=self._expand_collection, args=(collection,), daemon=True).start()
+        self._notify_collection(collection)
+        return collection
+
+    def cancel_collection(self, collection_id):
+        """Stop expanding a collection and cancel the jobs it already queued"""
+        collection = self.collections.get(collection_id)
+        if collection is None:
+            return
+        collection._cancel_token.cancel()
+        for job_id in collection.job_ids:
+            self.cancel(job_id)
+
+    def _expand_collection(self, collection):
+        try:
+            for entry in self.engine.iter_entries(collection.url, collection._cancel_token):
+                if collection._cancel_token.cancelled or self._shutdown:
+                    break
+                if not entry['url']:
+                    continue
+                job = self.enqueue(
+                    entry['url'], collection.output_path, collection.format_option,
+                    collection.priority, entry['title'], collection.id,
+                    video_archive_id=entry.get('archive_id')
+                )
+                collection.job_ids.append(job.id)
+                self._notify_collection(collection)
+        except Exception as e:
+            print(f"Error expanding playlist: {e}")
+            collection.error = str(e)
+        finally:
+            collection.done = True
+            self._notify_collection(collection)
+
+    def set_pool_size(self, max_workers):
+        """Change how many downloads may run at the same time"""
+        with self._cond:
+            self._max_workers = max(1, int(max_workers))
+            while self._worker_count < self._max_workers:
+                self._worker_count += 1
+                threading.Thread(target=self._worker_loop, daemon=True).start()
+            # Surplus workers exit once they finish their current job
+            self._cond.notify_all()
+
+    @property
+    def pool_size(self):
+        return self._max_workers
+
+    def pause(self, job_id):
+        """Pause a job; a running download is stopped and keeps its .part file"""
+        job = self.jobs.get(job_id)
+        if job is None or job.finished or job.state in (PAUSED, POSTPROCESSING):
+            return
+        with self._cond:
+            if job.state in (QUEUED, RETRYING):
+                job.state = PAUSED
+                job.next_attempt_at = None
+            else:
+                job._pause_requested = True
+                job._cancel_token.cancel()
+        self._notify_updated(job)
+
+    def resume(self, job_id):
+        """Put a paused job back in the queue; yt-dlp continues from the .part file"""
+        job = self.jobs.get(job_id)
+        if job is None or job.state != PAUSED:
+            return
+        with self._cond:
+            job.state = QUEUED
+            job._pause_requested = False
+            job._cancel_token = CancelToken()
+            self._push(job)
+        self._notify_updated(job)
+
+    def cancel(self, job_id):
+        """Cancel a queued, paused or running job"""
+        job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return
+        with self._cond:
+            was_running = job.state in (RUNNING, POSTPROCESSING)
+            job._pause_requested = False
+            job._cancel_requested = True
+            job._cancel_token.cancel()
+            if not was_running:
+                job.state = CANCELLED
+        if not was_running:
+            self._notify_finished(job)
+
+    def retry(self, job_id):
+        """Queue a failed (or waiting to retry) job again right away"""
+        job = self.jobs.get(job_id)
+        if job is None or job.state not in (FAILED, RETRYING):
+            return
+        with self._cond:
+            if job.state == FAILED:
+                job.attempts = 0
+                self._register_pending(job)
+            job.state = QUEUED
+            job.next_attempt_at = None
+            job._cancel_token = CancelToken()
+            self._push(job)
+        self._notify_updated(job)
+
+    def move_to_top(self, job_id):
+        """Give a job a higher priority than everything else in the queue"""
+        job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return
+        with self._cond:
+            job.priority = max(other.priority for other in self.jobs.values()) + 1
+            if job.state == QUEUED:
+                self._push(job)
+        self._notify_updated(job)
+
+    def remove_finished(self):
+        """Forget completed, failed and cancelled jobs"""
+        with self._cond:
+            finished = [job for job in self.jobs.values() if job.finished]
+            for job in finished:
+                del self.jobs[job.id]
+        if self.staging is not None:
+            # Failed jobs kept their partial files in case they were retried
+            for job in finished:
+                if job.state == FAILED:
+                    self.staging.release(job)
+        if self.job_store is not None:
+            for job in finished:
+                self.job_store.delete(job)
+
+    def active_count(self):
+        return sum(1 for job in self.jobs.values() if job.state == RUNNING)
+
+    def shutdown(self, cancel_running=True):
+        """Stop the workers, optionally stopping running downloads"""
+        with self._cond:
+            self._shutdown = True
+            if cancel_running:
+                for job in self.jobs.values():
+                    if job.state in (RUNNING, POSTPROCESSING):
+                        job._cancel_token.cancel()
+                # Also stops the yt-dlp process listing the playlist
+                for collection in self.collections.values():
+                    collection._cancel_token.cancel()
+            self._cond.notify_all()
+
+    def _push(self, job):
+        if self._held is not None and job in self._held:
+            return  # queued by release_new_jobs()
+        # Re-pushing on a priority change leaves a stale entry behind; _next_job skips it
+        heapq.heappush(self._heap, (-job.priority, next(self._sequence), job))
+        self._cond.notify()
+
+    def _host_limit(self, host):
+        return self.host_limits.get(host, self.per_host_limit)
+
+    def _next_job(self):
+        """Pop the highest priority job whose host is below its limit (lock held)"""
+        skipped = []
+        job = None
+        while self._heap:
+            priority, sequence, candidate = heapq.heappop(self._heap)
+            if candidate.state != QUEUED or -priority != candidate.priority:
+                continue
+            if self._host_counts[candidate.host] >= self._host_limit(candidate.host):
+                skipped.append((priority, sequence, candidate))
+                continue
+            job = candidate
+            break
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return job
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                job = None
+                while job is None:
+                    if self._shutdown or self._worker_count > self._max_workers:
+                        self._worker_count -= 1
+                        return
+                    job = self._next_job()
+                    if job is None:
+                        self._cond.wait()
+                job.state = RUNNING
+                self._host_counts[job.host] += 1
+            self._notify_updated(job)
+
+            try:
+                self._run_job(job)
+            finally:
+                with self._cond:
+                    self._host_counts[job.host] -= 1
+                    self._cond.notify_all()
+                if job.finished:
+                    self._notify_finished(job)
+                else:
+                    if self.staging is not None and job.state != POSTPROCESSING:
+                        # Paused or retrying: the .part files wait in the staging directory
+                        self.staging.release(job, keep_files=True)
+                    self._notify_updated(job)
+            if job.state == POSTPROCESSING:
+                self._start_postprocess(job)
+
+    def _run_job(self, job):
+        """Download one job, leaving it in its final (or paused) state"""
+        job.progress = {}
+        try:
+            # Get title and thumbnail info first (shared with the preview probe)
+            self._enter_phase(job, "probe")
+            info = self.metadata_cache.get(job.url, job._cancel_token)
+            if info and self._skip_probed_duplicate(job, info):
+                self._end_phase(job)
+                return
+            download_path = self._download_path(job, info)
+            if info:
+                job.title = info['title']
+                if info['thumbnail']:
+                    self._enter_phase(job, "thumbnail")
+                    self._fetch_thumbnail(job, info['thumbnail'], download_path)
+            self._notify_updated(job)
+
+            self._enter_phase(job, "transfer")
+            if self.bandwidth is not None:
+                self.bandwidth.job_started()
+            try:
+                result = self.engine.download(
+                    job.url, download_path, job.format_option,
+                    on_progress=lambda record: self._on_progress(job, record),
+                    on_log=lambda line: self._on_log(job, line),
+                    on_thumbnail=lambda path: self._on_thumbnail(job, path),
+                    cancel_token=job._cancel_token,
+                    bandwidth=self.bandwidth,
+                    concurrent_fragments=self.concurrent_fragments.get(
+                        job.format_option, self.concurrent_fragments.get("default", 1)),
+                    formats=(info or {}).get('formats'),
+                    postprocess=self.postprocessor is None
+                )
+            finally:
+                if self.bandwidth is not None:
+                    self.bandwidth.job_finished()
+            self._end_phase(job)
+            job.result = result
+            if not job.title:
+                job.title = result['title']
+            job.percent = 100.0
+            if result.get('postprocess') is not None:
+                # The worker hands the job to the post-processing pool once its slot is free
+                job.state = POSTPROCESSING
+                job.message = "Waiting for post-processing"
+                return
+            self._publish(job)
+            self._end_phase(job)
+            self._complete(job)
+        except TaskCancelled:
+            self._end_phase(job, "cancelled")
+            if job._pause_requested or job._cancel_requested or not self._shutdown:
+                job.state = PAUSED if job._pause_requested else CANCELLED
+                job.message = f"Download {job.state.lower()}"
+            else:
+                # Stopped by shutdown(): leave it queued in the job store for the next run
+                job.state = QUEUED
+                job.message = "Download interrupted"
+        except Exception as e:
+            self._end_phase(job, str(e))
+            job.attempts += 1
+            job.message = f"An error occurred: {str(e)}"
+            if job.attempts <= self.max_retries and is_transient_error(str(e)) and not self._shutdown:
+                delay = retry_delay(job.attempts, self.retry_base_delay, self.retry_max_delay)
+                with self._cond:
+                    self._schedule_retry(job, delay)
+                job.message += f" (retry {job.attempts} of {self.max_retries} in {int(delay)}s)"
+            else:
+                job.state = FAILED
+
+    def _skip_probed_duplicate(self, job, info):
+        """Check a job again once its probe gives the archive ID, returning True if it was SKIPPED
+
+        Only non-YouTube URLs without cached metadata get a new ID here.
+        """
+        probed_id = archive_id(job.url, info)
+        if not probed_id or probed_id == job.archive_id:
+            return False
+        with self._cond:
+            self._release_pending(job)
+            job.archive_id = probed_id
+            duplicate = None if job.allow_duplicate else self.find_duplicate(probed_id, job.format_option)
+            if duplicate:
+                job.title = info['title']
+                job.state = SKIPPED
+                job.message = duplicate
+                return True
+            self._register_pending(job)
+        return False
+
+    def _download_path(self, job, info):
+        """Directory the engine writes to: the job's staging directory, or its output folder"""
+        estimate = estimate_download_size(info, job.format_option)
+        check_free_space(job.output_path, estimate)
+        if self.staging is None:
+            return job.output_path
+        return self.staging.acquire(job, estimate) or job.output_path
+
+    def _publish(self, job):
+        """Move a staged job's finished file to its output folder"""
+        if self.staging is None:
+            return
+        if job._span is None or job._span.phase != "move":
+            self._enter_phase(job, "move")
+        self.staging.publish(job, job.result)
+        job.result.update(file_details(job.result['filepath']))
+
+    def _complete(self, job):
+        if self.archive is not None and job.archive_id:
+            self.archive.add(job.archive_id, job.format_option)
+        job.state = COMPLETED
+        job.message = "Download completed successfully!"
+
+    def _start_postprocess(self, job):
+        future = self.postprocessor.submit(
+            job.result['postprocess'], job._cancel_token,
+            on_log=lambda line: self._on_log(job, line),
+            on_phase=lambda phase: self._enter_phase(job, phase)
+        )
+        future.add_done_callback(lambda future: self._postprocess_done(job, future))
+
+    def _postprocess_done(self, job, future):
+        # Runs on a post-processing pool thread
+        try:
+            output = future.result()
+        except (TaskCancelled, CancelledError):
+            self._end_phase(job, "cancelled")
+            if job._cancel_requested or not self._shutdown:
+                job.state = CANCELLED
+                job.message = "Download cancelled"
+            else:
+                # The streams are on disk; the next run re-downloads nothing and post-processes again
+                job.state = QUEUED
+                job.message = "Download interrupted"
+        except Exception as e:
+            self._end_phase(job, str(e))
+            job.state = FAILED
+            job.message = f"An error occurred: {str(e)}"
+        else:
+            job.result.update(file_details(output))
+            job.result['postprocess'] = None
+            try:
+                self._publish(job)
+            except Exception as e:
+                self._end_phase(job, str(e))
+                job.state = FAILED
+                job.message = f"An error occurred: {str(e)}"
+            else:
+                self._end_phase(job)
+                self._complete(job)
+        if job.finished:
+            self._notify_finished(job)
+        else:
+            self._notify_updated(job)
+
+    def _schedule_retry(self, job, delay):
+        """Put a job back in the queue after a delay (lock held)"""
+        job.state = RETRYING
+        job.next_attempt_at = time.time() + delay
+        timer = threading.Timer(delay, self._retry_due, args=(job, job.next_attempt_at))
+        timer.daemon = True
+        timer.start()
+
+    def _retry_due(self, job, next_attempt_at):
+        with self._cond:
+            # Ignore timers for jobs that were paused, cancelled or retried by hand meanwhile
+            if job.state != RETRYING or job.next_attempt_at != next_attempt_at or self._shutdown:
+                return
+            job.state = QUEUED
+            job.next_attempt_at = None
+            self._push(job)
+        self._notify_updated(job)
+
+    def _fetch_thumbnail(self, job, thumbnail_url, directory):
+        # A "/" in the title would otherwise point into a directory that doesn't exist
+        safe_title = job.title.replace('/', '_').replace(os.sep, '_')
+        thumbnail_filename = os.path.join(directory, f"{safe_title}_thumbnail.jpg")
+        try:
+            # Over the shared keep-alive pool, so a playlist reuses one connection
+            data = read_url(thumbnail_url, job._cancel_token)
+            with open(thumbnail_filename, 'wb') as f:
+                f.write(data)
+            job.thumbnail_path = thumbnail_filename
+            job._span.observe(len(data))
+        except TaskCancelled:
+            raise
+        except Exception as e:
+            print(f"Error downloading thumbnail: {e}")
+            self._end_phase(job, str(e))
+
+    def _enter_phase(self, job, phase):
+        """End the job's current span and start timing the next phase"""
+        self._end_phase(job)
+        job._span = self.metrics.start_span(job.id, phase, job.attempts)
+
+    def _end_phase(self, job, error=None):
+        span, job._span = job._span, None
+        if span is not None:
+            job.spans.append(self.metrics.finish_span(span, error))
+
+    def _on_progress(self, job, record):
+        # Progress can arrive many times a second per job; it is only recorded
+        # here and picked up by whoever polls drain_progress()
+        if record.get('percent') is not None:
+            job.percent = record['percent']
+        entering_postprocess = record.get('phase') == 'postprocess' and job.progress.get('phase') != 'postprocess'
+        if entering_postprocess:
+            # yt-dlp running ffmpeg itself ends the transfer
+            self._enter_phase(job, "postprocess")
+        elif job._span is not None:
+            job._span.observe(record.get('downloaded_bytes'), record.get('speed'), record.get('filename'))
+        job.progress = record
+        job.message = format_progress(record)
+        with self._progress_lock:
+            self._dirty.add(job.id)
+        if entering_postprocess:
+            self._persist(job)
+
+    def _on_log(self, job, line):
+        self.log.append((time.time(), job.id, line))
+
+    def drain_progress(self):
+        """Return the jobs whose progress changed since the last call"""
+        with self._progress_lock:
+            dirty, self._dirty = self._dirty, set()
+        return [self.jobs[job_id] for job_id in dirty if job_id in self.jobs]
+
+    def log_lines(self, job_ids=None):
+        """Lines from the raw log ring buffer, optionally only for some jobs"""
+        return [
+            f"{time.strftime('%H:%M:%S', time.localtime(timestamp))} [{job_id}] {line}"
+            for timestamp, job_id, line in list(self.log)
+            if job_ids is None or job_id in job_ids
+        ]
+
+    def _on_thumbnail(self, job, path):
+        # Use the thumbnail written by yt-dlp if we couldn't fetch one ourselves
+        if not job.thumbnail_path:
+            job.thumbnail_path = path
+            self._notify_updated(job)
+
+    def _persist(self, job):
+        if self.job_store is None:
+            return
+        try:
+            if job.state in (COMPLETED, CANCELLED, SKIPPED):
+                self.job_store.delete(job)
+            else:
+                self.job_store.save(job)
+        except Exception as e:
+            print(f"Error saving job state: {e}")
+
+    def _notify_updated(self, job):
+        self._persist(job)
+        if self.on_job_updated is not None:
+            self.on_job_updated(job)
+
+    def _notify_collection(self, collection):
+        if self.on_collection_updated is not None:
+            self.on_collection_updated(collection)
+
+    def _notify_finished(self, job):
+        with self._cond:
+            self._release_pending(job)
+        if self.staging is not None:
+            self.staging.release(job, keep_files=job.state == FAILED)
+        self._persist(job)
+        self.metrics.job_finished(job)
+        if self.on_job_finished is not None:
+            self.on_job_finished(job)
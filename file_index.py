@@ -0,0 +1,155 @@
+import os
+import threading
+
+# Values of a history record's 'file_state'
+PRESENT = "present"
+MISSING = "missing"
+
+MEDIA_EXTENSIONS = ('.mp4', '.mp3', '.m4a', '.webm', '.mkv', '.opus')
+
+
+class FileIndex:
+    """Finds downloaded files from the paths recorded in the download history
+
+    Looking up a record costs one stat of its recorded path. A file that is
+    no longer there is looked for under the same name in the other folders
+    downloads went to (it was moved between them) and is otherwise marked
+    missing. Records from before exact paths were recorded are resolved by
+    title once, and the path found is written back to the history. Files
+    downloaded by a worker node (records with a 'node') are on that node's
+    disk and are left alone.
+    """
+    def __init__(self, history_store):
+        self.history_store = history_store
+        self._folders = set()
+        # add_records runs on the GUI thread while verify runs on a worker
+        self._folders_lock = threading.Lock()
+        # (folder, title) -> the folder's mtime when the title wasn't found in it
+        self._legacy_misses = {}
+
+    def add_records(self, records):
+        """Remember the download folders of these records as places files may move to"""
+        with self._folders_lock:
+            for record in records:
+                if record.get('node'):
+                    continue
+                if record.get('path'):
+                    self._folders.add(record['path'])
+                if record.get('filepath'):
+                    self._folders.add(os.path.dirname(record['filepath']))
+
+    def locate(self, record):
+        """Return the path of a record's file, or None, updating the record if it moved"""
+        if record.get('node'):
+            return None
+        changes = self._check(record, resolve_legacy=True)
+        if changes:
+            record.update(changes)
+            self.history_store.update(record['id'], **changes)
+        if record.get('file_state') == MISSING:
+            return None
+        return record.get('filepath') or None
+
+    def verify(self, cancel_token, records):
+        """Re-check every record with a recorded path, returning [(record id, changes)]
+
+        Takes the cancel token first, like every BackgroundTasks function.
+        Changes are saved to the history but not applied to the record dicts,
+        so this can run on a worker thread while the GUI owns the records.
+        """
+        updates = []
+        for record in records:
+            if cancel_token is not None:
+                cancel_token.check()
+            if not record.get('filepath') or record.get('node'):
+                continue
+            changes = self._check(record, resolve_legacy=False)
+            if changes:
+                updates.append((record['id'], changes))
+        if updates:
+            self.history_store.update_many(updates)
+        return updates
+
+    def _check(self, record, resolve_legacy):
+        """Fields of the record that need to change to match the disk"""
+        filepath = record.get('filepath')
+        if not filepath:
+            filepath = self._resolve_legacy(record) if resolve_legacy else None
+            if filepath is None:
+                return {}
+            return self._found(filepath)
+
+        stat = _stat(filepath)
+        if stat is not None:
+            if record.get('file_state') == MISSING or record.get('filesize') != stat.st_size:
+                return self._found(filepath, stat)
+            return {}
+
+        moved = self._find_moved(record)
+        if moved is not None:
+            return self._found(moved)
+        if record.get('file_state') != MISSING:
+            return {'file_state': MISSING}
+        return {}
+
+    def _found(self, filepath, stat=None):
+        stat = stat or _stat(filepath)
+        with self._folders_lock:
+            self._folders.add(os.path.dirname(filepath))
+        return {
+            'filepath': filepath,
+            'filesize': stat.st_size if stat else None,
+            'mtime': stat.st_mtime if stat else None,
+            'file_state': PRESENT,
+        }
+
+    def _find_moved(self, record):
+        name = os.path.basename(record['filepath'])
+        with self._folders_lock:
+            folders = self._folders | {record.get('path') or ""}
+        for folder in folders:
+            candidate = os.path.join(folder, name)
+            if candidate == record['filepath']:
+                continue
+            stat = _stat(candidate)
+            if stat is not None and record.get('filesize') in (None, stat.st_size):
+                return candidate
+        return None
+
+    def _resolve_legacy(self, record):
+        """Find the file of a record saved before paths were recorded
+
+        A folder is scanned at most once per title until it changes: a miss
+        is remembered with the folder's mtime, which adding or renaming a
+        file updates. An unreadable folder counts as empty.
+        """
+        folder = record.get('path') or ""
+        title = record.get('title') or ""
+        stat = _stat(folder) if folder and title else None
+        if stat is None or not os.path.isdir(folder):
+            return None
+        if self._legacy_misses.get((folder, title)) == stat.st_mtime:
+            return None
+        extensions = ('.mp3', '.m4a', '.opus') if "Audio Only" in record.get('format', '') else ('.mp4', '.webm', '.mkv')
+        for extension in extensions:
+            candidate = os.path.join(folder, title + extension)
+            if os.path.exists(candidate):
+                return candidate
+        title_lower = title.lower()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    name = entry.name.lower()
+                    if title_lower in name and name.endswith(MEDIA_EXTENSIONS):
+                        return entry.path
+        except OSError:
+            pass
+        self._legacy_misses[(folder, title)] = stat.st_mtime
+        return None
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
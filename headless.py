@@ -0,0 +1,309 @@
+"""Headless batch and daemon modes for machines without a display
+
+Both modes use the same download queue, engine, metadata cache and
+history as the GUI, but never import Qt.
+
+    python youtube_downloader.py --batch jobs.jsonl --results results.jsonl
+    python youtube_downloader.py --daemon --inbox /srv/porygon/inbox
+    python youtube_downloader.py --worker http://controller:8765 --slots 4
+
+Each job line is a JSON object such as
+{"url": "...", "format": "Audio Only (mp3)", "output": "/srv/media", "id": "job-1"};
+a bare URL on its own line is accepted as well. Videos already in the
+download archive for the job's format are reported as "Skipped" unless
+the job sets "allow_duplicate": true. In worker mode the jobs come from a
+coordinator instead (see cluster.py).
+"""
+import os
+import sys
+import json
+import signal
+import argparse
+import datetime
+import threading
+
+from video_metadata import MetadataCache, is_collection_url
+from download_engine import create_engine, FORMAT_OPTIONS
+from download_queue import DownloadQueue, COMPLETED, SKIPPED
+from history_store import HistoryStore, make_history_record
+from job_store import JobStore
+from download_archive import DownloadArchive
+from bandwidth import scheduler_from_settings
+from staging import staging_from_settings
+from postprocess import PostProcessPool
+from metrics import JobMetrics, start_metrics_server
+from settings import load_settings, app_data_dir
+
+APP_DIR = app_data_dir()
+
+HEADLESS_FLAGS = ("--batch", "--daemon", "--worker")
+
+
+def wants_headless(argv):
+    """Return True if the command line asks for a headless mode"""
+    return any(arg.split('=')[0] in HEADLESS_FLAGS for arg in argv)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="youtube_downloader.py",
+        description="Download videos without the GUI"
+    )
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--batch", metavar="JOBS",
+                      help="JSONL file of jobs to download, or - to read them from stdin")
+    mode.add_argument("--daemon", action="store_true",
+                      help="keep running and download every *.jsonl file dropped into the inbox")
+    mode.add_argument("--worker", metavar="URL",
+                      help="keep running and download the jobs handed out by the coordinator at URL")
+    parser.add_argument("--inbox", default=os.path.join(APP_DIR, "inbox"),
+                        help="directory watched in daemon mode (default: %(default)s)")
+    parser.add_argument("--results", metavar="FILE",
+                        help="JSONL file results are appended to (default: stdout)")
+    parser.add_argument("--parallel", type=int,
+                        help="number of simultaneous downloads (default: max_concurrent_downloads setting)")
+    parser.add_argument("--format", default=FORMAT_OPTIONS[0], choices=FORMAT_OPTIONS,
+                        help="format for jobs that don't specify one (default: %(default)s)")
+    parser.add_argument("--output", default=os.path.expanduser("~/Downloads"),
+                        help="output folder for jobs that don't specify one (default: %(default)s)")
+    parser.add_argument("--poll-interval", type=float, default=2.0,
+                        help="seconds between inbox scans in daemon mode (default: %(default)s)")
+    parser.add_argument("--name",
+                        help="name this worker reports to the coordinator (default: the host name)")
+    parser.add_argument("--slots", type=int,
+                        help="jobs this worker takes at once (default: the number of simultaneous downloads)")
+    parser.add_argument("--token", default=os.environ.get("PORYGON_CLUSTER_TOKEN"),
+                        help="shared secret the coordinator expects (default: $PORYGON_CLUSTER_TOKEN)")
+    return parser
+
+
+def parse_job_spec(line, default_format, default_output):
+    """Parse one JSONL job line, returning None for blank lines and comments"""
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    spec = json.loads(line) if line.startswith('{') else {"url": line}
+    if not spec.get("url"):
+        raise ValueError("job has no url")
+    spec.setdefault("format", default_format)
+    spec.setdefault("output", default_output)
+    spec.setdefault("priority", 0)
+    if spec["format"] not in FORMAT_OPTIONS:
+        raise ValueError(f"unknown format {spec['format']!r}")
+    return spec
+
+
+class HeadlessRunner:
+    """Feeds job specs into a DownloadQueue and writes one JSONL result per video"""
+    def __init__(self, args):
+        self.args = args
+        settings = load_settings(os.path.join(APP_DIR, "settings.json"))
+        self.history_store = HistoryStore(
+            os.path.join(APP_DIR, "download_history.sqlite3"),
+            legacy_json_file=os.path.join(APP_DIR, "download_history.json")
+        )
+        self.metadata_cache = MetadataCache(os.path.join(APP_DIR, "metadata_cache.json"))
+        self.archive = DownloadArchive(os.path.join(APP_DIR, "download_archive"))
+        if self.archive.is_new:
+            self.archive.import_history(self.history_store.load())
+
+        self.results = open(args.results, 'a') if args.results else sys.stdout
+        self.failures = 0
+        self.result_listeners = []  # called with each result after it is written
+        # Jobs and collections whose callbacks have run: their state is final
+        # a moment before the result is written
+        self._reported = set()  # job ids and ("collection", id)
+        self._cond = threading.Condition()
+
+        self.postprocess_pool = PostProcessPool(settings["postprocess_workers"])
+        self.metrics = JobMetrics(
+            trace_file=os.path.join(APP_DIR, "trace.jsonl"),
+            prometheus_file=os.path.join(APP_DIR, "metrics.prom")
+        )
+        self.metrics_server = start_metrics_server(self.metrics, settings["metrics_port"])
+
+        self.queue = DownloadQueue(
+            create_engine(), self.metadata_cache,
+            max_workers=args.parallel or settings["max_concurrent_downloads"],
+            per_host_limit=settings["per_host_limit"],
+            host_limits=settings["host_limits"],
+            on_job_finished=self.on_job_finished,
+            on_collection_updated=self.on_collection_updated,
+            # A batch is re-run by running its file again, and a worker's jobs
+            # belong to its coordinator; the daemon keeps its unfinished jobs
+            # (in the GUI's job store) across restarts
+            job_store=JobStore(self.history_store.db_file) if args.daemon else None,
+            max_retries=settings["max_retries"],
+            retry_base_delay=settings["retry_base_delay"],
+            retry_max_delay=settings["retry_max_delay"],
+            archive=self.archive,
+            bandwidth=scheduler_from_settings(settings),
+            concurrent_fragments=settings["concurrent_fragments"],
+            postprocessor=self.postprocess_pool,
+            metrics=self.metrics,
+            staging=staging_from_settings(settings)
+        )
+        self.queue.restore()
+
+    def submit(self, spec):
+        """Queue a job spec (a single video or a whole playlist), returning the job or collection"""
+        # The spec's id goes in as the tag: a job the archive skips is
+        # reported before enqueue returns
+        if is_collection_url(spec["url"]):
+            return self.queue.enqueue_collection(spec["url"], spec["output"], spec["format"], spec["priority"],
+                                                 tag=spec.get("id"))
+        return self.queue.enqueue(spec["url"], spec["output"], spec["format"], spec["priority"],
+                                  allow_duplicate=bool(spec.get("allow_duplicate")), tag=spec.get("id"))
+
+    def submit_file(self, jobs_file):
+        """Queue every job in a JSONL file; invalid lines are reported as failed results"""
+        for line_number, line in enumerate(jobs_file, 1):
+            try:
+                spec = parse_job_spec(line, self.args.format, self.args.output)
+            except ValueError as e:
+                self.write_result({"line": line_number, "state": "Invalid", "message": str(e)})
+                self.failures += 1
+                continue
+            if spec is not None:
+                self.submit(spec)
+
+    def on_job_finished(self, job):
+        # Runs on a queue worker thread
+        with self._cond:
+            if job.collection_id is not None:
+                spec_id = self.queue.collections[job.collection_id].tag
+            else:
+                spec_id = job.tag
+            if job.state == COMPLETED:
+                self.history_store.append(make_history_record(job))
+            elif job.state != SKIPPED:
+                self.failures += 1
+            result = job.result or {}
+            self._reported.add(job.id)
+            self.write_result({
+                "id": spec_id,
+                "url": job.url,
+                "state": job.state,
+                "title": job.title,
+                "format": job.format_option,
+                "output": job.output_path,
+                "filepath": result.get('filepath'),
+                "filesize": result.get('filesize'),
+                "mtime": result.get('mtime'),
+                "message": job.message,
+                "attempts": job.attempts,
+                "spans": job.spans,
+                "finished_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            })
+            self._cond.notify_all()
+
+    def on_collection_updated(self, collection):
+        if not collection.done:
+            return
+        with self._cond:
+            self._reported.add(("collection", collection.id))
+            if collection.error:
+                self.failures += 1
+                self.write_result({
+                    "id": collection.tag,
+                    "url": collection.url,
+                    "state": "Failed",
+                    "message": f"Playlist expansion failed: {collection.error}",
+                })
+            self._cond.notify_all()
+
+    def write_result(self, result):
+        self.results.write(json.dumps(result) + "\n")
+        self.results.flush()
+        for listener in self.result_listeners:
+            listener(result)
+
+    def idle(self):
+        """True once every queued job has finished and every playlist is expanded, with their results written"""
+        return (all(job.id in self._reported for job in list(self.queue.jobs.values()))
+                and all(("collection", collection.id) in self._reported
+                        for collection in list(self.queue.collections.values())))
+
+    def wait_until_idle(self, stop_event=None):
+        with self._cond:
+            while not self.idle():
+                if stop_event is not None and stop_event.is_set():
+                    return
+                self._cond.wait(1.0)
+
+    def close(self):
+        self.queue.shutdown()
+        self.postprocess_pool.shutdown()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        self.metrics.close()
+        if self.results is not sys.stdout:
+            self.results.close()
+
+
+def run_batch(runner, jobs_path):
+    """Download every job in a JSONL file and exit once they have all finished"""
+    if jobs_path == "-":
+        runner.submit_file(sys.stdin)
+    else:
+        with open(jobs_path, 'r') as f:
+            runner.submit_file(f)
+    runner.wait_until_idle()
+    return 0 if runner.failures == 0 else 1
+
+
+def run_daemon(runner, inbox, poll_interval):
+    """Watch the inbox for *.jsonl job files until SIGINT or SIGTERM
+
+    A file is claimed by renaming it to *.processing and renamed to *.done
+    once its jobs are queued, so several daemons can share one inbox.
+    """
+    os.makedirs(inbox, exist_ok=True)
+    stop_event = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop_event.set())
+
+    print(f"Watching {inbox} for job files", file=sys.stderr)
+    while not stop_event.is_set():
+        job_files = sorted(
+            (entry for entry in os.scandir(inbox) if entry.name.endswith(".jsonl") and entry.is_file()),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in job_files:
+            claimed = entry.path + ".processing"
+            try:
+                os.replace(entry.path, claimed)
+            except OSError:
+                continue  # another daemon claimed it first
+            with open(claimed, 'r') as f:
+                runner.submit_file(f)
+            os.replace(claimed, entry.path[:-len(".jsonl")] + ".done")
+        stop_event.wait(poll_interval)
+    return 0
+
+
+def run_worker(runner, args):
+    """Download jobs from a coordinator until SIGINT or SIGTERM"""
+    from cluster import WorkerNode
+    stop_event = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop_event.set())
+    node = WorkerNode(runner, args.worker, name=args.name, slots=args.slots, token=args.token)
+    return node.run(stop_event)
+
+
+def main(argv):
+    args = build_parser().parse_args(argv)
+    runner = HeadlessRunner(args)
+    try:
+        if args.daemon:
+            return run_daemon(runner, args.inbox, args.poll_interval)
+        if args.worker:
+            return run_worker(runner, args)
+        return run_batch(runner, args.batch)
+    finally:
+        runner.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,131 @@
+"""In-memory search index over the download history
+
+Titles and URLs are split into lowercase word tokens. Each token keeps the
+set of record ids containing it, and the token vocabulary has its own
+trigram index, so a query term matches every token it is a substring of
+without scanning the records. Format, output folder and date are facets.
+The index is updated record by record as history pages load and downloads
+finish. Sorted structures are appended to and only re-sorted by the next
+search, as history pages arrive newest first.
+"""
+import re
+import bisect
+from collections import defaultdict
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall((text or "").casefold())
+
+
+def trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+class HistorySearchIndex:
+    """Token/trigram index on title and URL, with format, folder and date facets"""
+    def __init__(self):
+        self.postings = defaultdict(set)  # token -> record ids
+        self.token_trigrams = defaultdict(set)  # trigram -> tokens containing it
+        self.vocabulary = []  # every token, for prefix lookups of short terms
+        self.formats = defaultdict(set)  # format option -> record ids
+        self.folders = defaultdict(set)  # output folder -> record ids
+        self.records = {}  # record id -> record
+        self.by_date = []  # (date, record id)
+        self._unsorted = False  # vocabulary and by_date need sorting
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, record):
+        """Index a record (which must have its 'id')"""
+        record_id = record['id']
+        if record_id in self.records:
+            return
+        for token in set(tokenize(record.get('title')) + tokenize(record.get('url'))):
+            postings = self.postings.get(token)
+            if postings is None:
+                postings = self.postings[token] = set()
+                self.vocabulary.append(token)
+                for trigram in trigrams(token):
+                    self.token_trigrams[trigram].add(token)
+            postings.add(record_id)
+        self.formats[record.get('format', '')].add(record_id)
+        self.folders[record.get('path', '')].add(record_id)
+        self.records[record_id] = record
+        self.by_date.append((record.get('date', ''), record_id))
+        self._unsorted = True
+
+    def add_many(self, records):
+        for record in records:
+            self.add(record)
+
+    def matching_tokens(self, term):
+        """Tokens that contain the term"""
+        if len(term) < 3:
+            # Too short for trigrams: tokens that start with it
+            start = bisect.bisect_left(self.vocabulary, term)
+            end = bisect.bisect_left(self.vocabulary, term + "\U0010ffff")
+            return self.vocabulary[start:end]
+        candidates = None
+        for trigram in trigrams(term):
+            tokens = self.token_trigrams.get(trigram)
+            if not tokens:
+                return []
+            candidates = set(tokens) if candidates is None else candidates & tokens
+        return [token for token in candidates if term in token]
+
+    def matches(self, record, query="", format_option=None, folder=None, date_from=None, date_to=None):
+        """Whether a single record passes search() with the same arguments"""
+        tokens = set(tokenize(record.get('title')) + tokenize(record.get('url')))
+        for term in tokenize(query):
+            if not any(term in token if len(term) >= 3 else token.startswith(term) for token in tokens):
+                return False
+        if format_option is not None and record.get('format', '') != format_option:
+            return False
+        if folder is not None and record.get('path', '') != folder:
+            return False
+        date = record.get('date', '')
+        return (date_from is None or date >= date_from) and (date_to is None or date < date_to)
+
+    def search(self, query="", format_option=None, folder=None, date_from=None, date_to=None):
+        """Return the matching records sorted by id, or None when nothing filters the history
+
+        Every word of the query must appear in the title or URL (as part of
+        a word). date_from/date_to are 'YYYY-MM-DD...' strings; date_to is
+        exclusive.
+        """
+        if self._unsorted:
+            self.vocabulary.sort()
+            self.by_date.sort()
+            self._unsorted = False
+        result = None
+
+        def narrow(ids):
+            nonlocal result
+            result = set(ids) if result is None else result & ids
+
+        for term in tokenize(query):
+            ids = set()
+            for token in self.matching_tokens(term):
+                ids |= self.postings[token]
+            narrow(ids)
+            if not result:
+                return []
+        if format_option is not None:
+            narrow(self.formats.get(format_option, set()))
+        if folder is not None:
+            narrow(self.folders.get(folder, set()))
+
+        if date_from is not None or date_to is not None:
+            low, high = date_from or "", date_to or "\U0010ffff"
+            if result is None:
+                start = bisect.bisect_left(self.by_date, (low,))
+                end = bisect.bisect_left(self.by_date, (high,))
+                result = {record_id for _, record_id in self.by_date[start:end]}
+            else:
+                result = {record_id for record_id in result if low <= self.records[record_id].get('date', '') < high}
+        if result is None:
+            return None
+        return [self.records[record_id] for record_id in sorted(result)]
@@ -0,0 +1,200 @@
+import os
+import json
+import sqlite3
+import datetime
+import threading
+
+from video_metadata import extract_video_id
+
+# Record fields stored in their own columns; anything else goes into the extra JSON column
+COLUMNS = ("video_id", "url", "title", "date", "format", "path", "thumbnail")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    video_id TEXT,
+    url TEXT NOT NULL,
+    title TEXT,
+    date TEXT,
+    format TEXT,
+    path TEXT,
+    thumbnail TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS downloads_video_id ON downloads (video_id);
+CREATE INDEX IF NOT EXISTS downloads_url ON downloads (url);
+CREATE INDEX IF NOT EXISTS downloads_date ON downloads (date);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Checkpoint the write-ahead log after this many writes
+CHECKPOINT_INTERVAL = 500
+
+
+def make_history_record(job):
+    """Build the history entry for a completed download job"""
+    result = job.result or {}
+    return {
+        "title": job.title if job.title else "Unknown Title",
+        "url": job.url,
+        "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "format": job.format_option,
+        "path": job.output_path,
+        "thumbnail": job.thumbnail_path if job.thumbnail_path and os.path.exists(job.thumbnail_path) else "",
+        # Exact file written by yt-dlp, so it can be opened without searching the folder
+        "filepath": result.get("filepath") or "",
+        "filesize": result.get("filesize"),
+        "mtime": result.get("mtime"),
+    }
+
+
+class HistoryStore:
+    """Download history in an SQLite database indexed by video ID, URL and date
+
+    Every download is a single-row insert and thumbnail backfills are
+    single-row updates, so the cost of recording an event doesn't grow with
+    the size of the history. WAL journaling keeps the database consistent if
+    the app crashes mid-write. The old download_history.json is imported
+    once and then left untouched as a backup.
+    """
+    def __init__(self, db_file, legacy_json_file=None):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        if legacy_json_file:
+            self.migrate_json(legacy_json_file)
+
+    def migrate_json(self, json_file):
+        """Import download_history.json the first time the database is opened"""
+        if self._get_meta("migrated_json") or not os.path.exists(json_file):
+            return 0
+        try:
+            with open(json_file, 'r') as f:
+                records = json.load(f)
+        except Exception as e:
+            print(f"Error loading history: {e}")
+            return 0
+
+        with self._lock, self._conn:
+            for record in records:
+                self._conn.execute(*self._insert_statement(record))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_json', ?)",
+                (os.path.abspath(json_file),)
+            )
+        return len(records)
+
+    def load(self):
+        """Return every record, oldest first"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM downloads ORDER BY id").fetchall()
+        return [self._row_to_record(row) for row in rows]
+
+    def load_page(self, before_id=None, limit=1000):
+        """Return up to limit records older than before_id (or the newest ones), newest first"""
+        if before_id is None:
+            return self._query("SELECT * FROM downloads ORDER BY id DESC LIMIT ?", (limit,))
+        return self._query("SELECT * FROM downloads WHERE id < ? ORDER BY id DESC LIMIT ?", (before_id, limit))
+
+    def append(self, record):
+        """Insert a record, setting its 'id' and 'video_id' keys"""
+        record.setdefault("video_id", extract_video_id(record.get("url", "")))
+        with self._lock, self._conn:
+            cursor = self._conn.execute(*self._insert_statement(record))
+            record["id"] = cursor.lastrowid
+        self._after_write()
+        return record
+
+    def update(self, record_id, **fields):
+        """Change some fields of a single record"""
+        self.update_many([(record_id, fields)])
+
+    def update_many(self, updates):
+        """Apply several (record_id, fields) updates in one transaction"""
+        with self._lock, self._conn:
+            for record_id, fields in updates:
+                self._update_locked(record_id, fields)
+        self._after_write()
+
+    def find_by_video_id(self, video_id):
+        return self._query("SELECT * FROM downloads WHERE video_id = ? ORDER BY id", (video_id,))
+
+    def find_by_url(self, url):
+        return self._query("SELECT * FROM downloads WHERE url = ? ORDER BY id", (url,))
+
+    def find_by_date(self, start, end):
+        """Records with start <= date < end (dates as 'YYYY-MM-DD HH:MM:SS' strings)"""
+        return self._query("SELECT * FROM downloads WHERE date >= ? AND date < ? ORDER BY id", (start, end))
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM downloads").fetchone()[0]
+
+    def compact(self):
+        """Fold the write-ahead log into the database and reclaim free pages"""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            free_pages = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+            total_pages = self._conn.execute("PRAGMA page_count").fetchone()[0]
+            if total_pages and free_pages > total_pages // 4:
+                self._conn.execute("VACUUM")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _after_write(self):
+        self._writes += 1
+        if self._writes % CHECKPOINT_INTERVAL == 0:
+            self.compact()
+
+    def _insert_statement(self, record):
+        extra = {key: value for key, value in record.items() if key not in COLUMNS and key != "id"}
+        values = [record.get(column) for column in COLUMNS]
+        if values[0] is None:
+            values[0] = extract_video_id(record.get("url", ""))
+        values[1] = values[1] or ""
+        return (
+            f"INSERT INTO downloads ({', '.join(COLUMNS)}, extra) VALUES ({', '.join('?' * (len(COLUMNS) + 1))})",
+            values + [json.dumps(extra) if extra else None]
+        )
+
+    def _update_locked(self, record_id, fields):
+        columns = {key: value for key, value in fields.items() if key in COLUMNS}
+        extra_fields = {key: value for key, value in fields.items() if key not in COLUMNS and key != "id"}
+        if extra_fields:
+            row = self._conn.execute("SELECT extra FROM downloads WHERE id = ?", (record_id,)).fetchone()
+            extra = json.loads(row["extra"]) if row and row["extra"] else {}
+            extra.update(extra_fields)
+            columns["extra"] = json.dumps(extra)
+        if columns:
+            assignments = ", ".join(f"{key} = ?" for key in columns)
+            self._conn.execute(f"UPDATE downloads SET {assignments} WHERE id = ?", list(columns.values()) + [record_id])
+
+    def _query(self, sql, params):
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._row_to_record(row) for row in rows]
+
+    def _get_meta(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    @staticmethod
+    def _row_to_record(row):
+        record = {"id": row["id"]}
+        for column in COLUMNS:
+            record[column] = row[column] if row[column] is not None else ""
+        if row["extra"]:
+            record.update(json.loads(row["extra"]))
+        return record
@@ -0,0 +1,171 @@
+"""Shared keep-alive HTTP client for thumbnails and other small downloads
+
+Connections are kept open per (scheme, host, port) and reused, so fetching
+many thumbnails from the same CDN costs one TLS handshake instead of one
+per image. A semaphore bounds the number of requests in flight across all
+threads. Conditional requests (If-None-Match / If-Modified-Since) let
+callers revalidate something they already have without downloading it.
+"""
+import threading
+from collections import namedtuple
+from urllib.parse import urlsplit, urljoin
+
+# Response statuses followed to their Location
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+# Errors meaning a reused keep-alive connection was closed by the server
+# (imported lazily with http.client, see _stale_connection_errors)
+_STALE_ERRORS = None
+
+Response = namedtuple("Response", "status headers body")
+
+
+class HTTPError(Exception):
+    """A request that finished with an error status"""
+    def __init__(self, url, status):
+        super().__init__(f"HTTP {status} for {url}")
+        self.url = url
+        self.status = status
+
+
+def _stale_connection_errors():
+    global _STALE_ERRORS
+    if _STALE_ERRORS is None:
+        import http.client
+        _STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                         ConnectionResetError, BrokenPipeError)
+    return _STALE_ERRORS
+
+
+class HttpPool:
+    """Thread-safe pool of keep-alive connections with bounded concurrency
+
+    At most max_requests requests run at once; up to max_idle_per_host
+    finished connections per host are kept for reuse.
+    """
+    def __init__(self, max_requests=8, max_idle_per_host=4, timeout=15, user_agent="Porygon"):
+        self.timeout = timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.user_agent = user_agent
+        self._slots = threading.BoundedSemaphore(max_requests)
+        self._idle = {}  # (scheme, host, port) -> [connection]
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+
+    def get(self, url, cancel_token=None, etag=None, last_modified=None,
+            max_redirects=5, chunk_size=64 * 1024):
+        """GET a URL, returning a Response (status 200, or 304 when revalidated)
+
+        etag/last_modified make the request conditional. Redirects are
+        followed; other error statuses raise HTTPError. The body is read in
+        chunks, checking cancel_token between them.
+        """
+        headers = {"User-Agent": self.user_agent, "Accept-Encoding": "identity"}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        for _ in range(max_redirects + 1):
+            if cancel_token is not None:
+                cancel_token.check()
+            with self._slots:
+                status, response_headers, body = self._request(url, headers, cancel_token, chunk_size)
+            if status in REDIRECT_STATUSES and response_headers.get("location"):
+                url = urljoin(url, response_headers["location"])
+                continue
+            if status != 304 and not 200 <= status < 300:
+                raise HTTPError(url, status)
+            return Response(status, response_headers, body)
+        raise HTTPError(url, status)
+
+    def read(self, url, cancel_token=None):
+        """GET a URL and return its body"""
+        return self.get(url, cancel_token).body
+
+    def close(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def _request(self, url, headers, cancel_token, chunk_size):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"unsupported URL scheme: {url}")
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        # A reused connection may have been closed by the server in the
+        # meantime; that is only worth one retry on a fresh connection
+        connection, reused = self._checkout(key)
+        try:
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+            except _stale_connection_errors():
+                connection.close()
+                if not reused:
+                    raise
+                connection, reused = self._open(key), False
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+
+            chunks = []
+            while True:
+                if cancel_token is not None:
+                    cancel_token.check()
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            response_headers = {name.lower(): value for name, value in response.getheaders()}
+        except BaseException:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._checkin(key, connection)
+        return response.status, response_headers, b"".join(chunks)
+
+    def _checkout(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._open(key), False
+
+    def _checkin(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def _open(self, key):
+        import http.client  # imported on first use: it pulls in ssl
+        scheme, host, port = key
+        connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        with self._lock:
+            self.connections_opened += 1
+        return connection_class(host, port, timeout=self.timeout)
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def shared_pool():
+    """The process-wide HttpPool used by read_url and the thumbnail fetches"""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = HttpPool()
+        return _shared_pool
@@ -0,0 +1,84 @@
+import time
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    output_path TEXT,
+    format TEXT,
+    priority INTEGER DEFAULT 0,
+    title TEXT,
+    state TEXT,
+    attempts INTEGER DEFAULT 0,
+    message TEXT,
+    next_attempt_at REAL,
+    created_at REAL,
+    updated_at REAL,
+    allow_duplicate INTEGER DEFAULT 0
+);
+"""
+
+
+class JobStore:
+    """Unfinished download jobs, persisted so they survive a restart or crash
+
+    A job is written whenever its state changes (never on progress), and
+    deleted once it completes or is cancelled. Failed jobs are kept, with
+    their retry count, until they are cleared from the queue.
+    """
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            if "allow_duplicate" not in columns:
+                # Job stores from before duplicates were re-checked after the probe
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN allow_duplicate INTEGER DEFAULT 0")
+
+    def save(self, job):
+        """Insert or update a job, setting job.store_id the first time"""
+        values = (
+            job.url, job.output_path, job.format_option, job.priority, job.title,
+            job.status, job.attempts, job.message, job.next_attempt_at, job.created_at, time.time(),
+            int(job.allow_duplicate)
+        )
+        with self._lock, self._conn:
+            if job.store_id is None:
+                cursor = self._conn.execute(
+                    "INSERT INTO jobs (url, output_path, format, priority, title, state, attempts, message,"
+                    " next_attempt_at, created_at, updated_at, allow_duplicate)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    values
+                )
+                job.store_id = cursor.lastrowid
+            else:
+                self._conn.execute(
+                    "UPDATE jobs SET url = ?, output_path = ?, format = ?, priority = ?, title = ?, state = ?,"
+                    " attempts = ?, message = ?, next_attempt_at = ?, created_at = ?, updated_at = ?,"
+                    " allow_duplicate = ? WHERE id = ?",
+                    values + (job.store_id,)
+                )
+
+    def delete(self, job):
+        if job.store_id is None:
+            return
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job.store_id,))
+        job.store_id = None
+
+    def load(self):
+        """Return every stored job as a dict, oldest first"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM jobs ORDER BY created_at, id").fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
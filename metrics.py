@@ -0,0 +1,284 @@
+"""Per-job timing spans and the aggregates exported from them
+
+Every download job is timed in phases (PHASES). Each finished span is
+appended to a rotating JSONL trace file, and per-phase aggregates are kept
+in memory for the stats panel and exported in the Prometheus text format,
+as a file (for node_exporter's textfile collector) and optionally over a
+local HTTP endpoint.
+
+Trace lines are either spans
+    {"type": "span", "job_id": 3, "phase": "transfer", "attempt": 0, "start": 1700000000.0,
+     "duration": 12.5, "bytes": 52428800, "avg_speed": 4194304.0, "peak_speed": 6291456.0, "error": null}
+or one summary per finished job
+    {"type": "job", "job_id": 3, "url": "...", "format": "...", "state": "Completed",
+     "message": "...", "attempts": 0, "duration": 14.1, "phases": {"probe": 0.8, ...}}
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+# Phases of a job, in the order they run
+PHASES = ("probe", "thumbnail", "transfer", "postprocess", "move")
+
+# Durations kept per phase for the percentiles
+WINDOW_SIZE = 1000
+
+TRACE_MAX_BYTES = 5 * 1024 * 1024
+TRACE_BACKUPS = 3
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers, or None if it is empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Span:
+    """Timing, bytes and speed of one phase of one job"""
+    def __init__(self, job_id, phase, attempt=0):
+        self.job_id = job_id
+        self.phase = phase
+        self.attempt = attempt
+        self.start = time.time()
+        self._started = time.monotonic()
+        self.duration = None
+        self.error = None
+        self.peak_speed = None
+        self._file_bytes = {}  # file name -> bytes downloaded (a job can fetch several streams)
+
+    @property
+    def bytes(self):
+        return sum(self._file_bytes.values())
+
+    def observe(self, downloaded_bytes=None, speed=None, filename=None):
+        """Record a progress update"""
+        if downloaded_bytes is not None:
+            self._file_bytes[filename] = max(downloaded_bytes, self._file_bytes.get(filename, 0))
+        if speed is not None and (self.peak_speed is None or speed > self.peak_speed):
+            self.peak_speed = speed
+
+    def finish(self, error=None):
+        self.duration = time.monotonic() - self._started
+        self.error = error
+
+    def to_dict(self):
+        num_bytes = self.bytes
+        return {
+            'type': "span",
+            'job_id': self.job_id,
+            'phase': self.phase,
+            'attempt': self.attempt,
+            'start': self.start,
+            'duration': self.duration,
+            'bytes': num_bytes,
+            'avg_speed': num_bytes / self.duration if num_bytes and self.duration else None,
+            'peak_speed': self.peak_speed,
+            'error': self.error,
+        }
+
+
+class PhaseStats:
+    """Running totals for one phase, with recent durations for the percentiles"""
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.peak_speed = None
+        self.durations = deque(maxlen=WINDOW_SIZE)
+
+    def add(self, span):
+        self.count += 1
+        if span.error:
+            self.errors += 1
+        self.seconds += span.duration
+        self.bytes += span.bytes
+        if span.peak_speed is not None and (self.peak_speed is None or span.peak_speed > self.peak_speed):
+            self.peak_speed = span.peak_speed
+        self.durations.append(span.duration)
+
+
+class JobMetrics:
+    """Collects job spans, writes the trace and exports per-phase aggregates
+
+    trace_file and prometheus_file are optional; without them the
+    aggregates are only kept in memory.
+    """
+    def __init__(self, trace_file=None, prometheus_file=None, trace_max_bytes=TRACE_MAX_BYTES,
+                 trace_backups=TRACE_BACKUPS):
+        self.prometheus_file = prometheus_file
+        self._phases = {phase: PhaseStats() for phase in PHASES}
+        self._jobs = {}  # final state -> count
+        self._lock = threading.Lock()
+        self._trace = None
+        if trace_file:
+            try:
+                handler = RotatingFileHandler(trace_file, maxBytes=trace_max_bytes,
+                                              backupCount=trace_backups, encoding='utf-8')
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                self._trace = logging.getLogger(f"porygon.trace.{id(self)}")
+                self._trace.propagate = False
+                self._trace.setLevel(logging.INFO)
+                self._trace.addHandler(handler)
+            except OSError as e:
+                print(f"Error opening trace file: {e}")
+
+    def start_span(self, job_id, phase, attempt=0):
+        return Span(job_id, phase, attempt)
+
+    def finish_span(self, span, error=None):
+        """Close a span, add it to the aggregates and the trace; returns its dict"""
+        span.finish(error)
+        with self._lock:
+            self._phases.setdefault(span.phase, PhaseStats()).add(span)
+        record = span.to_dict()
+        self._write_trace(record)
+        return record
+
+    def job_finished(self, job):
+        """Record the final state of a job and refresh the Prometheus file"""
+        phases = {}
+        for span in job.spans:
+            phases[span['phase']] = phases.get(span['phase'], 0.0) + span['duration']
+        with self._lock:
+            self._jobs[job.state] = self._jobs.get(job.state, 0) + 1
+        self._write_trace({
+            'type': "job",
+            'job_id': job.id,
+            'url': job.url,
+            'format': job.format_option,
+            'state': job.state,
+            'message': job.message,
+            'attempts': job.attempts,
+            'duration': time.time() - job.created_at,
+            'phases': phases,
+        })
+        if self.prometheus_file:
+            self.write_prometheus(self.prometheus_file)
+
+    def summary(self):
+        """Per-phase aggregates: {phase: {count, errors, p50, p95, seconds, bytes, avg_speed, peak_speed}}"""
+        with self._lock:
+            phases = {phase: (stats, list(stats.durations)) for phase, stats in self._phases.items()}
+        return {
+            phase: {
+                'count': stats.count,
+                'errors': stats.errors,
+                'p50': percentile(durations, 0.5),
+                'p95': percentile(durations, 0.95),
+                'seconds': stats.seconds,
+                'bytes': stats.bytes,
+                'avg_speed': stats.bytes / stats.seconds if stats.bytes and stats.seconds else None,
+                'peak_speed': stats.peak_speed,
+            }
+            for phase, (stats, durations) in phases.items()
+        }
+
+    def job_counts(self):
+        with self._lock:
+            return dict(self._jobs)
+
+    def prometheus_text(self):
+        """The aggregates in the Prometheus text exposition format"""
+        summary = self.summary()
+        lines = [
+            "# HELP porygon_phase_duration_seconds Time spent in each phase of a download job",
+            "# TYPE porygon_phase_duration_seconds summary",
+        ]
+        for phase, stats in summary.items():
+            for quantile, key in (("0.5", 'p50'), ("0.95", 'p95')):
+                if stats[key] is not None:
+                    lines.append(f'porygon_phase_duration_seconds{{phase="{phase}",quantile="{quantile}"}} {stats[key]:.6f}')
+            lines.append(f'porygon_phase_duration_seconds_sum{{phase="{phase}"}} {stats["seconds"]:.6f}')
+            lines.append(f'porygon_phase_duration_seconds_count{{phase="{phase}"}} {stats["count"]}')
+        for name, key, kind, help_text in (
+            ("porygon_phase_errors_total", 'errors', "counter", "Phases that ended with an error"),
+            ("porygon_phase_bytes_total", 'bytes', "counter", "Bytes transferred in each phase"),
+            ("porygon_phase_peak_speed_bytes", 'peak_speed', "gauge", "Highest speed seen in each phase, in bytes per second"),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for phase, stats in summary.items():
+                lines.append(f'{name}{{phase="{phase}"}} {stats[key] or 0}')
+        lines.append("# HELP porygon_jobs_finished_total Download jobs by final state")
+        lines.append("# TYPE porygon_jobs_finished_total counter")
+        for state, count in sorted(self.job_counts().items()):
+            lines.append(f'porygon_jobs_finished_total{{state="{state}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the Prometheus text file (atomically, so scrapers never see half a file)"""
+        temp_file = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                f.write(self.prometheus_text())
+            os.replace(temp_file, path)
+        except OSError as e:
+            print(f"Error writing metrics: {e}")
+
+    def close(self):
+        if self._trace is not None:
+            for handler in list(self._trace.handlers):
+                handler.close()
+                self._trace.removeHandler(handler)
+
+    def _write_trace(self, record):
+        if self._trace is not None:
+            self._trace.info(json.dumps(record))
+
+
+class MetricsServer:
+    """Local HTTP endpoint serving /metrics (Prometheus text) and /stats (JSON)"""
+    def __init__(self, metrics, port, host="127.0.0.1"):
+        # Only needed when the endpoint is enabled, so not imported at startup
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        self.metrics = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                path = handler.path.split('?')[0]
+                if path == "/metrics":
+                    body = metrics.prometheus_text().encode()
+                    content_type = "text/plain; version=0.0.4"
+                elif path == "/stats":
+                    body = json.dumps({'phases': metrics.summary(), 'jobs': metrics.job_counts()}).encode()
+                    content_type = "application/json"
+                else:
+                    handler.send_error(404)
+                    return
+                handler.send_response(200)
+                handler.send_header("Content-Type", content_type)
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def start_metrics_server(metrics, port):
+    """Serve the metrics on localhost, or return None if no port is set or it is taken"""
+    if not port:
+        return None
+    try:
+        return MetricsServer(metrics, int(port)).start()
+    except (OSError, ValueError) as e:
+        print(f"Error starting metrics endpoint: {e}")
+        return None
@@ -0,0 +1,164 @@
+"""Post-processing (merging streams, extracting audio) as its own pipeline stage
+
+When the queue has a PostProcessPool, engines only download the raw
+streams and describe the remaining ffmpeg work as a plan. The network slot
+is released as soon as the bytes are on disk, and the plan runs on a pool
+sized to the CPU count, so downloads and ffmpeg overlap instead of taking
+turns within each job.
+
+A plan is a dict:
+    action      "merge" (video + audio into one container) or "extract_audio"
+    inputs      stream files, deleted once the output is written
+    output      final file path
+    codec, quality, source_codec   audio extraction settings (extract_audio only)
+"""
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from tasks import CancelToken
+
+# Output template for raw streams; build_plan relies on the ".f<format id>." part
+STREAM_TEMPLATE = '%(title)s.f%(format_id)s.%(ext)s'
+
+# Audio codec option -> (file extension, ffmpeg encoder, codec names that can be copied as is)
+AUDIO_CODECS = {
+    'mp3': ('mp3', 'libmp3lame', ('mp3',)),
+    'opus': ('opus', 'libopus', ('opus',)),
+    'm4a': ('m4a', 'aac', ('mp4a', 'aac')),
+    'vorbis': ('ogg', 'libvorbis', ('vorbis',)),
+}
+
+
+def merge_container(video_ext, audio_ext, preferred=None):
+    """Container that holds both streams without re-encoding (yt-dlp's choice when none is set)"""
+    if preferred:
+        return preferred
+    if video_ext == 'mp4' and audio_ext in ('m4a', 'mp4'):
+        return 'mp4'
+    if video_ext == 'webm' and audio_ext == 'webm':
+        return 'webm'
+    return 'mkv'
+
+
+def stream_base(filepath, format_id):
+    """The path a stream file would have had without its ".f<format id>.<ext>" suffix"""
+    marker = f".f{format_id}."
+    index = filepath.rfind(marker)
+    return filepath[:index] if index >= 0 else os.path.splitext(filepath)[0]
+
+
+def build_plan(downloads, settings):
+    """Plan for the downloaded streams of a job, or None if they need no ffmpeg
+
+    downloads are the format dicts of the downloaded streams (format_id, ext,
+    acodec, vcodec) with their 'filepath'; settings come from format_settings().
+    """
+    downloads = [d for d in downloads if d.get('filepath')]
+    if len(downloads) >= 2:
+        video = next((d for d in downloads if d.get('vcodec') not in (None, 'none')), downloads[0])
+        audio = next((d for d in downloads if d is not video), downloads[1])
+        container = merge_container(video.get('ext'), audio.get('ext'), settings.get('merge_output_format'))
+        return {
+            'action': 'merge',
+            'inputs': [video['filepath'], audio['filepath']],
+            'output': f"{stream_base(video['filepath'], video['format_id'])}.{container}",
+        }
+    if downloads and settings.get('extract_audio'):
+        stream = downloads[0]
+        codec, quality = settings['extract_audio']
+        extension = AUDIO_CODECS.get(codec, (codec,))[0]
+        return {
+            'action': 'extract_audio',
+            'inputs': [stream['filepath']],
+            'output': f"{stream_base(stream['filepath'], stream.get('format_id', ''))}.{extension}",
+            'codec': codec,
+            'quality': quality,
+            'source_codec': stream.get('acodec') or "",
+        }
+    return None
+
+
+def ffmpeg_command(plan, output_file):
+    """The ffmpeg command that carries out a plan, writing output_file"""
+    cmd = ['ffmpeg', '-y', '-nostdin', '-loglevel', 'error']
+    for path in plan['inputs']:
+        cmd.extend(['-i', path])
+    if plan['action'] == 'merge':
+        cmd.extend(['-map', '0:v:0', '-map', '1:a:0', '-c', 'copy'])
+        if output_file.endswith('.mp4'):
+            cmd.extend(['-movflags', '+faststart'])
+    else:
+        _, encoder, copyable = AUDIO_CODECS.get(plan['codec'], (plan['codec'], plan['codec'], (plan['codec'],)))
+        cmd.append('-vn')
+        if plan['source_codec'].lower().startswith(copyable):
+            cmd.extend(['-c:a', 'copy'])
+        else:
+            cmd.extend(['-c:a', encoder])
+            if plan.get('quality'):
+                cmd.extend(['-q:a', str(plan['quality'])])
+    cmd.append(output_file)
+    return cmd
+
+
+def run_plan(plan, cancel_token=None, on_log=None, on_phase=None):
+    """Run a plan's ffmpeg command, returning the output path
+
+    The output is written under a temporary name and renamed into place,
+    so a cancelled or crashed run never leaves a truncated final file.
+    on_phase is called with "postprocess" when ffmpeg starts and with
+    "move" before the output is renamed into place.
+    """
+    cancel_token = cancel_token or CancelToken()
+    cancel_token.check()
+    if on_phase is not None:
+        on_phase("postprocess")
+    root, extension = os.path.splitext(plan['output'])
+    temp_file = f"{root}.temp{extension}"
+    process = cancel_token.popen(
+        ffmpeg_command(plan, temp_file),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True
+    )
+    try:
+        output, _ = process.communicate()
+    finally:
+        cancel_token.unregister_process(process)
+    if on_log is not None:
+        for line in output.splitlines():
+            on_log(line)
+    try:
+        cancel_token.check()
+        if process.returncode != 0:
+            raise RuntimeError(f"Post-processing failed with error code {process.returncode}")
+        if on_phase is not None:
+            on_phase("move")
+        os.replace(temp_file, plan['output'])
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+    for path in plan['inputs']:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return plan['output']
+
+
+class PostProcessPool:
+    """Bounded pool that runs post-processing plans
+
+    Each plan runs as one ffmpeg process, so a pool of workers sized to the
+    CPU count keeps the cores busy without oversubscribing them.
+    """
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="postprocess")
+
+    def submit(self, plan, cancel_token=None, on_log=None, on_phase=None):
+        """Queue a plan; returns a Future for the output path"""
+        return self._executor.submit(run_plan, plan, cancel_token, on_log, on_phase)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
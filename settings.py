@@ -0,0 +1,75 @@
+import os
+import json
+
+# Defaults for every setting; settings.json only needs to contain overrides
+DEFAULT_SETTINGS = {
+    # Number of downloads that run at the same time
+    "max_concurrent_downloads": 3,
+    # Maximum simultaneous downloads from one host, unless overridden in host_limits
+    "per_host_limit": 3,
+    "host_limits": {},
+    # Automatic retries of downloads that fail with a network error; the delay
+    # doubles after each attempt, from retry_base_delay up to retry_max_delay seconds
+    "max_retries": 3,
+    "retry_base_delay": 5,
+    "retry_max_delay": 300,
+    # Total download bandwidth for all jobs together, in bytes per second or
+    # as "500K"/"2M"; null for no limit. Entries of bandwidth_schedule such as
+    # {"start": "09:00", "end": "18:00", "limit": "2M"} override it during their hours
+    "bandwidth_limit": None,
+    "bandwidth_schedule": [],
+    # DASH/HLS fragments downloaded in parallel, per format option
+    "concurrent_fragments": {
+        "default": 4,
+        "Audio Only (mp3)": 1,
+        "Audio Only (m4a, no re-encode)": 1,
+        "Audio Only (opus, no re-encode)": 1,
+    },
+    # ffmpeg jobs (merging, audio extraction) run at the same time after
+    # their download has finished; null means one per CPU core
+    "postprocess_workers": None,
+    # Local port serving /metrics (Prometheus text) and /stats (JSON); null to
+    # only write metrics.prom and the trace.jsonl span trace
+    "metrics_port": None,
+    # Local directory where downloads and post-processing happen before the
+    # finished file is moved to the output folder (useful when that is a
+    # network share or an external disk); null to write to the output folder
+    # directly. staging_max_bytes (bytes or e.g. "20G") caps its use
+    "staging_dir": None,
+    "staging_max_bytes": None,
+    # Port for worker nodes (--worker) to pull jobs from, making this app the
+    # coordinator of a download cluster; null to download everything locally.
+    # cluster_host is the address to listen on ("0.0.0.0" for other machines)
+    # and cluster_token a shared secret the workers must send
+    "cluster_port": None,
+    "cluster_host": "127.0.0.1",
+    "cluster_token": None,
+    # Set once the preview thumbnails older versions saved in temp/ are removed
+    "preview_temp_removed": False,
+}
+
+
+def app_data_dir():
+    """Directory for history, caches and settings: $PORYGON_HOME, or the application directory"""
+    return os.environ.get("PORYGON_HOME") or os.path.dirname(os.path.abspath(__file__))
+
+
+def load_settings(settings_file):
+    """Load settings from a JSON file, filling in defaults for missing keys"""
+    settings = json.loads(json.dumps(DEFAULT_SETTINGS))
+    try:
+        if os.path.exists(settings_file):
+            with open(settings_file, 'r') as f:
+                settings.update(json.load(f))
+    except Exception as e:
+        print(f"Error loading settings: {e}")
+    return settings
+
+
+def save_settings(settings_file, settings):
+    """Save settings to a JSON file"""
+    try:
+        with open(settings_file, 'w') as f:
+            json.dump(settings, f, indent=2)
+    except Exception as e:
+        print(f"Error saving settings: {e}")
@@ -0,0 +1,109 @@
+"""Single-instance support: later launches hand their URLs to the running app
+
+The GUI listens on a local socket (a QLocalServer) named after the
+application data directory, so each history database has at most one
+process writing to it. A new launch first tries to connect: if an
+instance answers, the URLs from the command line are sent to it and the
+launch exits without loading Qt.
+
+The protocol is one JSON object per line in each direction, so scripts
+can drive the running app too:
+
+    {"command": "add", "urls": ["https://youtu.be/..."], "format": "Audio Only (mp3)", "output": "/media"}
+    {"command": "show"}
+    {"command": "status"}
+
+"format" and "output" are optional, and an entry of "urls" may also be a
+job object as in the headless JSONL files. Every reply has "ok" and, on
+failure, "error".
+
+This module only uses the standard library so the forwarding path stays fast.
+"""
+import os
+import sys
+import json
+import socket
+import hashlib
+import tempfile
+
+from settings import app_data_dir
+
+# How long a launch waits for the running instance before starting its own
+CONNECT_TIMEOUT = 2.0
+
+# Longest command line accepted from a client
+MAX_COMMAND_SIZE = 1024 * 1024
+
+
+def server_name(data_dir=None):
+    """Name to listen on with QLocalServer: a socket path, or a pipe name on Windows"""
+    digest = hashlib.sha1(os.path.abspath(data_dir or app_data_dir()).encode('utf-8')).hexdigest()[:12]
+    if sys.platform == "win32":
+        return f"porygon-{digest}"
+    # A full path, as the default (Qt's temporary directory) may differ from Python's
+    return os.path.join(tempfile.gettempdir(), f"porygon-{digest}.sock")
+
+
+def _pipe_path(name):
+    return name if name.startswith("\\\\.\\pipe\\") else f"\\\\.\\pipe\\{name}"
+
+
+def send_command(command, name=None, timeout=CONNECT_TIMEOUT):
+    """Send one command to the running instance and return its reply
+
+    Returns None when no instance is listening.
+    """
+    name = name or server_name()
+    data = (json.dumps(command) + "\n").encode('utf-8')
+    try:
+        if sys.platform == "win32":
+            with open(_pipe_path(name), 'r+b', buffering=0) as pipe:
+                pipe.write(data)
+                reply = pipe.readline()
+        else:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(timeout)
+                sock.connect(name)
+                sock.sendall(data)
+                reply = sock.makefile('rb').readline()
+    except OSError:
+        return None
+    if not reply:
+        return None  # the instance closed the connection without answering
+    try:
+        return json.loads(reply)
+    except ValueError:
+        return {"ok": False, "error": "invalid reply from the running instance"}
+
+
+def urls_from_argv(argv):
+    """URLs given on the command line, skipping options and Qt option values"""
+    return [arg for arg in argv if not arg.startswith('-') and ('://' in arg or '.' in arg)]
+
+
+def forward_to_running_instance(argv, name=None):
+    """Hand the command line to a running instance, returning True if one took it"""
+    urls = urls_from_argv(argv)
+    command = {"command": "add", "urls": urls} if urls else {"command": "show"}
+    reply = send_command(command, name)
+    if reply is None:
+        return False
+    if not reply.get("ok"):
+        print(f"Porygon is already running but refused the request: {reply.get('error')}")
+    return True
+
+
+def parse_command(line):
+    """Decode one command line from a client, raising ValueError if it is malformed"""
+    command = json.loads(line)
+    if not isinstance(command, dict) or not isinstance(command.get("command"), str):
+        raise ValueError("expected a JSON object with a \"command\"")
+    if command["command"] == "add":
+        urls = command.get("urls")
+        if not isinstance(urls, list) or not urls:
+            raise ValueError("\"add\" needs a non-empty \"urls\" list")
+    return command
+
+
+def encode_reply(reply):
+    return (json.dumps(reply) + "\n").encode('utf-8')
@@ -0,0 +1,217 @@
+"""Local staging area for downloads headed to slow destinations
+
+With a staging directory, yt-dlp writes its fragments and .part files and
+ffmpeg merges in a per-job directory on a fast local disk. Only the
+finished file is moved to the output folder: a rename when both are on
+the same filesystem, otherwise one streamed copy to a temporary name that
+is then renamed into place, so the destination never sees a partial file.
+
+Each job's directory is named after its URL, format, output folder and job
+store row, so a paused, retried or restored job finds its .part files again. Jobs
+reserve their estimated size; a job that would take the area over its cap
+(or over the free space of its disk) downloads straight into the output
+folder instead.
+"""
+import os
+import re
+import time
+import shutil
+import hashlib
+import threading
+
+from bandwidth import parse_rate
+from download_engine import FORMAT_SELECTORS
+
+# Space left free on a disk on top of a download's estimated size
+FREE_SPACE_MARGIN = 256 * 1024 * 1024
+
+# Directories of jobs that never finished are removed after this long
+STALE_AFTER = 7 * 24 * 60 * 60
+
+
+class InsufficientSpaceError(Exception):
+    """The output folder's disk doesn't have room for a download"""
+
+
+def estimate_download_size(info, format_option=None):
+    """Rough upper bound of a video's download size from its probed formats, or None
+
+    Only the streams the format option can select count: audio streams for
+    the audio options, single files for pre-muxed video, and streams within
+    the option's height cap. The estimate is the largest video-only plus the
+    largest audio-only stream, or the largest single file if that is bigger.
+    """
+    format_option = format_option or ""
+    selector = FORMAT_SELECTORS.get(format_option, "")
+    cap = re.search(r'height<=(\d+)', selector)
+    max_height = int(cap.group(1)) if cap else None
+    largest = {'video': 0, 'audio': 0, 'both': 0}
+    for fmt in (info or {}).get('formats') or []:
+        size = fmt.get('filesize') or fmt.get('filesize_approx')
+        if not size:
+            continue
+        has_video = fmt.get('vcodec') not in (None, 'none')
+        has_audio = fmt.get('acodec') not in (None, 'none')
+        if has_video and max_height and (fmt.get('height') or 0) > max_height:
+            continue
+        kind = 'both' if has_video and has_audio else 'video' if has_video else 'audio'
+        largest[kind] = max(largest[kind], size)
+    if "Audio Only" in format_option:
+        # A single file is only the fallback when there is no audio-only stream
+        estimate = largest['audio'] or largest['both']
+    elif "Pre-muxed" in format_option:
+        estimate = largest['both']
+    else:
+        estimate = max(largest['video'] + largest['audio'], largest['both'])
+    return estimate or None
+
+
+def free_space(path):
+    """Free bytes on the disk holding path (or its nearest existing parent), or None"""
+    while path and not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    try:
+        return shutil.disk_usage(path or ".").free
+    except OSError:
+        return None
+
+
+def check_free_space(path, needed):
+    """Raise InsufficientSpaceError if the disk holding path can't take needed bytes"""
+    if not needed:
+        return
+    free = free_space(path)
+    if free is not None and free < needed + FREE_SPACE_MARGIN:
+        raise InsufficientSpaceError(
+            f"Not enough free space in {path}: {free // (1024 * 1024)} MB free, "
+            f"about {needed // (1024 * 1024)} MB needed"
+        )
+
+
+def unused_path(path):
+    """path, or "name (1).ext", "name (2).ext", ... if a file by that name exists"""
+    base, ext = os.path.splitext(path)
+    candidate = path
+    number = 1
+    while os.path.lexists(candidate) or os.path.lexists(candidate + ".porygon-part"):
+        candidate = f"{base} ({number}){ext}"
+        number += 1
+    return candidate
+
+
+def publish_file(source, destination_dir):
+    """Move a finished file into destination_dir, returning its new path
+
+    The file appears under its final name only once it is complete. An
+    existing file of the same name (a re-download, or another video with
+    the same title) is kept and the new one gets a numbered name.
+    """
+    os.makedirs(destination_dir, exist_ok=True)
+    destination = unused_path(os.path.join(destination_dir, os.path.basename(source)))
+    try:
+        os.replace(source, destination)
+        return destination
+    except OSError:
+        pass  # another filesystem: copy once, then rename
+    temp_file = destination + ".porygon-part"
+    try:
+        shutil.copyfile(source, temp_file)
+        shutil.copystat(source, temp_file)
+        os.replace(temp_file, destination)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+    os.remove(source)
+    return destination
+
+
+class StagingArea:
+    """Per-job directories under a local staging root, with a size cap"""
+    def __init__(self, root, max_bytes=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._reserved = {}  # job directory -> reserved bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.prune()
+
+    def job_dir(self, job):
+        # The job store row keeps the directory across restarts; two jobs for
+        # the same video (allow_duplicate) never share one. Fixed on first use,
+        # as the row may be created after the job starts
+        if job.staging_dir is None:
+            identity = job.store_id if job.store_id is not None else f"job-{job.id}"
+            key = hashlib.sha1(f"{job.url}\n{job.format_option}\n{job.output_path}\n{identity}".encode('utf-8')).hexdigest()[:16]
+            job.staging_dir = os.path.join(self.root, key)
+        return job.staging_dir
+
+    def acquire(self, job, estimated_bytes):
+        """Directory the job should download into: its staging directory, or None if there's no room"""
+        directory = self.job_dir(job)
+        needed = estimated_bytes or 0
+        with self._lock:
+            if directory not in self._reserved:
+                if self.max_bytes is not None and sum(self._reserved.values()) + needed > self.max_bytes:
+                    return None
+                free = free_space(self.root)
+                if free is not None and free < needed + FREE_SPACE_MARGIN:
+                    return None
+                self._reserved[directory] = needed
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def is_staged(self, path):
+        return bool(path) and os.path.abspath(path).startswith(os.path.abspath(self.root) + os.sep)
+
+    def publish(self, job, result):
+        """Move the job's finished file and thumbnail to its output folder, updating result and job"""
+        moved = {}
+
+        def move(path):
+            if path in moved:
+                return moved[path]
+            if not self.is_staged(path) or not os.path.exists(path):
+                return path
+            moved[path] = publish_file(path, job.output_path)
+            return moved[path]
+
+        result['filepath'] = move(result.get('filepath'))
+        result['thumbnail_path'] = move(result.get('thumbnail_path'))
+        job.thumbnail_path = move(job.thumbnail_path)
+
+    def release(self, job, keep_files=False):
+        """Give back the job's reservation; unless keep_files, delete its directory"""
+        directory = self.job_dir(job)
+        with self._lock:
+            self._reserved.pop(directory, None)
+        if not keep_files:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def prune(self, max_age=STALE_AFTER):
+        """Remove job directories that haven't been touched for max_age seconds"""
+        cutoff = time.time() - max_age
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.root, name)
+            try:
+                if os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+
+
+def staging_from_settings(settings):
+    """The StagingArea described by the staging settings, or None when staging is off"""
+    if not settings.get("staging_dir"):
+        return None
+    try:
+        return StagingArea(os.path.expanduser(settings["staging_dir"]), parse_rate(settings.get("staging_max_bytes")))
+    except (OSError, ValueError) as e:
+        print(f"Error in staging settings: {e}")
+        return None
@@ -0,0 +1,118 @@
+import os
+import sys
+import signal
+import threading
+import subprocess
+
+from http_pool import shared_pool
+
+
+class TaskCancelled(Exception):
+    """Raised inside a task once its CancelToken has been cancelled"""
+
+
+def child_process_kwargs():
+    """Popen arguments that put a child in its own process group
+
+    The yt-dlp command (CLI engine and metadata probes) starts ffmpeg and
+    sometimes other helpers itself, so stopping it means signalling the
+    whole group, not just the yt-dlp process.
+    """
+    if sys.platform == "win32":
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'start_new_session': True}
+
+
+def terminate_process_tree(process, timeout=3):
+    """Stop a process started with child_process_kwargs() and everything it spawned"""
+    if process.poll() is not None:
+        return
+    try:
+        if sys.platform == "win32":
+            subprocess.run(['taskkill', '/T', '/F', '/PID', str(process.pid)], capture_output=True)
+        else:
+            os.killpg(process.pid, signal.SIGTERM)
+            try:
+                process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError, OSError):
+        # Already gone (or the group leader exited); fall back to the process itself
+        if process.poll() is None:
+            process.kill()
+
+
+class CancelToken:
+    """Cooperative cancellation flag shared between a task and whoever started it
+
+    Work checks the token between steps; child processes registered with it
+    are killed (with their whole process group) as soon as it is cancelled.
+    That covers processes started through popen()/run(): the CLI engine,
+    metadata probes and the post-processing pool. ffmpeg runs that yt_dlp
+    starts in-process for the API engine (HLS downloads, fixups) are not
+    registered; such a download stops at its next progress hook.
+    It also offers the threading.Event methods (set, is_set, wait) so it can
+    be passed where a stop event is expected.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        with self._lock:
+            self._event.set()
+            processes = list(self._processes)
+        for process in processes:
+            terminate_process_tree(process)
+
+    set = cancel
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    def check(self):
+        """Raise TaskCancelled if the token has been cancelled"""
+        if self._event.is_set():
+            raise TaskCancelled()
+
+    def register_process(self, process):
+        """Kill this process when the token is cancelled (immediately if it already is)"""
+        with self._lock:
+            if not self._event.is_set():
+                self._processes.add(process)
+                return
+        terminate_process_tree(process)
+
+    def unregister_process(self, process):
+        with self._lock:
+            self._processes.discard(process)
+
+    def popen(self, cmd, **kwargs):
+        """subprocess.Popen whose process (group) is killed on cancellation"""
+        kwargs.update(child_process_kwargs())
+        process = subprocess.Popen(cmd, **kwargs)
+        self.register_process(process)
+        return process
+
+    def run(self, cmd):
+        """Like subprocess.run(cmd, capture_output=True, text=True), but cancellable"""
+        process = self.popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        try:
+            stdout, stderr = process.communicate()
+        finally:
+            self.unregister_process(process)
+        self.check()
+        return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+
+def read_url(url, cancel_token=None):
+    """Read a URL into memory over the shared keep-alive pool, checking for cancellation between chunks"""
+    return shared_pool().read(url, cancel_token)
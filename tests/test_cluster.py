@@ -0,0 +1,30 @@
+import headless
+from cluster import Coordinator, WorkerNode
+from download_engine import FORMAT_OPTIONS
+from download_queue import SKIPPED
+
+FORMAT = FORMAT_OPTIONS[0]
+URL = "https://www.youtube.com/watch?v=aaaaaaaaaaa"
+
+
+def test_remote_job_already_in_the_archive_is_reported(tmp_path, monkeypatch):
+    monkeypatch.setattr(headless, "APP_DIR", str(tmp_path))
+    coordinator = Coordinator(0).start()
+    url = f"http://127.0.0.1:{coordinator.port}"
+    runner = headless.HeadlessRunner(headless.build_parser().parse_args(
+        ["--worker", url, "--output", str(tmp_path / "downloads"), "--results", str(tmp_path / "results.jsonl")]))
+    try:
+        runner.archive.add("youtube aaaaaaaaaaa", FORMAT)
+        job = coordinator.submit(URL, FORMAT)
+        node = WorkerNode(runner, url)
+
+        assert node.step()  # registers, pulls the job and skips it
+        assert node.active == {}
+        assert [result["id"] for result in node._outbox] == [job.id]
+        assert node.step()  # reports the result
+
+        assert job.state == SKIPPED
+        assert coordinator.nodes[node.node_id].jobs == set()
+    finally:
+        runner.close()
+        coordinator.stop()
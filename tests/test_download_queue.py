@@ -0,0 +1,129 @@
+import threading
+
+from download_engine import FORMAT_OPTIONS
+from download_queue import DownloadQueue, COMPLETED, SKIPPED
+from job_store import JobStore
+
+FORMAT = FORMAT_OPTIONS[0]
+TIMEOUT = 10  # only reached if the queue hangs
+
+
+class ProbeOnlyCache:
+    """Metadata that is only known after probing, as for most non-YouTube URLs"""
+    def peek(self, url):
+        return None
+
+    def get(self, url, cancel_token=None):
+        return {'title': "Clip", 'thumbnail': "", 'extractor_key': "Vimeo", 'id': "76979871", 'formats': []}
+
+
+class HeldEngine:
+    """Downloads that start when the queue runs them and end when the test releases them"""
+    def __init__(self):
+        self.downloads = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def download(self, url, output_path, format_option, **kwargs):
+        self.downloads.append(url)
+        self.started.set()
+        assert self.release.wait(TIMEOUT)
+        return {'title': "Clip", 'filepath': None}
+
+
+class Archive:
+    def __init__(self, *entries):
+        self.entries = set(entries)
+
+    def contains(self, video_archive_id, format_option):
+        return (video_archive_id, format_option) in self.entries
+
+    def add(self, video_archive_id, format_option):
+        self.entries.add((video_archive_id, format_option))
+
+
+class Finished:
+    """on_job_finished callback that can wait for a job"""
+    def __init__(self):
+        self.events = {}
+        self._lock = threading.Lock()
+
+    def _event(self, job_id):
+        with self._lock:
+            return self.events.setdefault(job_id, threading.Event())
+
+    def __call__(self, job):
+        self._event(job.id).set()
+
+    def wait(self, job):
+        assert self._event(job.id).wait(TIMEOUT)
+
+
+def make_queue(archive=None):
+    engine = HeldEngine()
+    finished = Finished()
+    queue = DownloadQueue(engine, ProbeOnlyCache(), archive=archive, on_job_finished=finished)
+    return queue, engine, finished
+
+
+def test_probed_video_in_archive_is_skipped():
+    queue, engine, finished = make_queue(Archive(("vimeo 76979871", FORMAT)))
+    job = queue.enqueue("https://vimeo.com/76979871", "/nonexistent", FORMAT)
+    finished.wait(job)
+    queue.shutdown()
+    assert job.state == SKIPPED
+    assert engine.downloads == []
+
+
+def test_allow_duplicate_downloads_after_the_probe():
+    queue, engine, finished = make_queue(Archive(("vimeo 76979871", FORMAT)))
+    engine.release.set()
+    job = queue.enqueue("https://vimeo.com/76979871", "/nonexistent", FORMAT, allow_duplicate=True)
+    finished.wait(job)
+    queue.shutdown()
+    assert job.state == COMPLETED
+
+
+def test_probed_video_already_downloading_is_skipped():
+    queue, engine, finished = make_queue()
+    first = queue.enqueue("https://vimeo.com/76979871", "/nonexistent", FORMAT)
+    assert engine.started.wait(TIMEOUT)
+    second = queue.enqueue("https://player.vimeo.com/video/76979871", "/nonexistent", FORMAT)
+    finished.wait(second)
+    engine.release.set()
+    finished.wait(first)
+    queue.shutdown()
+    assert [first.state, second.state] == [COMPLETED, SKIPPED]
+    assert len(engine.downloads) == 1
+
+
+def test_jobs_added_while_held_are_checked_on_release():
+    archive = Archive()
+    queue, engine, finished = make_queue(archive)
+    engine.release.set()
+    queue.hold_new_jobs()
+    job = queue.enqueue("https://www.youtube.com/watch?v=aaaaaaaaaaa", "/nonexistent", FORMAT)
+    archive.add("youtube aaaaaaaaaaa", FORMAT)  # the archive finished loading
+    queue.release_new_jobs()
+    finished.wait(job)
+    queue.shutdown()
+    assert job.state == SKIPPED
+    assert engine.downloads == []
+
+
+def test_move_to_top_is_saved_and_reported(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    updated = []
+    queue = DownloadQueue(HeldEngine(), ProbeOnlyCache(), max_workers=1, job_store=store,
+                          on_job_updated=updated.append)
+    queue.hold_new_jobs()  # keep both jobs queued
+    first = queue.enqueue("https://vimeo.com/1", "/nonexistent", FORMAT)
+    second = queue.enqueue("https://vimeo.com/2", "/nonexistent", FORMAT)
+    updated.clear()
+
+    queue.move_to_top(second.id)
+    queue.shutdown()
+
+    assert updated == [second]
+    priorities = {record['url']: record['priority'] for record in store.load()}
+    assert priorities[second.url] > priorities[first.url]
@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+from download_engine import FORMAT_OPTIONS
+from file_index import FileIndex, MISSING
+from history_store import HistoryStore
+from tasks import CancelToken, TaskCancelled
+
+
+def run_as_background_task(fn, *args):
+    """Call fn the way BackgroundTasks.run_task does: fn(cancel_token, *args)"""
+    return fn(CancelToken(), *args)
+
+
+def make_record(store, filepath):
+    return store.append({
+        "title": "video", "url": "https://www.youtube.com/watch?v=aaaaaaaaaaa",
+        "date": "2024-01-01 12:00:00", "format": FORMAT_OPTIONS[0],
+        "path": str(filepath.parent), "thumbnail": "", "filepath": str(filepath),
+        "filesize": 5, "mtime": 0.0,
+    })
+
+
+def test_verify_runs_as_a_background_task(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.sqlite3"))
+    present = tmp_path / "present.mp4"
+    present.write_bytes(b"12345")
+    records = [make_record(store, present), make_record(store, tmp_path / "deleted.mp4")]
+    file_index = FileIndex(store)
+    file_index.add_records(records)
+
+    updates = run_as_background_task(file_index.verify, records)
+
+    assert updates == [(records[1]['id'], {'file_state': MISSING})]
+    assert store.load()[1]['file_state'] == MISSING
+
+
+def test_verify_finds_moved_files(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.sqlite3"))
+    (tmp_path / "old").mkdir()
+    (tmp_path / "new").mkdir()
+    (tmp_path / "new" / "video.mp4").write_bytes(b"12345")
+    moved = make_record(store, tmp_path / "old" / "video.mp4")
+    other = make_record(store, tmp_path / "new" / "video.mp4")
+    file_index = FileIndex(store)
+    file_index.add_records([moved, other])
+
+    updates = dict(run_as_background_task(file_index.verify, [moved]))
+
+    assert updates[moved['id']]['filepath'] == str(tmp_path / "new" / "video.mp4")
+
+
+def test_verify_stops_when_cancelled(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.sqlite3"))
+    records = [make_record(store, tmp_path / "deleted.mp4")]
+    token = CancelToken()
+    token.cancel()
+    with pytest.raises(TaskCancelled):
+        FileIndex(store).verify(token, records)
+
+
+def make_legacy_record(store, folder, title):
+    return store.append({
+        "title": title, "url": "https://www.youtube.com/watch?v=aaaaaaaaaaa",
+        "date": "2024-01-01 12:00:00", "format": FORMAT_OPTIONS[0],
+        "path": str(folder), "thumbnail": "",
+    })
+
+
+def test_unresolved_legacy_record_scans_its_folder_once(tmp_path, monkeypatch):
+    store = HistoryStore(str(tmp_path / "history.sqlite3"))
+    folder = tmp_path / "videos"
+    folder.mkdir()
+    record = make_legacy_record(store, folder, "video")
+    file_index = FileIndex(store)
+    scans = []
+    real_scandir = os.scandir
+    monkeypatch.setattr(os, "scandir", lambda path: scans.append(path) or real_scandir(path))
+
+    assert file_index.locate(record) is None
+    assert file_index.locate(record) is None
+    assert len(scans) == 1
+
+    (folder / "My video (1080p).mp4").write_bytes(b"12345")
+    os.utime(folder, (0, 1))  # the folder changed, even within the mtime resolution
+    assert file_index.locate(record) == str(folder / "My video (1080p).mp4")
+
+
+def test_unreadable_legacy_folder_counts_as_empty(tmp_path, monkeypatch):
+    store = HistoryStore(str(tmp_path / "history.sqlite3"))
+    record = make_legacy_record(store, tmp_path, "video")
+
+    def denied(path):
+        raise PermissionError(13, "Permission denied", path)
+    monkeypatch.setattr(os, "scandir", denied)
+
+    assert FileIndex(store).locate(record) is None
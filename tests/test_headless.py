@@ -0,0 +1,25 @@
+import json
+
+import headless
+from download_engine import FORMAT_OPTIONS
+from download_queue import SKIPPED
+
+FORMAT = FORMAT_OPTIONS[0]
+
+
+def test_skipped_job_result_has_its_spec_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(headless, "APP_DIR", str(tmp_path))
+    results_file = tmp_path / "results.jsonl"
+    runner = headless.HeadlessRunner(headless.build_parser().parse_args(
+        ["--batch", "-", "--output", str(tmp_path), "--results", str(results_file)]))
+    try:
+        runner.archive.add("youtube aaaaaaaaaaa", FORMAT)
+        runner.submit_file([json.dumps({"id": "job-1", "url": "https://www.youtube.com/watch?v=aaaaaaaaaaa",
+                                        "format": FORMAT})])
+        runner.wait_until_idle()
+    finally:
+        runner.close()
+
+    results = [json.loads(line) for line in results_file.read_text().splitlines()]
+    assert [(result["id"], result["state"]) for result in results] == [("job-1", SKIPPED)]
+    assert runner.failures == 0
@@ -0,0 +1,24 @@
+from staging import publish_file
+
+
+def test_publish_keeps_an_existing_file(tmp_path):
+    (tmp_path / "staged").mkdir()
+    (tmp_path / "out").mkdir()
+    (tmp_path / "out" / "Clip.mp4").write_bytes(b"old")
+    (tmp_path / "out" / "Clip (1).mp4").write_bytes(b"older")
+    staged = tmp_path / "staged" / "Clip.mp4"
+    staged.write_bytes(b"new")
+
+    published = publish_file(str(staged), str(tmp_path / "out"))
+
+    assert published == str(tmp_path / "out" / "Clip (2).mp4")
+    assert (tmp_path / "out" / "Clip (2).mp4").read_bytes() == b"new"
+    assert (tmp_path / "out" / "Clip.mp4").read_bytes() == b"old"
+    assert (tmp_path / "out" / "Clip (1).mp4").read_bytes() == b"older"
+    assert not staged.exists()
+
+
+def test_publish_uses_the_original_name_when_free(tmp_path):
+    staged = tmp_path / "Clip.mp4"
+    staged.write_bytes(b"new")
+    assert publish_file(str(staged), str(tmp_path / "out")) == str(tmp_path / "out" / "Clip.mp4")
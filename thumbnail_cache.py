@@ -0,0 +1,253 @@
+import os
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+
+from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QImage, QPixmap
+
+# Size of the image area in ThumbnailWidget; variants are scaled to fit it
+THUMBNAIL_WIDTH = 300
+THUMBNAIL_HEIGHT = 200
+
+
+def scale_thumbnail(image):
+    """Scale a QImage to fit the thumbnail widget, keeping its aspect ratio"""
+    if image.width() <= THUMBNAIL_WIDTH and image.height() <= THUMBNAIL_HEIGHT:
+        return image
+    return image.scaled(
+        THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT,
+        Qt.AspectRatioMode.KeepAspectRatio,
+        Qt.TransformationMode.SmoothTransformation
+    )
+
+
+def decode_thumbnail(data):
+    """Decode encoded image bytes into a QImage scaled for the thumbnail widget, or None
+
+    QImage (unlike QPixmap) is safe to use off the GUI thread, so this can
+    run on a worker thread.
+    """
+    image = QImage.fromData(data)
+    if image.isNull():
+        return None
+    return scale_thumbnail(image)
+
+
+class ThumbnailCache:
+    """Content-addressed thumbnail cache with a disk tier and a pixmap tier
+
+    Source images are hashed (SHA-1 of their bytes) and stored once as a
+    JPEG pre-scaled for ThumbnailWidget. The disk tier is bounded by bytes
+    and the in-memory tier of decoded QPixmaps by entry count; both evict
+    the least recently used entry first. Disk operations are thread-safe;
+    pixmap() must only be called from the GUI thread, and the pixmap tier
+    is only ever touched there.
+
+    Images fetched with fetch_url() remember their ETag/Last-Modified, so
+    fetching the same URL again is a conditional request that downloads
+    nothing while the cached copy is current. Cache files can be evicted at
+    any time, so callers keep the source URL or path, never a cache file's.
+    """
+    def __init__(self, cache_dir, max_bytes=64 * 1024 * 1024, memory_items=64):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.index_file = os.path.join(cache_dir, "index.json")
+        self._entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self._sources = {}  # source path -> [mtime, size, key], so files aren't re-hashed
+        self._urls = {}  # source URL -> [etag, last modified, key]
+        self._pixmaps = OrderedDict()  # key -> QPixmap
+        self._total_bytes = 0
+        self._deferred_saves = 0  # batches in progress; the index is written when the last ends
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.load()
+
+    def path_for_key(self, key):
+        return os.path.join(self.cache_dir, f"{key}_{THUMBNAIL_WIDTH}x{THUMBNAIL_HEIGHT}.jpg")
+
+    def key_for_cache_file(self, path):
+        """The key of a file in this cache (which must not be hashed again), or None"""
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.cache_dir):
+            return None
+        key = os.path.basename(path).split('_')[0]
+        return key if self.path_for_key(key) == os.path.join(self.cache_dir, os.path.basename(path)) else None
+
+    def put_bytes(self, data):
+        """Store encoded image bytes, returning the cache key (None if they don't decode)"""
+        key = hashlib.sha1(data).hexdigest()
+        with self._lock:
+            if key in self._entries and os.path.exists(self.path_for_key(key)):
+                self._entries.move_to_end(key)
+                return key
+
+        image = decode_thumbnail(data)
+        if image is None:
+            return None
+        return self._store(key, image)
+
+    def key_for_file(self, source_path):
+        """Return the cache key for an image file, adding it to the cache if needed"""
+        cached_key = self.key_for_cache_file(source_path)
+        if cached_key is not None:
+            # Already scaled and stored (records from older versions point here)
+            with self._lock:
+                if cached_key in self._entries and os.path.exists(source_path):
+                    self._entries.move_to_end(cached_key)
+                    return cached_key
+            return None
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            return None
+        with self._lock:
+            known = self._sources.get(source_path)
+            if known and known[0] == stat.st_mtime and known[1] == stat.st_size and known[2] in self._entries:
+                self._entries.move_to_end(known[2])
+                return known[2]
+
+        with open(source_path, 'rb') as f:
+            key = self.put_bytes(f.read())
+        if key is not None:
+            with self._lock:
+                self._sources[source_path] = [stat.st_mtime, stat.st_size, key]
+            self._changed()
+        return key
+
+    def key_for_url(self, url):
+        """The cache key of an image fetched from url, if it is still cached (no network)"""
+        with self._lock:
+            known = self._urls.get(url)
+            if known and known[2] in self._entries:
+                self._entries.move_to_end(known[2])
+                return known[2]
+        return None
+
+    def fetch_url(self, url, pool, cancel_token=None):
+        """Return the cache key for an image URL, fetching it through an HttpPool if needed"""
+        with self._lock:
+            known = self._urls.get(url)
+            if known and known[2] not in self._entries:
+                known = None
+        if known:
+            response = pool.get(url, cancel_token, etag=known[0], last_modified=known[1])
+            if response.status == 304:
+                with self._lock:
+                    if known[2] in self._entries:
+                        self._entries.move_to_end(known[2])
+                        return known[2]
+                # Evicted while revalidating
+                response = pool.get(url, cancel_token)
+        else:
+            response = pool.get(url, cancel_token)
+
+        key = self.put_bytes(response.body)
+        if key is not None:
+            # Remembered even without validators, for key_for_url
+            validators = [response.headers.get("etag"), response.headers.get("last-modified")]
+            with self._lock:
+                self._urls[url] = validators + [key]
+            self._changed()
+        return key
+
+    @contextmanager
+    def batch(self):
+        """Write the index once at the end instead of after every image added meanwhile"""
+        with self._lock:
+            self._deferred_saves += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._deferred_saves -= 1
+                last = self._deferred_saves == 0
+            if last:
+                self.save()
+
+    def _changed(self):
+        with self._lock:
+            if self._deferred_saves:
+                return
+        self.save()
+
+    def pixmap(self, source_path):
+        """Return a pre-scaled QPixmap for an image file, or None (GUI thread only)"""
+        with self._lock:
+            known = self._sources.get(source_path)
+        key = known[2] if known and known[2] in self._pixmaps else self.key_for_file(source_path)
+        if key is None:
+            return None
+        return self.pixmap_for_key(key)
+
+    def pixmap_for_key(self, key):
+        """Return the decoded pixmap for a cache key (GUI thread only)"""
+        pixmap = self._pixmaps.get(key)
+        if pixmap is not None:
+            self._pixmaps.move_to_end(key)
+            return pixmap
+
+        pixmap = QPixmap(self.path_for_key(key))
+        if pixmap.isNull():
+            return None
+        self._pixmaps[key] = pixmap
+        while len(self._pixmaps) > self.memory_items:
+            self._pixmaps.popitem(last=False)
+        return pixmap
+
+    def _store(self, key, image):
+        path = self.path_for_key(key)
+        if not image.save(path, "JPG", 90):
+            return None
+        size = os.path.getsize(path)
+        with self._lock:
+            self._total_bytes += size - self._entries.get(key, 0)
+            self._entries[key] = size
+            self._entries.move_to_end(key)
+            self._evict_locked()
+        self._changed()
+        return key
+
+    def _evict_locked(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self.path_for_key(key))
+            except OSError:
+                pass
+        live = set(self._entries)
+        self._sources = {path: known for path, known in self._sources.items() if known[2] in live}
+        self._urls = {url: known for url, known in self._urls.items() if known[2] in live}
+
+    def load(self):
+        """Load the cache index, dropping entries whose files are gone"""
+        try:
+            if os.path.exists(self.index_file):
+                with open(self.index_file, 'r') as f:
+                    index = json.load(f)
+                with self._lock:
+                    for key, size in index.get("entries", []):
+                        if os.path.exists(self.path_for_key(key)):
+                            self._entries[key] = size
+                            self._total_bytes += size
+                    self._sources = index.get("sources", {})
+                    self._urls = index.get("urls", {})
+                    self._evict_locked()
+        except Exception as e:
+            print(f"Error loading thumbnail cache: {e}")
+
+    def save(self):
+        """Write the cache index (LRU order, known source files and URL validators)"""
+        with self._lock:
+            index = {"entries": list(self._entries.items()), "sources": dict(self._sources),
+                     "urls": dict(self._urls)}
+            try:
+                temp_file = self.index_file + ".tmp"
+                with open(temp_file, 'w') as f:
+                    json.dump(index, f)
+                os.replace(temp_file, self.index_file)
+            except Exception as e:
+                print(f"Error saving thumbnail cache: {e}")
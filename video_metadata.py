@@ -0,0 +1,254 @@
+import os
+import re
+import json
+import time
+import threading
+import subprocess
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+from tasks import TaskCancelled
+from download_engine import yt_dlp_command
+
+# YouTube video IDs are always 11 characters from this alphabet
+VIDEO_ID_PATTERN = re.compile(r'^[0-9A-Za-z_-]{11}$')
+
+# Only these format fields are kept in the cache; the rest (signed stream
+# URLs, fragment lists, http headers) expire quickly and bloat the file
+FORMAT_FIELDS = (
+    'format_id', 'ext', 'vcodec', 'acodec', 'width', 'height', 'fps',
+    'tbr', 'abr', 'vbr', 'asr', 'filesize', 'filesize_approx', 'protocol',
+    'format_note', 'container',
+)
+
+
+def extract_video_id(url):
+    """Return the YouTube video ID for a URL, or None if it can't be determined"""
+    url = (url or "").strip()
+    if not url:
+        return None
+    if "://" not in url:
+        url = "https://" + url
+
+    parsed = urlparse(url)
+    host = parsed.netloc.lower().split(':')[0]
+    for prefix in ("www.", "m.", "music."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    segments = [segment for segment in parsed.path.split('/') if segment]
+
+    candidate = None
+    if host == "youtu.be" and segments:
+        candidate = segments[0]
+    elif host in ("youtube.com", "youtube-nocookie.com"):
+        if parsed.path == "/watch":
+            candidate = parse_qs(parsed.query).get('v', [None])[0]
+        elif len(segments) >= 2 and segments[0] in ("shorts", "embed", "live", "v", "e"):
+            candidate = segments[1]
+
+    if candidate and VIDEO_ID_PATTERN.match(candidate):
+        return candidate
+    return None
+
+
+def youtube_thumbnail_url(video_id):
+    """URL of a YouTube video's standard thumbnail, which needs no metadata probe"""
+    return f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg"
+
+
+def is_collection_url(url):
+    """Return True for playlist and channel URLs that expand into many videos"""
+    url = (url or "").strip()
+    if not url or extract_video_id(url):
+        # A watch URL with a list= parameter is treated as the single video
+        return False
+    if "://" not in url:
+        url = "https://" + url
+
+    parsed = urlparse(url)
+    host = parsed.netloc.lower().split(':')[0]
+    if not (host.endswith("youtube.com") or host.endswith("youtube-nocookie.com")):
+        return False
+    if parsed.path.rstrip('/') == "/playlist" and 'list' in parse_qs(parsed.query):
+        return True
+    return parsed.path.startswith(("/channel/", "/c/", "/user/", "/@"))
+
+
+def cache_key(url):
+    """Key used for the metadata cache: the video ID when known, else the URL"""
+    return extract_video_id(url) or (url or "").strip()
+
+
+def normalize_url(url):
+    """Canonical form of a URL: YouTube URLs become a plain watch URL for their video ID
+
+    youtu.be links, shorts, embeds and watch URLs with extra parameters
+    (&t=30s, &list=...) all normalize to the same string.
+    """
+    video_id = extract_video_id(url)
+    if video_id:
+        return f"https://www.youtube.com/watch?v={video_id}"
+    return (url or "").strip()
+
+
+def archive_id(url, info=None):
+    """ID of a video in yt-dlp's download archive format ("<extractor> <video id>")
+
+    Metadata from the probe gives the extractor's own ID for any site;
+    without it only YouTube URLs can be identified. Returns None if unknown.
+    """
+    if info and info.get('extractor_key') and info.get('id'):
+        return f"{info['extractor_key'].lower()} {info['id']}"
+    video_id = extract_video_id(url)
+    return f"youtube {video_id}" if video_id else None
+
+
+def probe_metadata(url, cancel_token=None):
+    """Fetch title, thumbnail, duration and formats with a single yt-dlp call"""
+    cmd = yt_dlp_command() + [
+        '--dump-single-json', '--skip-download',
+        '--no-playlist', '--no-warnings', url
+    ]
+    if cancel_token is not None:
+        process = cancel_token.run(cmd)
+    else:
+        process = subprocess.run(cmd, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip() or f"yt-dlp exited with code {process.returncode}")
+    return compact_info(json.loads(process.stdout))
+
+
+def compact_info(info):
+    """Reduce a full yt-dlp info dict to the fields the app actually uses"""
+    formats = []
+    for fmt in info.get('formats') or []:
+        formats.append({key: fmt[key] for key in FORMAT_FIELDS if fmt.get(key) is not None})
+    return {
+        'id': info.get('id'),
+        'title': info.get('title') or "",
+        'thumbnail': info.get('thumbnail') or "",
+        'duration': info.get('duration'),
+        'uploader': info.get('uploader'),
+        'webpage_url': info.get('webpage_url'),
+        'extractor_key': info.get('extractor_key'),
+        'formats': formats,
+    }
+
+
+class _InFlightProbe:
+    """A probe that is currently running, shared by every caller asking for the same key"""
+    def __init__(self):
+        self.event = threading.Event()
+        self.info = None
+        self.cancelled = False
+
+
+class MetadataCache:
+    """Persistent metadata cache keyed by video ID, with TTL and LRU eviction
+
+    Concurrent lookups for the same video wait on one in-flight probe instead
+    of each starting their own yt-dlp extraction.
+    """
+    def __init__(self, cache_file, ttl=6 * 60 * 60, max_entries=200, probe=probe_metadata):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.probe = probe
+        self._entries = OrderedDict()  # key -> {"fetched_at": ..., "info": ...}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self.load()
+
+    def get(self, url, cancel_token=None):
+        """Return cached metadata for the URL, probing it at most once if needed
+
+        With a cancel_token, the probe (or the wait for someone else's probe)
+        stops with TaskCancelled when the token is cancelled. If the probe we
+        were waiting on was cancelled by its owner, we start our own.
+        """
+        key = cache_key(url)
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and time.time() - entry['fetched_at'] < self.ttl:
+                    self._entries.move_to_end(key)
+                    return entry['info']
+
+                in_flight = self._in_flight.get(key)
+                owner = in_flight is None
+                if owner:
+                    in_flight = _InFlightProbe()
+                    self._in_flight[key] = in_flight
+
+            if owner:
+                return self._run_probe(key, url, in_flight, cancel_token)
+
+            while not in_flight.event.wait(0.1):
+                if cancel_token is not None:
+                    cancel_token.check()
+            if not in_flight.cancelled:
+                return in_flight.info
+
+    def _run_probe(self, key, url, in_flight, cancel_token):
+        try:
+            in_flight.info = self.probe(url, cancel_token)
+        except TaskCancelled:
+            in_flight.cancelled = True
+            raise
+        except Exception as e:
+            print(f"Error probing metadata: {e}")
+        finally:
+            with self._lock:
+                if in_flight.info is not None:
+                    self._store(key, in_flight.info)
+                self._in_flight.pop(key, None)
+            in_flight.event.set()
+
+        if in_flight.info is not None:
+            self.save()
+        return in_flight.info
+
+    def peek(self, url):
+        """Return fresh cached metadata without ever probing"""
+        key = cache_key(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() - entry['fetched_at'] < self.ttl:
+                return entry['info']
+        return None
+
+    def _store(self, key, info):
+        self._entries[key] = {'fetched_at': time.time(), 'info': info}
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def load(self):
+        """Load cached metadata from disk, dropping expired entries"""
+        try:
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, 'r') as f:
+                    entries = json.load(f)
+                now = time.time()
+                with self._lock:
+                    for key, entry in entries:
+                        if now - entry.get('fetched_at', 0) < self.ttl:
+                            self._entries[key] = entry
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+        except Exception as e:
+            print(f"Error loading metadata cache: {e}")
+
+    def save(self):
+        """Write the cache to disk in LRU order (oldest first)"""
+        with self._lock:
+            entries = list(self._entries.items())
+        try:
+            with self._save_lock:
+                temp_file = self.cache_file + ".tmp"
+                with open(temp_file, 'w') as f:
+                    json.dump(entries, f)
+                os.replace(temp_file, self.cache_file)
+        except Exception as e:
+            print(f"Error saving metadata cache: {e}")
@@ -1,114 +1,360 @@
 import sys
 import os
-import subprocess
 import json
 import datetime
+import subprocess
+
+if __name__ == "__main__":
+    if "--profile-startup" in sys.argv:
+        # Enabled before the imports below so they are timed too
+        import startup_profile
+        startup_profile.enable()
+        sys.argv.remove("--profile-startup")
+    # Headless modes run before the Qt imports below so servers without a
+    # display (or without PyQt6) never load it
+    import headless
+    if headless.wants_headless(sys.argv[1:]):
+        sys.exit(headless.main(sys.argv[1:]))
+    # A running instance takes the URLs (or just comes to the front) and this
+    # launch exits, so only one process writes the history
+    import single_instance
+    if single_instance.forward_to_running_instance(sys.argv[1:]):
+        sys.exit(0)
+
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QLabel, QLineEdit, QPushButton, QComboBox, QFileDialog,
-    QProgressBar, QMessageBox, QGroupBox, QSplitter, QListWidget,
-    QListWidgetItem, QScrollArea, QFrame, QMenu
+    QProgressBar, QMessageBox, QGroupBox, QSplitter, QListView,
+    QFrame, QMenu, QTreeWidget, QTreeWidgetItem,
+    QSpinBox, QAbstractItemView, QStyledItemDelegate, QStyleOptionProgressBar, QStyle,
+    QDialog, QPlainTextEdit, QTableWidget, QTableWidgetItem, QHeaderView, QCheckBox
 )
-from PyQt6.QtCore import QThread, pyqtSignal, Qt, QSize, QUrl, QTimer
-from PyQt6.QtGui import QColor, QBrush, QFont, QPixmap, QImage, QMovie
-import urllib.request
-import webbrowser
-
-class DownloadThread(QThread):
-    """Thread for running yt-dlp without freezing the UI"""
-    progress = pyqtSignal(str)
-    finished = pyqtSignal(bool, str, str, str, str)  # success, message, title, format_option, thumbnail_path
-    thumbnail_ready = pyqtSignal(str)  # thumbnail path
-    
-    def __init__(self, url, output_path, format_option):
-        super().__init__()
-        self.url = url
-        self.output_path = output_path
-        self.format_option = format_option
-        self.title = ""
-        self.thumbnail_path = ""
+from PyQt6.QtCore import (
+    QObject, pyqtSignal, Qt, QTimer, QAbstractListModel, QModelIndex
+)
+from PyQt6.QtGui import QColor, QBrush, QFont, QPixmap
+from PyQt6.QtNetwork import QLocalServer
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from video_metadata import MetadataCache, is_collection_url, archive_id, youtube_thumbnail_url
+from download_engine import create_engine, format_bytes, FORMAT_OPTIONS
+from download_queue import DownloadQueue, COMPLETED, FAILED, SKIPPED
+from settings import load_settings, save_settings, app_data_dir
+from history_store import HistoryStore, make_history_record
+from job_store import JobStore
+from download_archive import DownloadArchive
+from bandwidth import scheduler_from_settings
+from staging import staging_from_settings, estimate_download_size
+from postprocess import PostProcessPool
+from metrics import JobMetrics, start_metrics_server
+from cluster import start_coordinator
+from file_index import FileIndex, MISSING
+from tasks import CancelToken, TaskCancelled, read_url
+from http_pool import shared_pool
+from thumbnail_cache import ThumbnailCache, decode_thumbnail
+from headless import parse_job_spec
+from history_search import HistorySearchIndex
+import startup_profile
+import single_instance
+
+# How often the queue view and progress bar pick up download progress
+PROGRESS_REFRESH_MS = 100
+
+# Decoded preview thumbnails kept in memory, so pasting a URL again is instant
+PREVIEW_CACHE_SIZE = 16
+
+# Date filter choices of the history panel: label -> days back (None for any time)
+HISTORY_DATE_RANGES = {
+    "Any time": None,
+    "Today": 0,
+    "Past 7 days": 7,
+    "Past 30 days": 30,
+    "Past year": 365,
+}
+
+# Thumbnails fetched at the same time by "Fetch Missing Thumbnails"
+BACKFILL_WORKERS = 8
+
+# History records loaded per background query; the first page is on screen
+# while older ones are still loading
+HISTORY_PAGE_SIZE = 2000
+
+
+class QueueSignals(QObject):
+    """Carries download queue callbacks from worker threads to the GUI thread"""
+    job_updated = pyqtSignal(object)
+    job_finished = pyqtSignal(object)
+    collection_updated = pyqtSignal(object)
+
+
+class InstanceServer(QObject):
+    """Answers JSON commands from later launches and scripts (see single_instance.py)
+
+    handler is called on the GUI thread with each parsed command and
+    returns the reply.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.handler = None
+        self.server = QLocalServer(self)
+        self.server.newConnection.connect(self.accept_connections)
         
-    def run(self):
-        try:
-            # Build the yt-dlp command based on the selected format
-            cmd = ['yt-dlp']
-            
-            if self.format_option == "High Quality Video (mp4)":
-                cmd.extend(['-f', 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'])
-            elif self.format_option == "Medium Quality Video (mp4)":
-                cmd.extend(['-f', 'bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/best[height<=720][ext=mp4]/best[height<=720]'])
-            elif self.format_option == "Low Quality Video (mp4)":
-                cmd.extend(['-f', 'bestvideo[height<=480][ext=mp4]+bestaudio[ext=m4a]/best[height<=480][ext=mp4]/best[height<=480]'])
-            elif self.format_option == "Audio Only (mp3)":
-                cmd.extend(['-x', '--audio-format', 'mp3'])
-            
-            # Get title and thumbnail info first
-            title_cmd = ['yt-dlp', '--get-title', self.url]
-            title_process = subprocess.run(title_cmd, capture_output=True, text=True)
-            if title_process.returncode == 0:
-                self.title = title_process.stdout.strip()
-                
-            # Get thumbnail URL
-            thumbnail_cmd = ['yt-dlp', '--get-thumbnail', self.url]
-            thumbnail_process = subprocess.run(thumbnail_cmd, capture_output=True, text=True)
-            if thumbnail_process.returncode == 0:
-                thumbnail_url = thumbnail_process.stdout.strip()
-                # Download the thumbnail
-                thumbnail_filename = os.path.join(self.output_path, f"{self.title}_thumbnail.jpg")
-                try:
-                    urllib.request.urlretrieve(thumbnail_url, thumbnail_filename)
-                    self.thumbnail_path = thumbnail_filename
-                    # Signal that the thumbnail is ready
-                    self.thumbnail_ready.emit(self.thumbnail_path)
-                except Exception as e:
-                    print(f"Error downloading thumbnail: {e}")
-            
-            # Also download thumbnail with yt-dlp as backup
-            cmd.append('--write-thumbnail')
-            
-            # Add output path
-            cmd.extend(['-o', f'{self.output_path}/%(title)s.%(ext)s'])
-            
-            # Add URL
-            cmd.append(self.url)
+    def listen(self, name):
+        """Start listening, returning False if another instance already is"""
+        if self.server.listen(name):
+            return True
+        if single_instance.send_command({"command": "status"}, name) is not None:
+            return False
+        # Left behind by an instance that crashed
+        QLocalServer.removeServer(name)
+        return self.server.listen(name)
+        
+    def accept_connections(self):
+        while self.server.hasPendingConnections():
+            connection = self.server.nextPendingConnection()
+            connection.readyRead.connect(lambda connection=connection: self.read_commands(connection))
+            connection.disconnected.connect(connection.deleteLater)
             
-            # Execute the command
-            process = subprocess.Popen(
-                cmd, 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                universal_newlines=True
-            )
+    def read_commands(self, connection):
+        while connection.canReadLine():
+            line = bytes(connection.readLine()).decode('utf-8', errors='replace')
+            connection.write(single_instance.encode_reply(self.handle(line)))
+        if connection.bytesAvailable() > single_instance.MAX_COMMAND_SIZE:
+            connection.abort()
             
-            # Stream the output
-            for line in process.stdout:
-                self.progress.emit(line.strip())
-                
-                # Check if thumbnail is written in this line
-                if "[info] Writing thumbnail" in line and not self.thumbnail_path:
-                    parts = line.split("Writing thumbnail to: ")
-                    if len(parts) > 1:
-                        self.thumbnail_path = parts[1].strip()
-                        self.thumbnail_ready.emit(self.thumbnail_path)
+    def handle(self, line):
+        try:
+            command = single_instance.parse_command(line)
+        except ValueError as e:
+            return {"ok": False, "error": f"invalid command: {e}"}
+        try:
+            return self.handler(command)
+        except Exception as e:
+            print(f"Error handling command {command['command']}: {e}")
+            return {"ok": False, "error": str(e)}
+
+
+class BackgroundTask:
+    """A unit of work submitted to BackgroundTasks"""
+    def __init__(self, key, on_result, on_error):
+        self.key = key
+        self.token = CancelToken()
+        self.on_result = on_result
+        self.on_error = on_error
+
+
+class BackgroundTasks(QObject):
+    """Runs blocking work on a thread pool and delivers results on the GUI thread
+
+    Tasks are submitted under a key. Submitting a new task with the same key
+    cancels the previous one (killing any child process it registered with
+    its CancelToken) and its result, if it still arrives, is discarded.
+    """
+    task_done = pyqtSignal(object, object, object)  # task, result, error
+    
+    def __init__(self, max_workers=4, parent=None):
+        super().__init__(parent)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.current = {}  # key -> newest BackgroundTask
+        self.task_done.connect(self.deliver)
+        
+    def submit(self, key, fn, *args, on_result=None, on_error=None):
+        """Run fn(cancel_token, *args) on a worker thread"""
+        self.cancel(key)
+        task = BackgroundTask(key, on_result, on_error)
+        self.current[key] = task
+        self.executor.submit(self.run_task, task, fn, args)
+        return task
+    
+    def run_task(self, task, fn, args):
+        # Runs on a worker thread; the signal queues delivery onto the GUI thread
+        try:
+            result = fn(task.token, *args)
+        except TaskCancelled:
+            return
+        except Exception as e:
+            self.task_done.emit(task, None, e)
+            return
+        self.task_done.emit(task, result, None)
+        
+    def deliver(self, task, result, error):
+        if self.current.get(task.key) is not task or task.token.cancelled:
+            return  # superseded or cancelled while the result was in flight
+        del self.current[task.key]
+        if error is not None:
+            print(f"Error in background task {task.key}: {error}")
+            if task.on_error is not None:
+                task.on_error(error)
+        elif task.on_result is not None:
+            task.on_result(result)
             
-            # Wait for the process to complete
-            process.wait()
+    def cancel(self, key):
+        task = self.current.pop(key, None)
+        if task is not None:
+            task.token.cancel()
             
-            if process.returncode == 0:
-                self.finished.emit(True, "Download completed successfully!", self.title, self.format_option, self.thumbnail_path)
-            else:
-                self.finished.emit(False, f"Download failed with error code {process.returncode}", "", "", "")
-                
-        except Exception as e:
-            self.finished.emit(False, f"An error occurred: {str(e)}", "", "", "")
+    def shutdown(self):
+        for key in list(self.current):
+            self.cancel(key)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ProgressDelegate(QStyledItemDelegate):
+    """Paints a progress bar from the item's UserRole value
+
+    Cheaper than a QProgressBar widget per row when a playlist adds
+    thousands of jobs to the queue view.
+    """
+    def paint(self, painter, option, index):
+        percent = index.data(Qt.ItemDataRole.UserRole)
+        if percent is None:
+            super().paint(painter, option, index)
+            return
+        bar = QStyleOptionProgressBar()
+        bar.rect = option.rect.adjusted(2, 2, -2, -2)
+        bar.minimum = 0
+        bar.maximum = 100
+        bar.progress = int(percent)
+        bar.text = f"{int(percent)}%"
+        bar.textVisible = True
+        bar.state = option.state
+        QApplication.style().drawControl(QStyle.ControlElement.CE_ProgressBar, bar, painter)
+
+
+class HistoryListModel(QAbstractListModel):
+    """List model over the download history, newest first
+
+    Row text, tooltips and icons are computed in data() only for the rows
+    the view actually paints, so a large history costs nothing up front.
+    
+    While a search is active only its results are shown; new records are
+    added to them if they pass the search's match function.
+    """
+    def __init__(self, records, parent=None):
+        super().__init__(parent)
+        self.records = records  # oldest first, as stored
+        self.rows = records  # records shown, oldest first: all of them or the search results
+        self.matches = None  # decides whether a new record is shown while searching
+        
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.rows)
+    
+    def record(self, row):
+        """Return the history record shown in a row, or None"""
+        if 0 <= row < len(self.rows):
+            return self.rows[-(row+1)]
+        return None
+    
+    def set_filter(self, rows, matches):
+        """Show only rows (sorted by id), or every record when rows is None"""
+        self.beginResetModel()
+        self.rows = self.records if rows is None else rows
+        self.matches = None if rows is None else matches
+        self.endResetModel()
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        item = self.record(index.row()) if index.isValid() else None
+        if item is None:
+            return None
+        
+        if role == Qt.ItemDataRole.DisplayRole:
+            # Icon prefix based on format
+            if "Audio Only" in item['format']:
+                return f"🎵 {item['title']}"
+            elif "Video" in item['format']:
+                return f"🎬 {item['title']}"
+            return item['title']
+        elif role == Qt.ItemDataRole.ToolTipRole:
+            tooltip = f"URL: {item['url']}\nDate: {item['date']}\nFormat: {item['format']}\nPath: {item['path']}"
+            if item.get('filepath'):
+                tooltip += f"\nFile: {item['filepath']}"
+            if item.get('node'):
+                tooltip += f" (on {item['node']})"
+            if item.get('file_state') == MISSING:
+                tooltip += " (missing)"
+            return tooltip
+        elif role == Qt.ItemDataRole.ForegroundRole:
+            if item.get('file_state') == MISSING:
+                return QBrush(QColor("gray"))
+        elif role == Qt.ItemDataRole.UserRole:
+            return item.get('thumbnail', '')
+        return None
+    
+    def set_records(self, records):
+        """Replace every record (used when history is reloaded)"""
+        self.beginResetModel()
+        self.records = self.rows = records
+        self.matches = None
+        self.endResetModel()
+    
+    def add_older_records(self, records):
+        """Add records older than every loaded one (given newest first) as the bottom rows"""
+        if self.records:
+            # Skip any download recorded (and shown) after the page was read
+            records = [record for record in records if record['id'] < self.records[0]['id']]
+        if not records:
+            return
+        if self.rows is not self.records:
+            self.records[0:0] = reversed(records)
+            records = [record for record in records if self.matches(record)]
+            if not records:
+                return
+        first = len(self.rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(records) - 1)
+        self.rows[0:0] = reversed(records)
+        self.endInsertRows()
+    
+    def add_record(self, record):
+        """Insert a new download as the top row"""
+        if self.rows is not self.records:
+            self.records.append(record)
+            if not self.matches(record):
+                return
+        self.beginInsertRows(QModelIndex(), 0, 0)
+        self.rows.append(record)
+        self.endInsertRows()
+    
+    def row_for_id(self, record_id):
+        """Return the row showing a record, or -1 (rows are sorted by id)"""
+        position = _position_of_id(self.rows, record_id)
+        return -1 if position < 0 else len(self.rows) - 1 - position
+    
+    def update_record(self, record_id, changes):
+        """Apply changes to a record, shown or hidden by the search, and refresh its row"""
+        position = _position_of_id(self.records, record_id)
+        if position < 0:
+            return
+        self.records[position].update(changes)
+        row = self.row_for_id(record_id)
+        if row >= 0:
+            self.record_changed(row)
+    
+    def record_changed(self, row):
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+
+def _position_of_id(records, record_id):
+    """Index of the record with record_id in a list sorted by id, or -1"""
+    low, high = 0, len(records)
+    while low < high:
+        middle = (low + high) // 2
+        if records[middle]['id'] < record_id:
+            low = middle + 1
+        else:
+            high = middle
+    if low < len(records) and records[low]['id'] == record_id:
+        return low
+    return -1
 
 
 class ThumbnailWidget(QWidget):
     """Widget to display a thumbnail with a title"""
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, thumbnail_cache=None):
         super().__init__(parent)
+        self.thumbnail_cache = thumbnail_cache
         self.layout = QVBoxLayout(self)
         
         # Create frame for the image
@@ -151,7 +397,11 @@ class ThumbnailWidget(QWidget):
         
     def set_image(self, image_path):
         if os.path.exists(image_path):
-            pixmap = QPixmap(image_path)
+            if self.thumbnail_cache is not None:
+                # Pre-scaled variant, decoded once and kept in memory
+                pixmap = self.thumbnail_cache.pixmap(image_path) or QPixmap()
+            else:
+                pixmap = QPixmap(image_path)
             if not pixmap.isNull():
                 self.hide_loading()
                 self.image_label.setPixmap(pixmap)
@@ -159,6 +409,22 @@ class ThumbnailWidget(QWidget):
                 return True
         return False
     
+    def set_qimage(self, image):
+        """Show an already decoded (and scaled) image"""
+        return self.set_pixmap(QPixmap.fromImage(image))
+    
+    def set_cached(self, key):
+        """Show an image from the thumbnail cache by its key"""
+        return self.set_pixmap(self.thumbnail_cache.pixmap_for_key(key) or QPixmap())
+    
+    def set_pixmap(self, pixmap):
+        if pixmap.isNull():
+            return False
+        self.hide_loading()
+        self.image_label.setPixmap(pixmap)
+        self.image_label.show()
+        return True
+    
     def show_loading(self):
         """Show the loading spinner"""
         self.is_loading = True
@@ -204,12 +470,144 @@ class ThumbnailWidget(QWidget):
 
 
 class YouTubeDownloader(QMainWindow):
-    def __init__(self):
+    def __init__(self, startup_urls=()):
         super().__init__()
-        self.history_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "download_history.json")
+        # Queued once unfinished jobs are restored
+        self.startup_urls = list(startup_urls)
+        self.history_file = os.path.join(app_data_dir(), "download_history.sqlite3")
+        self.history_store = HistoryStore(
+            self.history_file,
+            legacy_json_file=os.path.join(app_data_dir(), "download_history.json")
+        )
+        # Filled in the background after the window is shown (see load_history)
         self.download_history = []
-        self.load_history()
+        self.history_index = HistorySearchIndex()
+        self.file_index = FileIndex(self.history_store)
+        self.metadata_cache = MetadataCache(
+            os.path.join(app_data_dir(), "metadata_cache.json")
+        )
+        self.engine = create_engine()
+        self.thumbnail_cache = ThumbnailCache(
+            os.path.join(app_data_dir(), "thumbnail_cache")
+        )
+        self.settings_file = os.path.join(app_data_dir(), "settings.json")
+        self.settings = load_settings(self.settings_file)
+        self.download_archive = DownloadArchive(
+            os.path.join(app_data_dir(), "download_archive")
+        )
+        startup_profile.mark("stores and caches")
+        
+        # Merging and audio extraction run here, after the download has freed its slot
+        self.postprocess_pool = PostProcessPool(self.settings["postprocess_workers"])
+        
+        # Per-phase job timings, traced to trace.jsonl and exported as metrics.prom
+        self.metrics = JobMetrics(
+            trace_file=os.path.join(app_data_dir(), "trace.jsonl"),
+            prometheus_file=os.path.join(app_data_dir(), "metrics.prom")
+        )
+        self.metrics_server = start_metrics_server(self.metrics, self.settings["metrics_port"])
+        
+        # Queue callbacks run on worker threads; the signals hand them to the GUI thread
+        self.queue_signals = QueueSignals()
+        self.queue_signals.job_updated.connect(self.update_job_row)
+        self.queue_signals.job_finished.connect(self.download_finished)
+        self.queue_signals.collection_updated.connect(self.update_collection_status)
+        self.download_queue = DownloadQueue(
+            self.engine, self.metadata_cache,
+            max_workers=self.settings["max_concurrent_downloads"],
+            per_host_limit=self.settings["per_host_limit"],
+            host_limits=self.settings["host_limits"],
+            on_job_updated=self.queue_signals.job_updated.emit,
+            on_job_finished=self.queue_signals.job_finished.emit,
+            on_collection_updated=self.queue_signals.collection_updated.emit,
+            # Unfinished jobs live next to the history so they survive a restart or crash
+            job_store=JobStore(self.history_file),
+            max_retries=self.settings["max_retries"],
+            retry_base_delay=self.settings["retry_base_delay"],
+            retry_max_delay=self.settings["retry_max_delay"],
+            archive=self.download_archive,
+            bandwidth=scheduler_from_settings(self.settings),
+            concurrent_fragments=self.settings["concurrent_fragments"],
+            postprocessor=self.postprocess_pool,
+            metrics=self.metrics,
+            staging=staging_from_settings(self.settings)
+        )
+        # With cluster_port set, worker nodes can take single videos off this machine
+        self.coordinator = start_coordinator(
+            self.settings,
+            on_job_updated=self.queue_signals.job_updated.emit,
+            on_job_finished=self.queue_signals.job_finished.emit
+        )
+        self.job_items = {}  # job id -> QTreeWidgetItem in the queue view
+        self.current_job_id = None
+        startup_profile.mark("download queue")
         self.init_ui()
+        startup_profile.mark("window built")
+        # Everything else waits until the event loop runs, so the window paints first
+        QTimer.singleShot(0, self.finish_startup)
+    
+    def finish_startup(self):
+        """Restore unfinished jobs and start loading the history (after the window is shown)"""
+        if self.download_archive.is_new:
+            # Before any job runs, so restored and new jobs see what was already
+            # downloaded; jobs added meanwhile wait unchecked until it is done
+            self.download_queue.hold_new_jobs()
+            self.tasks.submit(
+                "seed-archive", self.seed_archive,
+                on_result=lambda added: self.start_queue(),
+                on_error=lambda error: self.start_queue()
+            )
+        else:
+            self.start_queue()
+        if not self.settings["preview_temp_removed"]:
+            self.tasks.submit(
+                "remove-temp", self.remove_preview_temp, os.path.join(app_data_dir(), "temp"),
+                on_result=self.preview_temp_removed
+            )
+        self.load_history()
+    
+    def remove_preview_temp(self, cancel_token, temp_dir):
+        """Delete the preview thumbnails older versions saved in temp/ (runs on a worker thread)
+
+        Only their files are removed, and the folder only if that leaves it
+        empty: with PORYGON_HOME it may be a folder of the user's.
+        """
+        try:
+            names = os.listdir(temp_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith("_thumbnail.jpg") or (name.startswith("history_thumbnail_") and name.endswith(".jpg")):
+                try:
+                    os.remove(os.path.join(temp_dir, name))
+                except OSError:
+                    pass
+        try:
+            os.rmdir(temp_dir)
+        except OSError:
+            pass  # not empty
+    
+    def preview_temp_removed(self, result):
+        self.settings["preview_temp_removed"] = True
+        save_settings(self.settings_file, self.settings)
+    
+    def seed_archive(self, cancel_token):
+        """Fill a new download archive from the whole history (runs on a worker thread)"""
+        return self.download_archive.import_history(self.history_store.load())
+    
+    def start_queue(self):
+        """Restore unfinished jobs, then let new ones in and queue the URLs from the command line"""
+        self.download_queue.restore()
+        self.download_queue.release_new_jobs()
+        if self.startup_urls:
+            try:
+                self.add_urls(self.startup_urls)
+            except ValueError as e:
+                QMessageBox.warning(self, "Input Error", str(e))
+    
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        startup_profile.mark("first paint")
         
     def init_ui(self):
         self.setWindowTitle("Porygon")
@@ -226,21 +624,46 @@ class YouTubeDownloader(QMainWindow):
         history_label.setFont(QFont("Arial", 12, QFont.Weight.Bold))
         history_layout.addWidget(history_label)
         
-        self.history_list = QListWidget()
+        # Filters apply on every keystroke; the index answers in milliseconds
+        self.history_search = QLineEdit()
+        self.history_search.setPlaceholderText("Search titles and URLs")
+        self.history_search.setClearButtonEnabled(True)
+        self.history_search.textChanged.connect(self.filter_history)
+        history_layout.addWidget(self.history_search)
+        
+        history_filters = QHBoxLayout()
+        self.format_filter = QComboBox()
+        self.format_filter.addItem("All formats", None)
+        self.date_filter = QComboBox()
+        self.date_filter.addItems(list(HISTORY_DATE_RANGES))
+        self.folder_filter = QComboBox()
+        self.folder_filter.addItem("All folders", None)
+        for combo in (self.format_filter, self.date_filter, self.folder_filter):
+            combo.currentIndexChanged.connect(self.filter_history)
+            history_filters.addWidget(combo)
+        history_layout.addLayout(history_filters)
+        
+        self.history_model = HistoryListModel(self.download_history)
+        self.history_list = QListView()
+        self.history_list.setModel(self.history_model)
+        self.history_list.setUniformItemSizes(True)
         self.history_list.setAlternatingRowColors(True)
         self.history_list.setMinimumWidth(250)
-        self.history_list.currentRowChanged.connect(self.display_selected_thumbnail)
+        self.history_list.selectionModel().currentRowChanged.connect(
+            lambda current, previous: self.display_selected_thumbnail(current.row())
+        )
         self.history_list.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         self.history_list.customContextMenuRequested.connect(self.show_history_context_menu)
         self.history_list.setStyleSheet("background-color: #242424;")  # Light gray
         history_layout.addWidget(self.history_list)
         
         # Add thumbnail display area
-        self.thumbnail_widget = ThumbnailWidget()
+        self.thumbnail_widget = ThumbnailWidget(thumbnail_cache=self.thumbnail_cache)
         history_layout.addWidget(self.thumbnail_widget)
         
-        # Populate history list
-        self.update_history_list()
+        self.backfill_button = QPushButton("Fetch Missing Thumbnails")
+        self.backfill_button.clicked.connect(self.backfill_thumbnails)
+        history_layout.addWidget(self.backfill_button)
         
         # Create the main content widget and layout
         content_widget = QWidget()
@@ -263,7 +686,7 @@ class YouTubeDownloader(QMainWindow):
         url_layout.addLayout(url_input_layout)
         
         # Add URL preview thumbnail
-        self.preview_thumbnail = ThumbnailWidget()
+        self.preview_thumbnail = ThumbnailWidget(thumbnail_cache=self.thumbnail_cache)
         url_layout.addWidget(self.preview_thumbnail)
         
         main_layout.addWidget(url_group)
@@ -276,12 +699,7 @@ class YouTubeDownloader(QMainWindow):
         format_layout = QHBoxLayout()
         format_layout.addWidget(QLabel("Format:"))
         self.format_combo = QComboBox()
-        self.format_combo.addItems([
-            "High Quality Video (mp4)",
-            "Medium Quality Video (mp4)",
-            "Low Quality Video (mp4)",
-            "Audio Only (mp3)"
-        ])
+        self.format_combo.addItems(FORMAT_OPTIONS)
         format_layout.addWidget(self.format_combo)
         options_layout.addLayout(format_layout)
         
@@ -298,6 +716,14 @@ class YouTubeDownloader(QMainWindow):
         output_layout.addWidget(self.browse_button)
         
         options_layout.addLayout(output_layout)
+        
+        if self.coordinator is not None:
+            self.remote_check = QCheckBox("Send to worker nodes")
+            self.remote_check.setToolTip(
+                f"Hand single videos to the workers connected on port {self.coordinator.port}; "
+                "they are saved in the worker's own output folder"
+            )
+            options_layout.addWidget(self.remote_check)
         main_layout.addWidget(options_group)
         
         # Progress information
@@ -318,6 +744,54 @@ class YouTubeDownloader(QMainWindow):
         self.download_button.clicked.connect(self.start_download)
         main_layout.addWidget(self.download_button)
         
+        # Download queue section
+        queue_group = QGroupBox("Download Queue")
+        queue_layout = QVBoxLayout(queue_group)
+        
+        self.queue_view = QTreeWidget()
+        self.queue_view.setHeaderLabels(["Title", "Format", "Status", "Progress"])
+        self.queue_view.setRootIsDecorated(False)
+        self.queue_view.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.queue_view.setColumnWidth(0, 260)
+        self.queue_view.setUniformRowHeights(True)
+        self.queue_view.setItemDelegateForColumn(3, ProgressDelegate(self.queue_view))
+        queue_layout.addWidget(self.queue_view)
+        
+        queue_controls = QHBoxLayout()
+        queue_controls.addWidget(QLabel("Parallel downloads:"))
+        self.pool_size_spin = QSpinBox()
+        self.pool_size_spin.setRange(1, 16)
+        self.pool_size_spin.setValue(self.download_queue.pool_size)
+        self.pool_size_spin.valueChanged.connect(self.set_pool_size)
+        queue_controls.addWidget(self.pool_size_spin)
+        queue_controls.addStretch()
+        
+        for label, handler in (
+            ("Pause", self.download_queue.pause),
+            ("Resume", self.download_queue.resume),
+            ("Cancel", self.download_queue.cancel),
+            ("Retry", self.download_queue.retry),
+            ("Move to Top", self.download_queue.move_to_top),
+        ):
+            button = QPushButton(label)
+            button.clicked.connect(lambda checked, handler=handler: self.apply_to_selected_jobs(handler))
+            queue_controls.addWidget(button)
+        
+        clear_button = QPushButton("Clear Finished")
+        clear_button.clicked.connect(self.clear_finished_jobs)
+        queue_controls.addWidget(clear_button)
+        
+        log_button = QPushButton("View Log")
+        log_button.clicked.connect(self.show_log)
+        queue_controls.addWidget(log_button)
+        
+        stats_button = QPushButton("Stats")
+        stats_button.clicked.connect(self.show_stats)
+        queue_controls.addWidget(stats_button)
+        
+        queue_layout.addLayout(queue_controls)
+        main_layout.addWidget(queue_group)
+        
         # Add widgets to splitter
         self.main_splitter.addWidget(self.history_panel)
         self.main_splitter.addWidget(content_widget)
@@ -328,15 +802,20 @@ class YouTubeDownloader(QMainWindow):
         # Set the central widget
         self.setCentralWidget(self.main_splitter)
         
-        # Initialize thread as None
-        self.download_thread = None
-        self.preview_thread = None
+        # Progress is polled at a fixed rate rather than signalled per update
+        self.progress_timer = QTimer()
+        self.progress_timer.timeout.connect(self.refresh_progress)
+        self.progress_timer.start(PROGRESS_REFRESH_MS)
+        
+        # Preview and thumbnail lookups run here instead of on the GUI thread
+        self.tasks = BackgroundTasks(parent=self)
         
         # Create a timer for URL changes to avoid too many thumbnail fetches
         self.url_timer = QTimer()
         self.url_timer.setSingleShot(True)
         self.url_timer.timeout.connect(self.fetch_delayed_preview)
         self.last_url = ""
+        self.preview_images = OrderedDict()  # URL -> (QImage, title), least recently used first
 
     def paste_url(self):
         clipboard = QApplication.clipboard()
@@ -352,6 +831,12 @@ class YouTubeDownloader(QMainWindow):
     def on_url_changed(self, url):
         """When URL changes, schedule a thumbnail fetch with a delay"""
         url = url.strip()
+        if is_collection_url(url):
+            # Playlists and channels are expanded when downloaded, not previewed
+            self.preview_thumbnail.clear()
+            self.preview_thumbnail.set_title("Playlist or channel: every video will be added to the queue")
+            self.last_url = url
+            return
         if url and ("youtube.com" in url or "youtu.be" in url) and url != self.last_url:
             self.last_url = url
             # Show loading immediately
@@ -363,35 +848,50 @@ class YouTubeDownloader(QMainWindow):
     def fetch_delayed_preview(self):
         """Fetch thumbnail preview after the delay"""
         url = self.url_input.text().strip()
-        if url and ("youtube.com" in url or "youtu.be" in url):
+        if url and ("youtube.com" in url or "youtu.be" in url) and not is_collection_url(url):
             self.fetch_preview(url)
     
     def fetch_preview(self, url):
-        """Fetch thumbnail preview for the URL"""
-        if self.preview_thread and self.preview_thread.isRunning():
-            # Cancel any existing preview thread
-            self.preview_thread.terminate()
-            self.preview_thread.wait()
-            
-        # Create a download thread just for thumbnail and title
-        self.preview_thread = DownloadThread(url, os.path.join(os.path.dirname(os.path.abspath(__file__)), "temp"), "")
-        self.preview_thread.thumbnail_ready.connect(self.update_preview_thumbnail)
-        self.preview_thread.start()
+        """Fetch thumbnail preview for the URL in the background"""
+        if url in self.preview_images:
+            self.preview_images.move_to_end(url)
+            self.tasks.cancel("preview")
+            self.show_preview(*self.preview_images[url])
+            return
+        # Any preview still running for a previous URL is cancelled and its result dropped
+        self.tasks.submit(
+            "preview", self.load_preview, url,
+            on_result=self.update_preview_thumbnail,
+            on_error=lambda error: self.preview_thumbnail.hide_loading()
+        )
     
-    def update_preview_thumbnail(self, thumbnail_path):
+    def load_preview(self, cancel_token, url):
+        """Get the title and decoded thumbnail for a URL (runs on a worker thread)
+
+        The thumbnail stays in memory; only downloads that are started save one to disk.
+        """
+        info = self.metadata_cache.get(url, cancel_token)
+        if not info or not info['thumbnail']:
+            return url, None, ""
+        image = decode_thumbnail(read_url(info['thumbnail'], cancel_token))
+        return url, image, info['title']
+    
+    def update_preview_thumbnail(self, preview):
         """Update the preview thumbnail when available"""
-        if thumbnail_path and os.path.exists(thumbnail_path):
-            success = self.preview_thumbnail.set_image(thumbnail_path)
-            if success:
-                # Get title using yt-dlp
-                try:
-                    title_cmd = ['yt-dlp', '--get-title', self.url_input.text().strip()]
-                    title_process = subprocess.run(title_cmd, capture_output=True, text=True)
-                    if title_process.returncode == 0:
-                        title = title_process.stdout.strip()
-                        self.preview_thumbnail.set_title(title)
-                except Exception as e:
-                    print(f"Error getting title: {e}")
+        url, image, title = preview
+        if image is not None:
+            self.preview_images[url] = (image, title)
+            while len(self.preview_images) > PREVIEW_CACHE_SIZE:
+                self.preview_images.popitem(last=False)
+        if url != self.url_input.text().strip():
+            return  # the URL changed while the preview was loading
+        self.show_preview(image, title)
+    
+    def show_preview(self, image, title):
+        if image is not None and self.preview_thumbnail.set_qimage(image):
+            self.preview_thumbnail.set_title(title)
+            return
+        self.preview_thumbnail.hide_loading()
             
     def start_download(self):
         url = self.url_input.text().strip()
@@ -403,164 +903,500 @@ class YouTubeDownloader(QMainWindow):
         output_path = self.output_path.text()
         format_option = self.format_combo.currentText()
         
-        # Disable the download button while download is in progress
-        self.download_button.setEnabled(False)
         self.progress_bar.setValue(0)
         
+        if is_collection_url(url):
+            # Entries stream into the queue while the playlist is still being read
+            self.download_queue.enqueue_collection(url, output_path, format_option)
+            return
+        
+        if self.coordinator is not None and self.remote_check.isChecked():
+            info = self.metadata_cache.peek(url)
+            job = self.coordinator.submit(url, format_option, estimated_size=estimate_download_size(info, format_option))
+            self.current_job_id = job.id
+            return
+        
+        # Playlist entries we already have are skipped; a single video is the user's call
+        duplicate = self.download_queue.find_duplicate(archive_id(url, self.metadata_cache.peek(url)), format_option)
+        if duplicate:
+            answer = QMessageBox.question(
+                self, "Already Downloaded",
+                f"{duplicate}. Download it again?"
+            )
+            if answer != QMessageBox.StandardButton.Yes:
+                return
+        
         # Show loading in the thumbnail widget
         self.thumbnail_widget.clear()
         self.thumbnail_widget.show_loading()
         
-        # Create and start the download thread
-        self.download_thread = DownloadThread(url, output_path, format_option)
-        self.download_thread.progress.connect(self.update_progress)
-        self.download_thread.finished.connect(self.download_finished)
-        self.download_thread.thumbnail_ready.connect(self.update_current_thumbnail)
-        self.download_thread.start()
-    
-    def update_current_thumbnail(self, thumbnail_path):
-        """Update the current thumbnail display during download"""
-        if thumbnail_path and os.path.exists(thumbnail_path):
-            self.thumbnail_widget.set_image(thumbnail_path)
-            if self.download_thread and hasattr(self.download_thread, 'title') and self.download_thread.title:
-                self.thumbnail_widget.set_title(self.download_thread.title)
-        
-    def update_progress(self, message):
-        self.log_output.setText(message)
-        
-        # Try to extract progress percentage if available
-        if '[download]' in message and '%' in message:
+        # Add the download to the queue; the main progress bar follows the newest job
+        job = self.download_queue.enqueue(url, output_path, format_option, allow_duplicate=bool(duplicate))
+        self.current_job_id = job.id
+    
+    def add_urls(self, entries, format_option=None, output_path=None):
+        """Queue URLs (or headless job objects) from the command line, returning the job ids
+
+        Unlike start_download nothing is asked: videos already downloaded
+        in the format are skipped unless the entry sets allow_duplicate.
+        Raises ValueError for an invalid entry.
+        """
+        format_option = format_option or self.format_combo.currentText()
+        output_path = output_path or self.output_path.text()
+        job_ids = []
+        for entry in entries:
+            spec = parse_job_spec(json.dumps(entry) if isinstance(entry, dict) else str(entry),
+                                  format_option, output_path)
+            if spec is None:
+                continue
+            if is_collection_url(spec["url"]):
+                self.download_queue.enqueue_collection(spec["url"], spec["output"], spec["format"], spec["priority"])
+                continue
+            job = self.download_queue.enqueue(spec["url"], spec["output"], spec["format"], spec["priority"],
+                                              allow_duplicate=bool(spec.get("allow_duplicate")))
+            job_ids.append(job.id)
+        self.statusBar().showMessage(f"Added {len(entries)} URL(s) to the queue", 5000)
+        return job_ids
+    
+    def handle_instance_command(self, command):
+        """Answer a command sent over the single-instance socket"""
+        name = command["command"]
+        if name == "add":
             try:
-                percent_str = message.split('%')[0].split()[-1]
-                percent = float(percent_str)
-                self.progress_bar.setValue(int(percent))
-            except (ValueError, IndexError):
-                pass
-        
-    def download_finished(self, success, message, title, format_option, thumbnail_path):
-        self.download_button.setEnabled(True)
-        
-        if success:
-            QMessageBox.information(self, "Success", message)
-            self.progress_bar.setValue(100)
-            
-            # Add to download history
-            download_info = {
-                "title": title if title else "Unknown Title",
-                "url": self.url_input.text().strip(),
-                "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "format": format_option,
-                "path": self.output_path.text(),
-                "thumbnail": thumbnail_path if os.path.exists(thumbnail_path) else ""
-            }
-            self.download_history.append(download_info)
-            self.save_history()
-            self.update_history_list()
+                job_ids = self.add_urls(command["urls"], command.get("format"), command.get("output"))
+            except ValueError as e:
+                return {"ok": False, "error": str(e)}
+            self.bring_to_front()
+            return {"ok": True, "jobs": job_ids}
+        if name == "show":
+            self.bring_to_front()
+            return {"ok": True}
+        if name == "status":
+            jobs = list(self.download_queue.jobs.values())
+            if self.coordinator is not None:
+                jobs += list(self.coordinator.jobs.values())
+            return {"ok": True, "jobs": [
+                {"id": job.id, "url": job.url, "title": job.title, "format": job.format_option,
+                 "state": job.status, "percent": job.percent, "message": job.message}
+                for job in jobs
+            ]}
+        return {"ok": False, "error": f"unknown command {name!r}"}
+    
+    def bring_to_front(self):
+        if self.isMinimized():
+            self.showNormal()
+        self.raise_()
+        self.activateWindow()
+    
+    def update_job_row(self, job):
+        """Create or refresh the queue view row for a job"""
+        item = self.job_items.get(job.id)
+        if item is None:
+            item = QTreeWidgetItem([job.url, job.format_option, "", ""])
+            item.setData(0, Qt.ItemDataRole.UserRole, job.id)
+            self.queue_view.addTopLevelItem(item)
+            self.job_items[job.id] = item
+        
+        if job.title:
+            item.setText(0, job.title)
+        item.setToolTip(0, job.url)
+        item.setText(2, job.status)
+        item.setToolTip(2, job.message)
+        item.setData(3, Qt.ItemDataRole.UserRole, job.percent)
+        
+        if job.id == self.current_job_id:
+            self.update_current_job(job)
+    
+    def refresh_progress(self):
+        """Update the rows of jobs whose progress changed since the last tick"""
+        for job in self.download_queue.drain_progress():
+            self.update_job_row(job)
+    
+    def show_log(self):
+        """Show the raw download log, limited to the selected jobs if any"""
+        job_ids = set(self.selected_job_ids()) or None
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Download Log")
+        dialog.resize(800, 400)
+        layout = QVBoxLayout(dialog)
+        log_view = QPlainTextEdit()
+        log_view.setReadOnly(True)
+        log_view.setLineWrapMode(QPlainTextEdit.LineWrapMode.NoWrap)
+        log_view.setPlainText("\n".join(self.download_queue.log_lines(job_ids)))
+        log_view.moveCursor(log_view.textCursor().MoveOperation.End)
+        layout.addWidget(log_view)
+        dialog.exec()
+    
+    def show_stats(self):
+        """Show p50/p95 timings, bytes and speeds per job phase, refreshed while open"""
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Download Stats")
+        dialog.resize(760, 260)
+        layout = QVBoxLayout(dialog)
+        columns = ("Phase", "Count", "Errors", "p50", "p95", "Data", "Avg Speed", "Peak Speed")
+        table = QTableWidget(0, len(columns))
+        table.setHorizontalHeaderLabels(columns)
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        table.verticalHeader().setVisible(False)
+        table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        layout.addWidget(table)
+        jobs_label = QLabel()
+        layout.addWidget(jobs_label)
+        
+        def seconds(value):
+            return f"{value:.2f}s" if value is not None else "-"
+        
+        def speed(value):
+            return f"{format_bytes(value)}/s" if value else "-"
+        
+        def refresh():
+            summary = self.metrics.summary()
+            table.setRowCount(len(summary))
+            for row, (phase, stats) in enumerate(summary.items()):
+                values = (
+                    phase, str(stats['count']), str(stats['errors']),
+                    seconds(stats['p50']), seconds(stats['p95']),
+                    format_bytes(stats['bytes']) if stats['bytes'] else "-",
+                    speed(stats['avg_speed']), speed(stats['peak_speed']),
+                )
+                for column, value in enumerate(values):
+                    table.setItem(row, column, QTableWidgetItem(value))
+            counts = self.metrics.job_counts()
+            jobs_label.setText(", ".join(f"{state}: {count}" for state, count in sorted(counts.items())) or "No finished jobs yet")
+        
+        refresh()
+        timer = QTimer(dialog)
+        timer.timeout.connect(refresh)
+        timer.start(1000)
+        dialog.exec()
+    
+    def update_collection_status(self, collection):
+        """Report playlist expansion progress in the status bar and the collection's queue row"""
+        if collection.error:
+            status = f"Playlist expansion stopped after {collection.count} videos: {collection.error}"
+            self.statusBar().showMessage(status)
+        elif collection.cancelled:
+            status = f"Playlist expansion cancelled after {collection.count} videos"
+            self.statusBar().showMessage(status, 5000)
+        elif collection.done:
+            status = f"Playlist expanded: {collection.count} videos queued"
+            self.statusBar().showMessage(status, 5000)
         else:
-            QMessageBox.critical(self, "Error", message)
-            self.thumbnail_widget.hide_loading()
-            
-        # Clean up the thread
-        self.download_thread = None
+            status = f"Expanding playlist: {collection.count} videos queued..."
+            self.statusBar().showMessage(status)
         
-    def load_history(self):
-        """Load download history from JSON file"""
-        try:
-            if os.path.exists(self.history_file):
-                with open(self.history_file, 'r') as f:
-                    self.download_history = json.load(f)
-        except Exception as e:
-            print(f"Error loading history: {e}")
-            self.download_history = []
-            
-    def save_history(self):
-        """Save download history to JSON file"""
-        try:
-            with open(self.history_file, 'w') as f:
-                json.dump(self.download_history, f, indent=2)
-        except Exception as e:
-            print(f"Error saving history: {e}")
-            
-    def update_history_list(self):
-        """Update the history list widget with download history"""
-        self.history_list.clear()
+        # A row of its own while expanding, so Cancel can stop it
+        row_id = f"collection-{collection.id}"
+        item = self.job_items.get(row_id)
+        if item is None:
+            item = QTreeWidgetItem([collection.url, collection.format_option, "", ""])
+            item.setData(0, Qt.ItemDataRole.UserRole, row_id)
+            self.queue_view.addTopLevelItem(item)
+            self.job_items[row_id] = item
+        item.setToolTip(0, collection.url)
+        item.setText(2, "Expanding" if not collection.done else "Cancelled" if collection.cancelled else "Expanded")
+        item.setToolTip(2, status)
+    
+    def collection_for_row(self, row_id):
+        """The playlist expansion shown in a queue row, or None for a job's row"""
+        if isinstance(row_id, str) and row_id.startswith("collection-"):
+            return self.download_queue.collections.get(int(row_id[len("collection-"):]))
+        return None
+    
+    def update_current_job(self, job):
+        """Mirror the newest job in the main progress bar and thumbnail"""
+        if job.message:
+            self.log_output.setText(job.message)
+        self.progress_bar.setValue(int(job.percent))
+        if job.thumbnail_path and self.thumbnail_widget.is_loading and os.path.exists(job.thumbnail_path):
+            self.thumbnail_widget.set_image(job.thumbnail_path)
+            self.thumbnail_widget.set_title(job.title)
+    
+    def selected_job_ids(self):
+        return [item.data(0, Qt.ItemDataRole.UserRole) for item in self.queue_view.selectedItems()]
+    
+    def apply_to_selected_jobs(self, handler):
+        """Run a queue action (pause, resume, cancel...) on the selected jobs"""
+        for job_id in self.selected_job_ids():
+            collection = self.collection_for_row(job_id)
+            if collection is not None:
+                # Cancel stops the expansion and the videos it queued; nothing else applies
+                if handler == self.download_queue.cancel:
+                    self.download_queue.cancel_collection(collection.id)
+                continue
+            job = self.download_queue.jobs.get(job_id)
+            action = handler
+            if job is None and self.coordinator is not None:
+                # A job on a worker node: the coordinator has the same actions, except pause/resume
+                job = self.coordinator.jobs.get(job_id)
+                action = getattr(self.coordinator, handler.__name__, None)
+            if job is None or action is None:
+                continue
+            action(job_id)
+            self.update_job_row(job)
+    
+    def clear_finished_jobs(self):
+        """Remove completed, failed and cancelled jobs from the queue view"""
+        self.download_queue.remove_finished()
+        remote_jobs = {}
+        if self.coordinator is not None:
+            self.coordinator.remove_finished()
+            remote_jobs = self.coordinator.jobs
+        for job_id in list(self.job_items):
+            collection = self.collection_for_row(job_id)
+            if collection is not None and not collection.done:
+                continue
+            if job_id not in self.download_queue.jobs and job_id not in remote_jobs:
+                item = self.job_items.pop(job_id)
+                self.queue_view.takeTopLevelItem(self.queue_view.indexOfTopLevelItem(item))
+    
+    def set_pool_size(self, value):
+        self.download_queue.set_pool_size(value)
+        self.settings["max_concurrent_downloads"] = value
+        save_settings(self.settings_file, self.settings)
         
-        # Add items in reverse order (newest first)
-        for item in reversed(self.download_history):
-            list_item = QListWidgetItem(f"{item['title']}")
-            
-            # Add format tag as tooltip
-            list_item.setToolTip(f"URL: {item['url']}\nDate: {item['date']}\nFormat: {item['format']}\nPath: {item['path']}")
+    def download_finished(self, job):
+        self.update_job_row(job)
+        
+        if job.state == COMPLETED:
+            self.statusBar().showMessage(f"Downloaded {job.title}", 5000)
             
-            # Store thumbnail path as user data
-            list_item.setData(Qt.ItemDataRole.UserRole, item.get('thumbnail', ''))
+            # Add to download history; a worker's file is on its own disk
+            record = make_history_record(job)
+            if getattr(job, 'node', None):
+                record['node'] = job.node
+            record = self.history_store.append(record)
+            self.file_index.add_records([record])
+            self.history_index.add(record)
+            self.history_model.add_record(record)
+            self.update_history_facets()
+        elif job.state == FAILED:
+            # The job stays in the queue view (and the job store) so it can be retried
+            self.statusBar().showMessage(f"Download failed: {job.title or job.url}", 5000)
+        elif job.state == SKIPPED:
+            self.statusBar().showMessage(f"Skipped {job.title or job.url}: {job.message}", 5000)
             
-            # Set background color based on format
-            if "High Quality" in item['format']:
-                list_item.setText(f"🎬 {item['title']}")
-            elif "Medium Quality" in item['format']:
-                list_item.setText(f"🎬 {item['title']}")
-            elif "Low Quality" in item['format']:
-                list_item.setText(f"🎬 {item['title']}")
-            elif "Audio Only" in item['format']:
-                list_item.setText(f"🎵 {item['title']}")
-                
-            self.history_list.addItem(list_item)
+        if job.id == self.current_job_id and job.state != COMPLETED:
+            self.thumbnail_widget.hide_loading()
+    
+    def closeEvent(self, event):
+        """Stop running downloads when the window closes"""
+        self.tasks.shutdown()
+        self.download_queue.shutdown()
+        self.postprocess_pool.shutdown()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.coordinator is not None:
+            self.coordinator.stop()
+        self.metrics.close()
+        shared_pool().close()
+        self.history_store.compact()
+        super().closeEvent(event)
+        
+    def load_history(self):
+        """Load the download history in pages on a worker thread, newest first"""
+        self.tasks.submit(
+            "history", self.read_history_page, None,
+            on_result=self.history_page_loaded
+        )
+    
+    def read_history_page(self, cancel_token, before_id):
+        """Read the next page of history records (runs on a worker thread)"""
+        return self.history_store.load_page(before_id, HISTORY_PAGE_SIZE)
+    
+    def history_page_loaded(self, records):
+        """Show a page of older history records and request the next one"""
+        self.history_index.add_many(records)
+        self.history_model.add_older_records(records)
+        self.file_index.add_records(records)
+        self.update_history_facets()
+        if len(records) == HISTORY_PAGE_SIZE:
+            self.tasks.submit(
+                "history", self.read_history_page, records[-1]['id'],
+                on_result=self.history_page_loaded
+            )
+        else:
+            self.history_loaded()
+    
+    def history_loaded(self):
+        """Work that needs the whole history, once its last page is in"""
+        startup_profile.mark(f"history loaded ({len(self.download_history)} records)")
+        self.verify_history_files()
+        if startup_profile.enabled():
+            startup_profile.report(app_data_dir())
+    
+    def history_criteria(self):
+        """Keyword arguments for HistorySearchIndex.search from the search box and filters"""
+        days = HISTORY_DATE_RANGES[self.date_filter.currentText()]
+        date_from = None
+        if days is not None:
+            date_from = (datetime.date.today() - datetime.timedelta(days=days)).strftime("%Y-%m-%d")
+        return {
+            "query": self.history_search.text(),
+            "format_option": self.format_filter.currentData(),
+            "folder": self.folder_filter.currentData(),
+            "date_from": date_from,
+        }
+    
+    def filter_history(self):
+        """Show only the history records matching the search box and filters"""
+        criteria = self.history_criteria()
+        rows = self.history_index.search(**criteria)
+        self.history_model.set_filter(rows, lambda record: self.history_index.matches(record, **criteria))
+        if rows is not None:
+            self.statusBar().showMessage(f"{len(rows)} of {len(self.history_index)} downloads match", 3000)
+    
+    def update_history_facets(self):
+        """Add formats and folders seen in the history to the filter choices"""
+        for combo, values in ((self.format_filter, self.history_index.formats),
+                              (self.folder_filter, self.history_index.folders)):
+            if combo.count() - 1 == len(values):
+                continue
+            known = {combo.itemData(i) for i in range(1, combo.count())}
+            combo.blockSignals(True)
+            for value in sorted(set(values) - known):
+                combo.addItem(value or "(none)", value)
+            combo.blockSignals(False)
+    
+    def verify_history_files(self):
+        """Check in the background which downloaded files were moved or deleted"""
+        self.tasks.submit(
+            "verify-files", self.file_index.verify, list(self.download_history),
+            on_result=self.history_files_verified
+        )
+    
+    def history_files_verified(self, updates):
+        for record_id, changes in updates:
+            self.history_model.update_record(record_id, changes)
             
     def display_selected_thumbnail(self, row):
         """Display the thumbnail for the selected history item"""
-        if row >= 0:
-            item = self.history_list.item(row)
-            thumbnail_path = item.data(Qt.ItemDataRole.UserRole)
-            title = item.text()
+        record = self.history_model.record(row)
+        if record is not None:
+            thumbnail_path = record.get('thumbnail', '')
+            title = self.history_model.data(self.history_model.index(row))
             
             # Show loading first
             self.thumbnail_widget.clear()
             self.thumbnail_widget.show_loading()
             
+            cached_key = self.thumbnail_cache.key_for_url(record['thumbnail_url']) if record.get('thumbnail_url') else None
             if thumbnail_path and os.path.exists(thumbnail_path):
+                self.tasks.cancel("history-thumbnail")
                 self.thumbnail_widget.set_image(thumbnail_path)
                 self.thumbnail_widget.set_title(title)
+            elif cached_key is not None:
+                self.tasks.cancel("history-thumbnail")
+                self.thumbnail_widget.set_cached(cached_key)
+                self.thumbnail_widget.set_title(title)
             else:
                 # Try to get thumbnail from URL if we don't have one saved
-                try:
-                    for history_item in reversed(self.download_history):
-                        if history_item['title'] in title:
-                            url = history_item['url']
-                            self.fetch_thumbnail_for_history(url, row)
-                            break
-                except Exception as e:
-                    print(f"Error fetching history thumbnail: {e}")
-                    self.thumbnail_widget.hide_loading()
-    
-    def fetch_thumbnail_for_history(self, url, row):
-        """Fetch thumbnail for a history item that doesn't have one"""
+                self.fetch_thumbnail_for_history(record, row)
+    
+    def fetch_thumbnail_for_history(self, record, row):
+        """Fetch thumbnail for a history item that doesn't have one, in the background"""
+        # Selecting another row cancels the fetch for the previous one
+        self.tasks.submit(
+            "history-thumbnail", self.load_history_thumbnail, record,
+            on_result=self.history_thumbnail_loaded,
+            on_error=lambda error: self.thumbnail_widget.hide_loading()
+        )
+    
+    def load_history_thumbnail(self, cancel_token, record):
+        """Download a history item's thumbnail into the thumbnail cache (runs on a worker thread)
+
+        Returns (record, thumbnail URL, cache key); the record keeps the URL,
+        as the cached file may be evicted later.
+        """
+        thumbnail_url = self.thumbnail_url_for(record, cancel_token)
+        if not thumbnail_url:
+            return record, None, None
+        key = self.thumbnail_cache.fetch_url(thumbnail_url, shared_pool(), cancel_token)
+        if key is None:
+            return record, None, None
+        return record, thumbnail_url, key
+    
+    def thumbnail_url_for(self, record, cancel_token):
+        """Thumbnail URL of a history record, probing the video only when there's no other way"""
+        info = self.metadata_cache.peek(record['url'])
+        if info:
+            return info['thumbnail']
+        if record.get('video_id'):
+            return youtube_thumbnail_url(record['video_id'])
+        info = self.metadata_cache.get(record['url'], cancel_token)
+        return info['thumbnail'] if info else None
+    
+    def backfill_thumbnails(self):
+        """Fetch the thumbnail of every history record that has none in the background, or stop doing so"""
+        if "backfill-thumbnails" in self.tasks.current:
+            # What was fetched so far is saved by the task itself
+            self.tasks.cancel("backfill-thumbnails")
+            self.backfill_button.setText("Fetch Missing Thumbnails")
+            self.statusBar().showMessage("Stopped fetching thumbnails", 5000)
+            return
+        self.backfill_button.setText("Stop Fetching Thumbnails")
+        self.statusBar().showMessage("Fetching missing thumbnails...")
+        self.tasks.submit(
+            "backfill-thumbnails", self.fetch_missing_thumbnails, list(self.download_history),
+            on_result=self.thumbnails_backfilled,
+            on_error=lambda error: self.backfill_button.setText("Fetch Missing Thumbnails")
+        )
+    
+    def fetch_missing_thumbnails(self, cancel_token, records):
+        """Fetch missing thumbnails in parallel and save them in one history write (runs on a worker thread)
+
+        A record whose thumbnail was fetched before has its URL and isn't
+        missing, even if the cached image was evicted since (selecting it
+        fetches the image again).
+        """
+        missing = [record for record in records
+                   if not record.get('thumbnail_url')
+                   and not (record.get('thumbnail') and os.path.exists(record['thumbnail']))]
+        
+        def fetch(record):
+            try:
+                return self.load_history_thumbnail(cancel_token, record)
+            except TaskCancelled:
+                raise
+            except Exception as e:
+                print(f"Error fetching thumbnail for {record['url']}: {e}")
+                return record, None, None
+        
+        updates = []
         try:
-            thumbnail_cmd = ['yt-dlp', '--get-thumbnail', url]
-            thumbnail_process = subprocess.run(thumbnail_cmd, capture_output=True, text=True)
-            if thumbnail_process.returncode == 0:
-                thumbnail_url = thumbnail_process.stdout.strip()
-                # Download the thumbnail
-                temp_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "temp")
-                os.makedirs(temp_dir, exist_ok=True)
-                thumbnail_filename = os.path.join(temp_dir, f"history_thumbnail_{row}.jpg")
-                urllib.request.urlretrieve(thumbnail_url, thumbnail_filename)
-                
-                # Update the item and display
-                item = self.history_list.item(row)
-                item.setData(Qt.ItemDataRole.UserRole, thumbnail_filename)
-                self.thumbnail_widget.set_image(thumbnail_filename)
-                self.thumbnail_widget.set_title(item.text())
-                
-                # Update the history record
-                if row < len(self.download_history):
-                    self.download_history[-(row+1)]['thumbnail'] = thumbnail_filename
-                    self.save_history()
-            else:
-                self.thumbnail_widget.hide_loading()
-        except Exception as e:
-            print(f"Error fetching thumbnail: {e}")
+            with self.thumbnail_cache.batch(), ThreadPoolExecutor(max_workers=BACKFILL_WORKERS) as executor:
+                for record, url, key in executor.map(fetch, missing):
+                    if key:
+                        updates.append((record['id'], {'thumbnail_url': url}))
+        finally:
+            # Also when cancelled, so the next run doesn't fetch these again
+            if updates:
+                self.history_store.update_many(updates)
+        return len(missing), updates
+    
+    def thumbnails_backfilled(self, result):
+        missing, updates = result
+        self.backfill_button.setText("Fetch Missing Thumbnails")
+        self.history_files_verified(updates)
+        self.statusBar().showMessage(f"Fetched {len(updates)} of {missing} missing thumbnails", 5000)
+    
+    def history_thumbnail_loaded(self, result):
+        """Store a fetched history thumbnail and show it if its row is still selected"""
+        record, thumbnail_url, key = result
+        row = self.history_model.row_for_id(record['id'])
+        if key is None:
             self.thumbnail_widget.hide_loading()
+            return
+            
+        # Update the history record and display
+        if record.get('thumbnail_url') != thumbnail_url:
+            record['thumbnail_url'] = thumbnail_url
+            self.history_store.update(record['id'], thumbnail_url=thumbnail_url)
+        if row >= 0:
+            self.history_model.record_changed(row)
+            if self.history_list.currentIndex().row() == row:
+                self.thumbnail_widget.set_cached(key)
+                self.thumbnail_widget.set_title(self.history_model.data(self.history_model.index(row)))
 
     def show_history_context_menu(self, position):
         """Show context menu for history items"""
@@ -585,50 +1421,39 @@ class YouTubeDownloader(QMainWindow):
         elif action == youtube_action:
             self.open_youtube_link(selected_indexes[0].row())
     
+    def show_remote_file(self, history_item):
+        """Tell where a worker node saved a file, returning False for local downloads"""
+        if not history_item.get('node'):
+            return False
+        QMessageBox.information(
+            self, "Downloaded on a Worker",
+            f"This file was downloaded by {history_item['node']}:\n{history_item.get('filepath') or history_item.get('path')}"
+        )
+        return True
+    
     def open_in_finder(self, row):
         """Open the file location in Finder"""
         try:
             # Get the selected history item
-            if row < 0 or row >= len(self.download_history):
+            history_item = self.history_model.record(row)
+            if history_item is None:
+                return
+            if self.show_remote_file(history_item):
                 return
                 
-            history_item = self.download_history[-(row+1)]  # Reverse index
             download_dir = history_item.get('path', '')
-            file_title = history_item.get('title', 'video')
-            file_format = history_item.get('format', '')
-            
-            if not download_dir or not os.path.exists(download_dir):
-                QMessageBox.warning(self, "Folder Not Found", "The download folder could not be found.")
-                return
-            
-            # Determine the actual file extension based on format
-            if "Audio Only" in file_format:
-                extension = ".mp3"
-            else:
-                extension = ".mp4"
-            
-            # First try the simple case - exact filename.extension
-            file_path = os.path.join(download_dir, f"{file_title}{extension}")
+            file_path = self.file_index.locate(history_item)
+            self.history_model.record_changed(row)
             
-            # If that doesn't exist, search for a file with similar name
-            if not os.path.exists(file_path):
-                found = False
-                for file in os.listdir(download_dir):
-                    file_lower = file.lower()
-                    title_lower = file_title.lower()
-                    
-                    # Check if file contains the title and has the right extension
-                    if title_lower in file_lower and (file_lower.endswith('.mp4') or file_lower.endswith('.mp3')):
-                        file_path = os.path.join(download_dir, file)
-                        found = True
-                        break
-                
-                if not found:
-                    # Fall back to opening the directory if file not found
-                    QMessageBox.warning(self, "File Not Found", 
-                        "Could not locate the specific file. Opening download folder instead.")
-                    subprocess.run(['open', download_dir])
+            if file_path is None:
+                if not download_dir or not os.path.exists(download_dir):
+                    QMessageBox.warning(self, "Folder Not Found", "The download folder could not be found.")
                     return
+                # Fall back to opening the directory if file not found
+                QMessageBox.warning(self, "File Not Found", 
+                    "Could not locate the specific file. Opening download folder instead.")
+                subprocess.run(['open', download_dir])
+                return
             
             # Open Finder and highlight the specific file
             # The 'open -R' command reveals and highlights the file in Finder on macOS
@@ -641,37 +1466,16 @@ class YouTubeDownloader(QMainWindow):
         """Play the video using the default application"""
         try:
             # Get the selected history item
-            if row < 0 or row >= len(self.download_history):
+            history_item = self.history_model.record(row)
+            if history_item is None:
                 return
-                
-            history_item = self.download_history[-(row+1)]  # Reverse index
-            file_path = history_item.get('path', '')
-            
-            if not file_path or not os.path.exists(file_path):
-                QMessageBox.warning(self, "File Not Found", "The video file could not be found.")
+            if self.show_remote_file(history_item):
                 return
             
-            # Determine the actual file to play based on the format
-            file_title = history_item.get('title', 'video')
-            file_format = history_item.get('format', '')
-            
-            # Construct probable file name based on format
-            if "Audio Only" in file_format:
-                extension = ".mp3"
-            else:
-                extension = ".mp4"
-                
-            file_to_play = os.path.join(file_path, f"{file_title}{extension}")
+            file_to_play = self.file_index.locate(history_item)
+            self.history_model.record_changed(row)
             
-            # Check if file exists, if not try to find it
-            if not os.path.exists(file_to_play):
-                # Look for files with similar names in the directory
-                for file in os.listdir(file_path):
-                    if file_title in file and (file.endswith('.mp4') or file.endswith('.mp3')):
-                        file_to_play = os.path.join(file_path, file)
-                        break
-                        
-            if os.path.exists(file_to_play):
+            if file_to_play is not None:
                 # Open the file with the default application
                 if sys.platform == "darwin":  # macOS
                     subprocess.run(['open', file_to_play])
@@ -689,10 +1493,10 @@ class YouTubeDownloader(QMainWindow):
         """Open the original YouTube link in a web browser"""
         try:
             # Get the selected history item
-            if row < 0 or row >= len(self.download_history):
+            history_item = self.history_model.record(row)
+            if history_item is None:
                 return
                 
-            history_item = self.download_history[-(row+1)]  # Reverse index
             url = history_item.get('url', '')
             
             if not url:
@@ -700,6 +1504,7 @@ class YouTubeDownloader(QMainWindow):
                 return
             
             # Open the URL in the default web browser
+            import webbrowser
             webbrowser.open(url)
             
         except Exception as e:
@@ -707,7 +1512,16 @@ class YouTubeDownloader(QMainWindow):
 
 
 if __name__ == "__main__":
+    startup_profile.mark("imports")
     app = QApplication(sys.argv)
-    window = YouTubeDownloader()
+    startup_profile.mark("QApplication")
+    instance_server = InstanceServer()
+    if not instance_server.listen(single_instance.server_name()):
+        # Another launch started the app while this one was importing Qt
+        single_instance.forward_to_running_instance(sys.argv[1:])
+        sys.exit(0)
+    window = YouTubeDownloader(single_instance.urls_from_argv(sys.argv[1:]))
+    instance_server.handler = window.handle_instance_command
     window.show()
+    startup_profile.mark("window shown")
     sys.exit(app.exec()) 
\ No newline at end of file